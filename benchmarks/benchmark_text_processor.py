@@ -0,0 +1,80 @@
+"""Compare CPU time per page of default and fast TextProcessor engines and check their outputs are equal.
+
+    python benchmarks/benchmark_text_processor.py --num_pages 200
+    python benchmarks/benchmark_text_processor.py --cache wiki_cache.sqlite
+
+Pages are synthetic Wikipedia-like html unless a WikiParser cache is given"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from src.parsers.cache import ResponseCache
+from src.parsers.parser_utils import TextProcessor
+from src.parsers.wiki_dump import wikitext_to_html
+
+
+CONFIG = {
+    'remove_section_headers': {},
+    'remove_non_ascii_symbols': {},
+    'remove_references': {},
+    'remove_latex': {},
+    'strip_sentences': {},
+    'remove_short_sentences': {'min_len': 3},
+}
+
+WORDS = ['history', 'river', 'the', 'of', 'population', 'city', 'was', 'founded', 'in', 'century', 'Zoë', 'and', 'église']
+
+
+def make_page(num_sections=8, num_paragraphs=4, num_sentences=6):
+    """Html resembling parse API output: headers, paragraphs with links and references, styles and tables"""
+    parts = ['<div class="mw-parser-output"><style>.mw-parser-output .hatnote{font-style:italic}</style>']
+    for section in range(num_sections):
+        parts.append(f'<h2><span class="mw-headline" id="s{section}">Section {section}</span></h2>')
+        for _ in range(num_paragraphs):
+            sentences = []
+            for _ in range(num_sentences):
+                words = random.choices(WORDS, k=random.randint(5, 20))
+                words[random.randrange(len(words))] = f'<a href="/wiki/{words[0]}">{words[0]}</a>'
+                sentences.append(' '.join(words).capitalize() + f'.<sup class="reference"><a href="#c">[{random.randint(1, 99)}]</a></sup>')
+            parts.append(f"<p>{' '.join(sentences)}</p>\n")
+        parts.append('<table><tr><td>{\\displaystyle x^2}</td><td>&nbsp;cell &amp; value</td></tr></table>\n')
+    parts.append('</div>')
+    return ''.join(parts)
+
+
+def load_pages(args):
+    if not args.cache:
+        random.seed(0)
+        return [make_page() for _ in range(args.num_pages)]
+    cache = ResponseCache(args.cache)
+    pages = []
+    for title, revid in cache.keys()[:args.num_pages]:
+        content, kind = cache.get(title, revid)
+        pages.append(wikitext_to_html(content) if kind == 'wikitext' else content)
+    return pages
+
+
+def measure(processor, pages):
+    start = time.process_time()
+    outputs = [processor(page) for page in pages]
+    return (time.process_time() - start) / len(pages), outputs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_pages', type=int, default=200)
+    parser.add_argument('--cache', help='Path to WikiParser cache to take pages from')
+    args = parser.parse_args()
+
+    pages = load_pages(args)
+    default_time, default_outputs = measure(TextProcessor(CONFIG), pages)
+    fast_time, fast_outputs = measure(TextProcessor(CONFIG, engine='fast'), pages)
+
+    print(f'Pages: {len(pages)}, mean size: {sum(map(len, pages)) / len(pages) / 1024:.1f} KiB')
+    print(f'default: {default_time * 1000:.2f} ms/page')
+    print(f'fast:    {fast_time * 1000:.2f} ms/page ({default_time / fast_time:.1f}x)')
+    print(f'Outputs are identical: {default_outputs == fast_outputs}')
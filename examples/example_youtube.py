@@ -5,35 +5,69 @@ from pathlib import Path
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
-from tqdm import tqdm
-
 from src.dataset.dataset import OCRDataset
 from src.layouts.layouts import HTMLCreator
 from src.parsers.parsers import YouTubeParser
 from src.images.images import ImageCreator
-from src.layouts.config import FONTS, COLORS, BACKGROUND_IMAGES
+from src.layouts.config import FONTS, COLORS
 
 from queries import QUERIES
 
 
 arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument('-o', '--output_folder', nargs=1, default='ocr_dataset', type=str)
-output_folder = arg_parser.parse_args().output_folder[0]
+arg_parser.add_argument('-n', '--name', nargs='?', default='ocr-dataset-youtube', type=str)
+arg_parser.add_argument('-t', '--titles', nargs='?', default=20, type=int)
+arg_parser.add_argument('-p', '--processes', nargs='?', default=5, type=int)
+
+dataset_name = arg_parser.parse_args().name
+max_titles = arg_parser.parse_args().titles
+num_processes = arg_parser.parse_args().processes
 driver_path = 'chromedriver-win64/chromedriver.exe'
 
-parser = YouTubeParser(driver_path=driver_path)
-html_creator = HTMLCreator(
+html_processor_config = {
+    'get_colors': dict(
+        colors=COLORS,
+    ),
+    'get_font': dict(
+        font_size_range=(5, 45),
         fonts=FONTS,
-        text_colors=COLORS,
-        background_images=BACKGROUND_IMAGES,
-        background_colors=COLORS,
-        font_size=(5, 45),
-        top=(5, 75),
-        left=(5, 75),
-    )
-processor = ImageCreator(driver_path=driver_path)
-dataset = OCRDataset(parser=parser, html_creator=html_creator, image_processor=processor)
+    ),
+    'get_text_position': dict(
+        top_range=(5, 75),
+        left_range=(5, 75),
+    ),
+}
+image_processor_config = {
+    'random_blur': dict(
+        blur_type_values=('avg', 'median', 'gaussian'),
+        ksize_range=(3, 8),
+    ),
+}
 
-for search_query in tqdm(QUERIES, leave=False):
-    parser_args = dict(search_query=search_query)
-    data = dataset(output_folder=output_folder, data_exists_handler='complete', parser_args=parser_args)
+# Every parser process keeps one browser for all its queries
+dataset = OCRDataset(
+    driver_path=driver_path,
+    parser=YouTubeParser,
+    html_creator=HTMLCreator,
+    image_creator=ImageCreator,
+    storage_type='local',
+    storage_params={
+        'dataset_name': dataset_name,
+    },
+    parser_params={
+        'driver_path': driver_path,
+        'queries': QUERIES,
+        'max_titles': max_titles,
+    },
+)
+
+if __name__ == '__main__':
+    # Samples of one query make one batch, so every query is searched once
+    dataset(
+        text_processor_config={},
+        html_processor_config=html_processor_config,
+        image_processor_config=image_processor_config,
+        dataset_size=len(QUERIES) * max_titles,
+        num_processes=num_processes,
+        batch_size=max_titles,
+    )
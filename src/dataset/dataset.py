@@ -1,6 +1,14 @@
 import copy
+import os
+from multiprocessing import Queue
 
-from src.utils.utils import DataCreator, DatasetFactory, generate_ui_script
+from src.layouts.layouts_utils import LayoutTable
+from src.parsers.dedup import DedupIndex
+from src.parsers.parsers import TokenDownsampler
+from src.utils.manifest import Manifest
+from src.utils.scheduler import ResultCollector, make_batches
+from src.utils.storage import ShardStorage
+from src.utils.utils import DataCreator, DatasetFactory, generate_ui_script, get_sample_id
 
 
 class OCRDataset:
@@ -17,6 +25,12 @@ class OCRDataset:
             pages_subdir='pages',
             images_subdir='images',
             bbox_subdir='labels',
+            manifest_path=None,
+            parser_params=None,
+            image_creator_params=None,
+            downsampler_params=None,
+            dedup_params=None,
+            layout_table=False,
         ):
         self.dataset_name = storage_params.get('dataset_name')
         storage_cls = DatasetFactory.get_storage(storage_type)
@@ -26,11 +40,13 @@ class OCRDataset:
             storage_type=storage_type,
             storage_params=storage_params,
             subdir=texts_subdir,
+            **(parser_params or {}),
         )
         self.html_creator = html_creator(
             storage_type=storage_type,
             storage_params=storage_params,
             subdir=pages_subdir,
+            layout_table=layout_table,
         )
         self.image_creator = image_creator(
             storage_type=storage_type,
@@ -38,62 +54,203 @@ class OCRDataset:
             driver_path=driver_path,
             subdir=images_subdir,
             bbox_subdir=bbox_subdir,
+            layout_table=layout_table,
+            **(image_creator_params or {}),
+        )
+
+        self.token_downsampler = TokenDownsampler(
+            storage_type=storage_type,
+            storage_params=storage_params,
+            subdir=texts_subdir,
+            **(downsampler_params or {}),
         )
 
         self.texts_subdir = texts_subdir
         self.pages_subdir = pages_subdir
         self.images_subdir = images_subdir
         self.bbox_subdir = bbox_subdir
+        self.layout_table = layout_table
+
+        # Local datasets keep manifest inside, remote ones keep local copy and sync it to the storage
+        self.is_local = storage_type == 'local' or (storage_type == 'shard' and storage_params.get('destination', 'local') == 'local')
+        if manifest_path is None:
+            if self.is_local:
+                manifest_path = os.path.join(self.dataset_name, 'manifest.sqlite')
+            else:
+                manifest_path = f'{self.dataset_name}.manifest.sqlite'
+        self.manifest_path = manifest_path
+        self.manifest = Manifest(manifest_path)
+
+        # Near-duplicate index of parsed texts lives and is synced along with the manifest
+        self.dedup_index = None
+        if dedup_params is not None:
+            dedup_path = os.path.join(self.dataset_name, 'dedup.sqlite') if self.is_local else f'{self.dataset_name}.dedup.sqlite'
+            self.dedup_index = DedupIndex(dedup_path, **dedup_params)
+            self.parser.dedup_index = self.dedup_index
+        for creator in (self.parser, self.token_downsampler, self.html_creator, self.image_creator):
+            creator.manifest_path = manifest_path
+
+
+    def get_synced_paths(self):
+        """Local files which are kept in 'manifest' subdir of remote storage"""
+        paths = [self.manifest_path]
+        if self.dedup_index is not None:
+            paths.append(self.dedup_index.path)
+        return paths
+
+
+    def load_manifest(self):
+        """Get manifest copy from remote storage. If there is no manifest, build it from subdirs listing once"""
+        for path in self.get_synced_paths():
+            file_name = os.path.basename(path)
+            if not self.is_local and not os.path.exists(path):
+                if self.storage.check_file_exists(file_name, 'manifest'):
+                    with open(path, 'wb') as f:
+                        f.write(self.storage.read_file(file_name, 'manifest', file_type='bytes'))
+
+        if self.manifest.is_empty():
+            for subdir in (self.texts_subdir, self.pages_subdir, self.images_subdir):
+                if subdir == self.pages_subdir and self.layout_table:
+                    # Layout table keeps many samples in one shard
+                    ids = [row['id'] for row in LayoutTable(self.storage, subdir)]
+                else:
+                    ids = [get_sample_id(i) for i in self.storage.read_all(subdir)]
+                self.manifest.add_many(ids, subdir)
+
+
+    def save_manifest(self):
+        self.manifest.close()
+        if self.dedup_index is not None:
+            self.dedup_index.checkpoint()
+            self.dedup_index.close()
+        if not self.is_local:
+            self.storage.strategy = 'rewrite'
+            for path in self.get_synced_paths():
+                with open(path, 'rb') as f:
+                    content = f.read()
+                self.storage.save_file(content, os.path.basename(path), 'manifest')
 
 
-    def get_start_indeces(self, dataset_size=1000):
-        texts = self.storage.read_all(self.texts_subdir)
-        pages = self.storage.read_all(self.pages_subdir)
-        images = self.storage.read_all(self.images_subdir)
-        start_index_texts = min(len(texts), dataset_size)
-        start_index_pages = min(len(pages), dataset_size)
-        start_index_images = min(len(images), dataset_size)
-        return start_index_texts, start_index_pages, start_index_images
+    def get_pending_file_names(self, dataset_size=1000):
+        """Get input file names left for every stage. Samples with numbers beyond dataset_size are ignored"""
+        texts = self.manifest.completed(self.texts_subdir)
+        pages = self.manifest.completed(self.pages_subdir)
+        images = self.manifest.completed(self.images_subdir)
+        pending_texts = [num for num in range(dataset_size) if num not in texts]
+        pending_pages = [f'title_{num}.txt' for num in sorted(texts - pages) if num < dataset_size]
+        pending_images = [f'page_{num}.html' for num in sorted(pages - images) if num < dataset_size]
+        return pending_texts, pending_pages, pending_images
 
 
-    def __call__(self, text_processor_config, html_processor_config, image_processor_config, dataset_size=1000, delay=0.05, num_processes=5):
+    def get_size(self):
+        """Number of finished samples"""
+        return self.manifest.count(self.images_subdir)
+
+
+    def get_renders_saved(self):
+        """Number of samples which text fitting of the layouts stage brought inside the canvas"""
+        return self.manifest.count('renders_saved')
+
+
+    def get_orphans(self):
+        """Numbers of samples which have text but no page and page but no image"""
+        return {
+            self.texts_subdir: self.manifest.orphans(self.texts_subdir, self.pages_subdir),
+            self.pages_subdir: self.manifest.orphans(self.pages_subdir, self.images_subdir),
+        }
+
+
+    def downsample_texts(self, dataset_size=1000, num_processes=5, batch_size=8):
+        """Remove frequent tokens from texts which are not downsampled yet. Tokens are counted over all texts,
+        so probabilities of removal stay the same when dataset creation is resumed"""
+        texts = self.manifest.completed(self.texts_subdir)
+        downsampled = self.manifest.completed(self.token_downsampler.stage)
+        pending = [f'title_{num}.txt' for num in sorted(texts - downsampled) if num < dataset_size]
+        if not pending:
+            return []
+        file_names = [f'title_{num}.txt' for num in sorted(texts) if num < dataset_size]
+        return self.token_downsampler.downsample(file_names, pending, num_processes, batch_size)
+
+
+    def __call__(
+            self,
+            text_processor_config,
+            html_processor_config,
+            image_processor_config,
+            dataset_size=1000,
+            delay=0.05,
+            num_processes=5,
+            streaming=False,
+            queue_size=100,
+            batch_size=8,
+        ):
+        """Create dataset. Returns list of (file_name, error) for items failed at any stage.
+        remove_frequent_tokens in text_processor_config runs two-pass token downsampling after parsing"""
+        if streaming and 'remove_frequent_tokens' in text_processor_config:
+            raise ValueError('"remove_frequent_tokens" needs token counts over all texts and can\'t be used in streaming mode')
+        if streaming and isinstance(self.storage, ShardStorage) and not self.storage.shares_open_shards:
+            raise ValueError(
+                'Shards of remote destination are uploaded only when they are full or closed, so streaming stages '
+                'can\'t read files they are handed. Use local destination or streaming=False'
+            )
+
+        self.load_manifest()
+        pending_texts, pending_pages, pending_images = self.get_pending_file_names(dataset_size)
 
-        start_index_texts, start_index_pages, start_index_images = self.get_start_indeces(dataset_size)
-        
-        # Run dataset parsing
         text_process_params = {
             'processor_config': text_processor_config,
             'delay': delay,
         }
-        self.parser(
-            process_params=text_process_params,
-            dataset_size=dataset_size,
-            start_index=start_index_texts,
-            num_processes=num_processes,
-        )
-
-        # Put parsed texts into html template
         html_process_params = {
             'processor_config': html_processor_config,
         }
-        self.html_creator(
-            process_params=html_process_params,
-            input_data_subdir=self.texts_subdir,
-            start_index=start_index_pages,
-            num_processes=num_processes,
-        )
-
-        # Make screenshots of html pages
         image_process_params = {
             'processor_config': image_processor_config,
             'bbox_subdir': self.bbox_subdir,
         }
-        self.image_creator(
-            process_params=image_process_params,
-            input_data_subdir=self.pages_subdir,
-            start_index=start_index_images,
-            num_processes=num_processes,
-        )
+
+        if streaming:
+            # Run all stages at once passing samples through bounded queues
+            results = self.stream(
+                text_process_params,
+                html_process_params,
+                image_process_params,
+                pending_file_names=(pending_texts, pending_pages, pending_images),
+                num_processes=num_processes,
+                queue_size=queue_size,
+                batch_size=batch_size,
+            )
+        else:
+            # Run dataset parsing
+            results = self.parser(
+                process_params=text_process_params,
+                dataset_size=dataset_size,
+                num_processes=num_processes,
+                batch_size=batch_size,
+                file_names=pending_texts,
+            )
+
+            # Remove frequent tokens from parsed texts
+            if 'remove_frequent_tokens' in text_processor_config:
+                results += self.downsample_texts(dataset_size, num_processes, batch_size)
+
+            # Put parsed texts into html template
+            results += self.html_creator(
+                process_params=html_process_params,
+                input_data_subdir=self.texts_subdir,
+                num_processes=num_processes,
+                batch_size=batch_size,
+                file_names=self.get_pending_file_names(dataset_size)[1],
+            )
+
+            # Make screenshots of html pages
+            results += self.image_creator(
+                process_params=image_process_params,
+                input_data_subdir=self.pages_subdir,
+                num_processes=num_processes,
+                batch_size=batch_size,
+                file_names=self.get_pending_file_names(dataset_size)[2],
+            )
 
         # Generate py script to run streamlit UI
         ui_script = generate_ui_script(
@@ -102,3 +259,65 @@ class OCRDataset:
             texts_path=self.texts_subdir,
         )
         self.storage.save_file(ui_script, 'ui.py')
+        self.save_manifest()
+        self.storage.close()
+        return [(file_name, error) for file_name, _, error in results if error]
+
+
+    def stream(self, text_process_params, html_process_params, image_process_params, pending_file_names, num_processes=5, queue_size=100, batch_size=8):
+        """Run parser, html and image stages concurrently. Every stage has its own pool of processes,
+        file names of produced samples flow text -> html -> image through bounded queues.
+        num_processes may be a tuple with pool size of every stage"""
+        pending_texts, pending_pages, pending_images = pending_file_names
+        if isinstance(num_processes, int):
+            num_processes = (num_processes, num_processes, num_processes)
+        parser_processes, html_processes, image_processes = num_processes
+
+        texts_queue = Queue(maxsize=queue_size)
+        pages_queue = Queue(maxsize=queue_size)
+        result_queue = Queue()
+        collector = ResultCollector(result_queue)
+        collector.start()
+
+        # Start consumers first so that producers never block on a full queue for long
+        image_workers = self.image_creator.start(
+            process_params=image_process_params,
+            input_data_subdir=self.pages_subdir,
+            num_processes=image_processes,
+            input_queue=pages_queue,
+            result_queue=result_queue,
+        )
+        html_workers = self.html_creator.start(
+            process_params=html_process_params,
+            input_data_subdir=self.texts_subdir,
+            num_processes=html_processes,
+            input_queue=texts_queue,
+            output_queue=pages_queue,
+            result_queue=result_queue,
+        )
+        parser_workers = self.parser.start(
+            process_params=text_process_params,
+            num_processes=parser_processes,
+            batch_size=batch_size,
+            output_queue=texts_queue,
+            result_queue=result_queue,
+            file_names=pending_texts,
+        )
+
+        # Samples left unfinished by previous runs go downstream along with new ones
+        for batch in make_batches(pending_images, batch_size):
+            pages_queue.put(batch)
+        for batch in make_batches(pending_pages, batch_size):
+            texts_queue.put(batch)
+
+        # Stop every stage once its upstream is exhausted
+        for workers, queue, num_consumers in (
+            (parser_workers, texts_queue, html_processes),
+            (html_workers, pages_queue, image_processes),
+            (image_workers, None, 0),
+        ):
+            for pr in workers:
+                pr.join()
+            for _ in range(num_consumers):
+                queue.put(None)
+        return collector.stop()
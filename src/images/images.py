@@ -1,4 +1,3 @@
-import copy
 import sys
 from tqdm import tqdm
 from pathlib import Path
@@ -7,55 +6,156 @@ import urllib
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
-import os
-from utils.utils import DataCreator, DatasetFactory, set_driver
+from utils.utils import DataCreator, get_sample_id, set_driver
 from images.image_utils import ImageProcessor, get_yolo_bounding_box
+from images.renderers import PillowRenderer
+from layouts.assets import AssetServer, load_background_store
+from layouts.fonts import get_font_face_css
+from layouts.layouts_utils import LayoutTable, get_layout_shard, get_page_params, render_page
+
+
+JS_DIR = parent_dir / 'images' / 'js'
+ADD_STYLE_SCRIPT = "const style = document.createElement('style'); style.textContent = arguments[0]; document.head.appendChild(style);"
 
 
 class ImageCreator(DataCreator):
     """Add visual effects to image to enable OCR model recognize text in complex conditions"""
     
-    def __init__(self, storage_type, storage_params, driver_path, subdir='images', bbox_subdir=None):
+    BACKENDS = ('selenium', 'pillow')
+
+    def __init__(self, storage_type, storage_params, driver_path, subdir='images', bbox_subdir=None, backend='selenium', renderer_params=None, reuse_page=True, bg_cache_size=64 * 2**20, asset_server=False, font_dirs=None, layout_table=False):
         super().__init__(storage_type, storage_params, subdir)
+        if backend not in self.BACKENDS:
+            raise ValueError(f'backend should be one of {self.BACKENDS}, got "{backend}"')
         self.driver_path = driver_path
         self.bbox_subdir = bbox_subdir
+        self.backend = backend
+        self.renderer_params = renderer_params or {}
+        self.reuse_page = reuse_page
+        self.bg_cache_size = bg_cache_size
+        self.asset_server = asset_server
+        self.font_dirs = tuple(font_dirs or ())
+        self.layout_table = layout_table
+
+
+    def load_page(self, driver, page):
+        """Navigate browser to the page"""
+        url = "data:text/html;charset=utf-8," + urllib.parse.quote(page)
+        driver.get(url)
+
+
+    def render_selenium(self, driver, page, bbox_script=None):
+        """Open page in browser and take screenshot. Return png bytes, text box coordinates and canvas sizes"""
+        self.load_page(driver, page)
+
+        # Hide scrollbar with JavaScript
+        driver.execute_script("document.body.style.overflow = 'hidden';")
+        img = driver.get_screenshot_as_png()
+
+        coords, width, height = None, None, None
+        if bbox_script:
+            # Get bounding box coordinates and canvas sizes
+            coords = driver.execute_script(bbox_script)
+            width = driver.execute_script("return document.documentElement.scrollWidth")
+            height = driver.execute_script("return document.documentElement.scrollHeight")
+        return img, coords, width, height
+
 
+    def resolve_assets(self, params, width, height, server=None):
+        """Put url of background referenced by id into page params. Variants are taken from asset server if it runs,
+        otherwise they are read through cache of the worker and inlined"""
+        if params.get('bg_image_id'):
+            store = load_background_store(None, params['bg_store'], cache_size=self.bg_cache_size)
+            params['bg_image'] = store.get_url(params['bg_image_id'], width, height, server)
+        return params
 
-    def process(self, file_names, subdir, input_data_subdir, bbox_subdir, processor_config, storage_type, storage_params, chunk_num, **kwargs):
-        storage_cls = DatasetFactory.get_storage(storage_type)
-        storage_params_copy = copy.deepcopy(storage_params)
-        storage = storage_cls(**storage_params_copy)
+
+    def load_template(self, driver, page, font_css=''):
+        """Navigate browser to the page and add @font-face rules of served fonts"""
+        self.load_page(driver, page)
+        if font_css:
+            driver.execute_script(ADD_STYLE_SCRIPT, font_css)
+
+
+    def apply_page_params(self, driver, params, apply_script):
+        """Put params into already loaded page with one script call and take screenshot.
+        Return png bytes, text box coordinates and canvas sizes"""
+        result = driver.execute_async_script(apply_script, params)
+        img = driver.get_screenshot_as_png()
+        return img, result['coords'], result['width'], result['height']
+
+
+    def process(self, file_names, subdir, input_data_subdir, bbox_subdir, processor_config, storage_type, storage_params, chunk_num, input_queue=None, **kwargs):
+        storage = self.get_storage(storage_type, storage_params)
         processor = ImageProcessor(processor_config)
-        driver = set_driver(self.driver_path)
-        for file_name in tqdm(file_names, position=chunk_num, desc=f'Process {chunk_num}'):
-            
-            # Get html page, inject into browser and get its url
-            page = storage.read_file(file_name, input_data_subdir, file_type='text')
-            url = "data:text/html;charset=utf-8," + urllib.parse.quote(page)
-            driver.get(url)
-
-            # Hide scrollbar with JavaScript
-            driver.execute_script("document.body.style.overflow = 'hidden';")
-
-            # Take and preprocess a screenshot
-            img = driver.get_screenshot_as_png()
-            img = processor(img, bytes_like=True)
-
-            # Save image
-            num = int(file_name.split('_')[1].split('.')[0])
-            img_name = f'image_{num}'
-            storage.save_file(img, f'{img_name}.png', subdir)
-
-            if bbox_subdir:
-                # Get bounding box coordinates and canvas sizes
-                js_script_path = os.path.join('src', 'images', 'js', 'get_bbox_coords.js')
-                with open(js_script_path, 'r') as f:
-                    js_script = f.read()
-                coords = driver.execute_script(js_script)
-                width = driver.execute_script("return document.documentElement.scrollWidth")
-                height = driver.execute_script("return document.documentElement.scrollHeight")
-
-                # Calculate bounding box in YOLO format and
-                # save under the image name for ultralytics dataset consistency
-                coords_yolo = get_yolo_bounding_box(coords, width, height)
-                storage.save_file(coords_yolo, f'{img_name}.txt', bbox_subdir)
+        table = LayoutTable(storage, input_data_subdir)
+        driver = None
+        server = None
+        if self.backend == 'pillow':
+            renderer = PillowRenderer(**self.renderer_params)
+        else:
+            driver = set_driver(self.driver_path)
+            bbox_script = (JS_DIR / 'get_bbox_coords.js').read_text()
+            apply_script = (JS_DIR / 'apply_page_params.js').read_text()
+            page_loaded = False
+            viewport = None
+            font_css = ''
+            if self.asset_server:
+                # Every worker serves assets to its browser, which keeps them in its cache between samples
+                server = AssetServer().start()
+                font_css = get_font_face_css(self.font_dirs, server.get_url) if self.font_dirs else ''
+
+        try:
+            for file_name in tqdm(self.iter_file_names(file_names, input_queue), position=chunk_num, desc=f'Process {chunk_num}'):
+                num = get_sample_id(file_name)
+                if self.layout_table:
+                    # Page is made from params only if browser has to load it
+                    params = table.get(num, get_layout_shard(file_name))
+                    page = None
+                else:
+                    page = storage.read_file(file_name, input_data_subdir, file_type='text')
+                    params = None
+
+                # Render page and preprocess the image
+                if self.backend == 'pillow':
+                    params = self.resolve_assets(params or get_page_params(page), renderer.width, renderer.height)
+                    img, coords = renderer(params)
+                    width, height = renderer.width, renderer.height
+                    img = processor(img, bytes_like=False)
+                else:
+                    if params is None:
+                        try:
+                            params = get_page_params(page)
+                        except ValueError:
+                            # Pages made before params were embedded are rendered with full navigation
+                            pass
+
+                    # Background referenced by id and served fonts are only put into the page by script
+                    if params is None or not (self.reuse_page or params.get('bg_image_id') or server is not None):
+                        img, coords, width, height = self.render_selenium(driver, page or render_page(params), bbox_script if bbox_subdir else None)
+                    else:
+                        if params.get('bg_image_id') and viewport is None:
+                            viewport = driver.execute_script('return [window.innerWidth, window.innerHeight]')
+                        params = self.resolve_assets(params, *(viewport or (None, None)), server)
+                        # Template is loaded once, later samples only update its content
+                        if not page_loaded or not self.reuse_page:
+                            self.load_template(driver, page or render_page(params), font_css)
+                            page_loaded = True
+                        img, coords, width, height = self.apply_page_params(driver, params, apply_script)
+                    img = processor(img, bytes_like=True)
+
+                # Save image
+                img_name = f'image_{num}'
+                storage.save_file(img, f'{img_name}.png', subdir)
+
+                if bbox_subdir:
+                    # Calculate bounding box in YOLO format and
+                    # save under the image name for ultralytics dataset consistency
+                    coords_yolo = get_yolo_bounding_box(coords, width, height)
+                    storage.save_file(coords_yolo, f'{img_name}.txt', bbox_subdir)
+                self.emit(f'{img_name}.png')
+        finally:
+            if driver is not None:
+                driver.quit()
+            if server is not None:
+                server.stop()
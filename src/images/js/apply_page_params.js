@@ -0,0 +1,41 @@
+// Update already loaded base.html page with new text and layout params,
+// wait for fonts and background, then return bbox and canvas sizes in one call
+const [params, done] = arguments;
+const body = document.body;
+const el = document.getElementById('Text');
+
+body.style.overflow = 'hidden';
+body.style.backgroundImage = params.bg_image ? `url("${params.bg_image}")` : 'none';
+body.style.backgroundColor = params.bg_color;
+body.style.fontFamily = params.font;
+body.style.color = params.text_color;
+body.style.fontSize = `${params.font_size}px`;
+el.style.top = `${params.top}%`;
+el.style.left = `${params.left}%`;
+el.style.backgroundColor = params.text_highlight_color;
+el.style.padding = `${params.highlight_padding_height || 0}px ${params.highlight_padding_width || 0}px`;
+el.style.borderRadius = `${params.highlight_rounding || 0}px`;
+el.textContent = params.text;
+
+// Force layout so the new font starts loading before waiting for it
+el.getBoundingClientRect();
+const ready = [document.fonts.ready];
+if (params.bg_image) {
+    const img = new Image();
+    img.src = params.bg_image;
+    ready.push(img.decode().catch(() => null));
+}
+
+Promise.all(ready).then(() => requestAnimationFrame(() => requestAnimationFrame(() => {
+    const rect = el.getBoundingClientRect();
+    done({
+        coords: {
+            top: rect.top,
+            left: rect.left,
+            width: rect.width,
+            height: rect.height
+        },
+        width: document.documentElement.scrollWidth,
+        height: document.documentElement.scrollHeight
+    });
+})));
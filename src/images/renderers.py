@@ -0,0 +1,108 @@
+import base64
+from functools import lru_cache
+from io import BytesIO
+import urllib.request
+
+from PIL import Image, ImageDraw
+
+from src.layouts.assets import cover
+from src.layouts.fonts import load_font
+
+
+@lru_cache(maxsize=32)
+def load_bg_image(url):
+    """Open background image from data url or remote url"""
+    if url.startswith('data:'):
+        content = base64.b64decode(url.split(',', 1)[1])
+    else:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            content = response.read()
+    return Image.open(BytesIO(content)).convert('RGB')
+
+
+def wrap_words(words, font, max_width):
+    """Greedily break words into lines not wider than max_width. Too long words take a line of their own"""
+    lines = []
+    line = ''
+    for word in words:
+        candidate = f'{line} {word}' if line else word
+        if line and font.getlength(candidate) > max_width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+    return lines
+
+
+class PillowRenderer:
+    """Draw page straight from HTMLProcessor params with Pillow, without browser.
+    Follows the layout rules of base.html, so text box matches the one Chrome renders"""
+
+    def __init__(self, width=800, height=600, font_dirs=None):
+        self.width = width
+        self.height = height
+        self.font_dirs = tuple(font_dirs or ())
+
+
+    def layout(self, params):
+        """Get font, text lines, padding and text box coordinates in px"""
+        font = load_font(params['font'], int(params['font_size']), self.font_dirs)
+        padding_height = int(params.get('highlight_padding_height') or 0)
+        padding_width = int(params.get('highlight_padding_width') or 0)
+        ascent, descent = font.getmetrics()
+        line_height = ascent + descent
+
+        # Absolutely positioned box shrinks to fit its text, but not wider than the space right of its left edge
+        words = params['text'].split()
+        center_x = params['left'] / 100 * self.width
+        center_y = params['top'] / 100 * self.height
+        available_width = max(0, self.width - center_x - 2 * padding_width)
+        max_content_width = font.getlength(' '.join(words))
+        min_content_width = max((font.getlength(word) for word in words), default=0)
+        content_width = min(max(min_content_width, available_width), max_content_width)
+        lines = wrap_words(words, font, content_width)
+
+        # Box is centered around (top, left) like translate(-50%, -50%) does
+        box_width = content_width + 2 * padding_width
+        box_height = len(lines) * line_height + 2 * padding_height
+        coords = {
+            'top': round(center_y - box_height / 2),
+            'left': round(center_x - box_width / 2),
+            'width': round(box_width),
+            'height': box_height,
+        }
+        return {
+            'font': font,
+            'lines': lines,
+            'line_height': line_height,
+            'padding': (padding_height, padding_width),
+            'coords': coords,
+        }
+
+
+    def __call__(self, params):
+        """Render page into RGB image. Return image and text box coordinates"""
+        if params.get('bg_image'):
+            img = cover(load_bg_image(params['bg_image']), self.width, self.height)
+        else:
+            img = Image.new('RGB', (self.width, self.height), params['bg_color'])
+        draw = ImageDraw.Draw(img)
+
+        layout = self.layout(params)
+        coords = layout['coords']
+        padding_height, padding_width = layout['padding']
+        if params.get('text_highlight_color'):
+            draw.rounded_rectangle(
+                (coords['left'], coords['top'], coords['left'] + coords['width'] - 1, coords['top'] + coords['height'] - 1),
+                radius=int(params.get('highlight_rounding') or 0),
+                fill=params['text_highlight_color'],
+            )
+
+        x = coords['left'] + padding_width
+        y = coords['top'] + padding_height
+        for line in layout['lines']:
+            draw.text((x, y), line, font=layout['font'], fill=params['text_color'], anchor='la')
+            y += layout['line_height']
+        return img, coords
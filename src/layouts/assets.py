@@ -0,0 +1,258 @@
+import base64
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import json
+import os
+from threading import Thread
+import urllib.parse
+
+from PIL import Image
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+# Headless Chrome window and PillowRenderer canvas
+DEFAULT_SIZES = ((800, 600),)
+
+
+def cover(img, width, height):
+    """Scale image to cover the canvas and crop it around the center, like CSS background-size: cover"""
+    scale = max(width / img.width, height / img.height)
+    resized = img.resize((max(width, round(img.width * scale)), max(height, round(img.height * scale))))
+    left = (resized.width - width) // 2
+    top = (resized.height - height) // 2
+    return resized.crop((left, top, left + width, top + height))
+
+
+class LRUCache:
+    """In-memory cache of byte strings, least recently used ones are evicted above max_bytes"""
+
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+
+    def put(self, key, value):
+        if key in self.items:
+            self.size -= len(self.items.pop(key))
+        if len(value) > self.max_bytes:
+            return
+        self.items[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.size -= len(evicted)
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+class AssetRequestHandler(SimpleHTTPRequestHandler):
+    """Serve files of folders registered in the server. Paths look like /<folder key>/<file name>"""
+
+    def translate_path(self, path):
+        key, _, file_name = urllib.parse.unquote(urllib.parse.urlsplit(path).path).lstrip('/').partition('/')
+        root = self.server.dirs.get(key)
+        if root is None or not file_name:
+            return ''
+        path = os.path.realpath(os.path.join(root, file_name))
+        # Files outside of registered folders are not found
+        return path if path.startswith(root + os.sep) else ''
+
+
+    def end_headers(self):
+        # Assets never change during a run, so browser keeps them in its cache and doesn't ask again.
+        # Pages are opened from data urls, fonts need CORS header to load from another origin
+        self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        super().end_headers()
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AssetServer:
+    """Static file server of local asset folders running in a daemon thread, so browser loads
+    backgrounds and fonts by url instead of parsing them inlined into every page"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.dirs = {}
+        self.server = None
+
+
+    def add_dir(self, path):
+        """Register folder to serve, return its key in urls"""
+        path = os.path.realpath(path)
+        key = hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]
+        self.dirs[key] = path
+        return key
+
+
+    def get_url(self, path):
+        """Url of local file, its folder gets served"""
+        dir_name, file_name = os.path.split(os.path.realpath(path))
+        return f'http://{self.host}:{self.port}/{self.add_dir(dir_name)}/{urllib.parse.quote(file_name)}'
+
+
+    def start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), AssetRequestHandler)
+        self.server.daemon_threads = True
+        self.server.dirs = self.dirs
+        self.port = self.server.server_address[1]
+        Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.1}, daemon=True).start()
+        return self
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class BackgroundStore:
+    """Background images preprocessed once: every image of images_dir is resized to cover each of sizes,
+    cropped and recompressed to JPEG. index.json of store_dir maps image ids to their sources,
+    so pages keep only the id and workers read small variants through byte-bounded cache"""
+
+    def __init__(self, images_dir, store_dir=None, sizes=DEFAULT_SIZES, quality=85, cache_size=64 * 2**20):
+        if images_dir is None and store_dir is None:
+            raise ValueError('One should provide either "images_dir" or "store_dir"')
+        self.images_dir = images_dir
+        self.store_dir = store_dir or os.path.join(images_dir, '.store')
+        self.sizes = tuple(tuple(size) for size in sizes)
+        self.quality = quality
+        self.index_path = os.path.join(self.store_dir, 'index.json')
+        self.images = {}
+        self.cache = LRUCache(cache_size)
+
+
+    @property
+    def ids(self):
+        return sorted(self.images)
+
+
+    def get_variant_path(self, image_id, size):
+        width, height = size
+        return os.path.join(self.store_dir, f'{image_id}_{width}x{height}.jpg')
+
+
+    def iter_sources(self):
+        """Yield (image_id, file name, stat) of source images. Ids are stable for file names"""
+        for file_name in sorted(os.listdir(self.images_dir)):
+            path = os.path.join(self.images_dir, file_name)
+            if file_name.startswith('.') or not file_name.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(path):
+                continue
+            image_id = hashlib.sha1(file_name.encode('utf-8')).hexdigest()[:16]
+            yield image_id, file_name, os.stat(path)
+
+
+    def make_variants(self, image_id, file_name):
+        with Image.open(os.path.join(self.images_dir, file_name)) as img:
+            img = img.convert('RGB')
+            for size in self.sizes:
+                buffer = BytesIO()
+                cover(img, *size).save(buffer, format='JPEG', quality=self.quality, optimize=True)
+                # Variant is written under temporary name first, so readers never see a partial file
+                path = self.get_variant_path(image_id, size)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(buffer.getvalue())
+                os.replace(tmp_path, path)
+
+
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path, 'r') as f:
+            return json.load(f)
+
+
+    def build(self):
+        """Make variants of new and changed images and drop ones of removed images. Unchanged images are skipped"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        index = self.read_index() or {}
+        settings = {'sizes': [list(size) for size in self.sizes], 'quality': self.quality}
+        cached = index.get('images', {}) if index.get('settings') == settings else {}
+
+        images = {}
+        for image_id, file_name, stat in self.iter_sources():
+            entry = {'source': file_name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            variants_exist = all(os.path.exists(self.get_variant_path(image_id, size)) for size in self.sizes)
+            if cached.get(image_id) != entry or not variants_exist:
+                try:
+                    self.make_variants(image_id, file_name)
+                except OSError:
+                    # Files which are not images are skipped
+                    continue
+            images[image_id] = entry
+
+        for file_name in os.listdir(self.store_dir):
+            if file_name.endswith('.jpg') and file_name.split('_')[0] not in images:
+                os.remove(os.path.join(self.store_dir, file_name))
+
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'settings': settings, 'images': images}, f)
+        os.replace(tmp_path, self.index_path)
+        self.images = images
+        return self
+
+
+    def load(self):
+        """Read index built before, or build it if there is none"""
+        index = self.read_index()
+        if index is None:
+            if self.images_dir is None:
+                raise FileNotFoundError(f'Background store {self.store_dir} has no index')
+            return self.build()
+        self.images = index['images']
+        self.sizes = tuple(tuple(size) for size in index['settings']['sizes'])
+        return self
+
+
+    def choose_size(self, width, height):
+        """Smallest variant covering the canvas, or the largest one if none does"""
+        covering = [size for size in self.sizes if size[0] >= width and size[1] >= height]
+        if covering:
+            return min(covering, key=lambda size: size[0] * size[1])
+        return max(self.sizes, key=lambda size: size[0] * size[1])
+
+
+    def read(self, image_id, width, height):
+        """JPEG bytes of the image variant for the canvas"""
+        size = self.choose_size(width, height)
+        key = (image_id, size)
+        content = self.cache.get(key)
+        if content is None:
+            with open(self.get_variant_path(image_id, size), 'rb') as f:
+                content = f.read()
+            self.cache.put(key, content)
+        return content
+
+
+    def get_url(self, image_id, width, height, server=None):
+        """Url of the image variant for the canvas. Variant is inlined as data url unless it is served by asset server"""
+        if server is not None:
+            return server.get_url(self.get_variant_path(image_id, self.choose_size(width, height)))
+        return f"data:image/jpeg;base64,{base64.b64encode(self.read(image_id, width, height)).decode('utf-8')}"
+
+
+@lru_cache(maxsize=None)
+def load_background_store(images_dir, store_dir=None, sizes=DEFAULT_SIZES, quality=85, cache_size=64 * 2**20):
+    """Background store of the process, its index is read once"""
+    return BackgroundStore(images_dir, store_dir, sizes, quality, cache_size).load()
@@ -0,0 +1,68 @@
+from functools import lru_cache
+import logging
+import os
+
+from matplotlib import font_manager
+from PIL import ImageFont
+
+
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+# matplotlib warns on every family it can't find, missing fonts are expected here
+logging.getLogger('matplotlib.font_manager').setLevel(logging.ERROR)
+
+
+def normalize_family(family):
+    """Make font family comparable: 'Times New Roman' -> 'timesnewroman'"""
+    return ''.join(ch for ch in family.split(',')[0].strip('"\' ').lower() if ch.isalnum())
+
+
+@lru_cache(maxsize=None)
+def index_font_dirs(font_dirs=()):
+    """Map normalized family names and file names of fonts in font_dirs to their paths"""
+    index = {}
+    for font_dir in font_dirs:
+        for root, _, file_names in os.walk(font_dir):
+            for file_name in sorted(file_names):
+                if not file_name.lower().endswith(FONT_EXTENSIONS):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    family, style = ImageFont.truetype(path, 10).getname()
+                except OSError:
+                    continue
+                # Prefer regular style of the family, keep file name as a fallback key
+                if style in ('Regular', 'Book', 'Roman') or normalize_family(family) not in index:
+                    index[normalize_family(family)] = path
+                index.setdefault(normalize_family(os.path.splitext(file_name)[0]), path)
+    return index
+
+
+@lru_cache(maxsize=None)
+def get_font_path(family, font_dirs=()):
+    """Find font file for CSS font family. Fonts from font_dirs go first,
+    then system fonts. Unknown families fall back to the default sans-serif font"""
+    path = index_font_dirs(font_dirs).get(normalize_family(family))
+    if path is None:
+        properties = font_manager.FontProperties(family=[family.split(',')[0].strip('"\' ')])
+        path = font_manager.findfont(properties, fallback_to_default=True)
+    return path
+
+
+@lru_cache(maxsize=1024)
+def load_font(family, size, font_dirs=()):
+    """Load font of size in px, which matches CSS font-size"""
+    return ImageFont.truetype(get_font_path(family, font_dirs), size)
+
+
+def get_font_face_css(font_dirs, get_url):
+    """@font-face rules for families of fonts in font_dirs, so browser loads them by url.
+    Family is bound to the same file PillowRenderer takes for it"""
+    font_dirs = tuple(font_dirs)
+    index = index_font_dirs(font_dirs)
+    rules = {}
+    for path in sorted(set(index.values())):
+        family = ImageFont.truetype(path, 10).getname()[0]
+        font_path = index.get(normalize_family(family), path)
+        rules.setdefault(family, f'@font-face {{ font-family: "{family}"; src: url("{get_url(font_path)}"); }}')
+    return '\n'.join(rules.values())
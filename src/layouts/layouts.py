@@ -1,43 +1,109 @@
-import copy
 import sys
 from tqdm import tqdm
 from pathlib import Path
 
+import numpy as np
+
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
-from jinja2 import Environment, FileSystemLoader
-from layouts.layouts_utils import HTMLProcessor
-from utils.utils import DataCreator, DatasetFactory
+from layouts.layouts_utils import HTMLProcessor, LayoutTable, batch_to_params, get_layout_name, render_page
+from layouts.text_fit import TextFitter
+from utils.utils import DataCreator, get_sample_id
 
 
 class HTMLCreator(DataCreator):
-    """Wrap text with html pages"""
+    """Wrap text with html pages. With layout_table, text and layout params of samples are saved
+    as rows of JSONL shards instead, and pages are made by the image stage when they are rendered.
+    Rows are buffered for the worker's lifetime, shard is saved when it has shard_size rows or the worker is done.
+    Samples are passed on with the shard name, so the next stage reads it without listing the storage"""
     
-    def __init__(self, storage_type, storage_params, subdir='pages'):
+    def __init__(self, storage_type, storage_params, subdir='pages', layout_table=False, shard_size=1000, seed=None, params_batch_size=256):
         super().__init__(storage_type, storage_params, subdir)
+        self.layout_table = layout_table
+        self.shard_size = shard_size
+        self.seed = seed
+        self.params_batch_size = params_batch_size
+        self.layout_params = None
+        self.text_fitter = None
+        self.table = None
+        self.rows = []
+        self.shard_name = None
+
+
+    def start(self, process_params, *args, **kwargs):
+        HTMLProcessor(process_params.get('processor_config')).build_assets()
+        return super().start(process_params, *args, **kwargs)
+
+
+    def iter_layout_params(self, processor, chunk_num):
+        """Yield layout params of pages drawn params_batch_size at once. With seed every worker has its own sequence"""
+        rng = np.random.default_rng(None if self.seed is None else [self.seed, chunk_num])
+        while True:
+            yield from batch_to_params(processor.sample_batch(self.params_batch_size, rng))
+
+
+    def report_renders_saved(self):
+        """Add renders saved by text fitting since the last report to 'renders_saved' count of the manifest"""
+        if self.text_fitter is not None and self.text_fitter.renders_saved and self.manifest is not None:
+            self.manifest.add_count('renders_saved', self.text_fitter.renders_saved)
+            self.text_fitter.renders_saved = 0
+
+
+    def add_row(self, row):
+        """Buffer row of the current item, its output is named after the shard the row goes to"""
+        if not self.rows:
+            self.shard_name = self.table.new_shard_name(row['id'])
+        self.rows.append(row)
+        if self.work_items is not None:
+            self.work_items.add_output(get_layout_name(row['id'], self.shard_name))
+        if len(self.rows) >= self.shard_size:
+            self.save_rows()
+
+
+    def save_rows(self):
+        """Save buffered rows as one shard, then pass their samples on"""
+        if not self.rows:
+            return
+        self.table.write(self.rows, self.shard_name)
+        self.pass_on([get_layout_name(row['id'], self.shard_name) for row in self.rows])
+        self.rows = []
+
+
+    def finish(self):
+        if self.table is not None:
+            self.save_rows()
 
 
-    def process(self, file_names, subdir, input_data_subdir, processor_config, storage_type, storage_params, chunk_num, **kwargs):
-        storage_cls = DatasetFactory.get_storage(storage_type)
-        storage_params_copy = copy.deepcopy(storage_params)
-        storage = storage_cls(**storage_params_copy)
-        env = Environment(
-            loader=FileSystemLoader('src/layouts/templates')
-        )
-        processor = HTMLProcessor(processor_config)
+    def process(self, file_names, subdir, input_data_subdir, processor_config, storage_type, storage_params, chunk_num, input_queue=None, **kwargs):
+        storage = self.get_storage(storage_type, storage_params)
+        if self.layout_params is None:
+            # Params left from the batch drawn before a failure are used by the next items of the worker
+            self.layout_params = self.iter_layout_params(HTMLProcessor(processor_config), chunk_num)
+        if self.text_fitter is None and 'fit_text' in processor_config:
+            # Text box is measured before rendering, and text is moved or made smaller to stay inside the canvas
+            self.text_fitter = TextFitter(**(processor_config['fit_text'] or {}))
+        if self.table is None:
+            self.table = LayoutTable(storage, subdir)
 
-        template = env.get_template('base.html')
-        for file_name in tqdm(file_names, position=chunk_num, desc=f'Process {chunk_num}'):
+        try:
+            for file_name in tqdm(self.iter_file_names(file_names, input_queue), position=chunk_num, desc=f'Process {chunk_num}'):
 
-            # Get text file to place into template
-            text = storage.read_file(file_name, input_data_subdir, file_type='text')
+                # Get text file to place into template
+                text = storage.read_file(file_name, input_data_subdir, file_type='text')
+                html_params = next(self.layout_params)
+                if self.text_fitter is not None:
+                    html_params = self.text_fitter(html_params, text)
+                num = get_sample_id(file_name)
 
-            # Render template
-            html_params = processor({})
-            html_page = template.render(text=text, **html_params)
+                if self.layout_table:
+                    self.add_row({'id': num, 'text': text, **html_params})
+                    continue
 
-            # Save page
-            num = int(file_name.split('_')[1].split('.')[0])
-            page_name = f'page_{num}.html'
-            storage.save_file(html_page, page_name, subdir)
+                # Render template and save page
+                html_page = render_page({'text': text, **html_params})
+                page_name = f'page_{num}.html'
+                storage.save_file(html_page, page_name, subdir)
+                self.emit(page_name)
+        finally:
+            self.report_renders_saved()
@@ -1,12 +1,187 @@
-import base64
 from collections import OrderedDict
-import os
+from functools import lru_cache
+import json
 import random
+import re
+import uuid
+
+from jinja2 import Environment, FileSystemLoader
+import numpy as np
+from PIL import ImageColor
 
 from src.utils.utils import BaseProcessor
+from src.layouts.assets import DEFAULT_SIZES, BackgroundStore, load_background_store
 from src.layouts.config import FONTS, COLORS
 
 
+PARAMS_PATTERN = re.compile(r"<script id='Params' type=\"application/json\">(.*?)</script>", re.DOTALL)
+HIGHLIGHT_SIZE_PARAMS = ('highlight_padding_height', 'highlight_padding_width', 'highlight_rounding')
+
+
+def dump_page_params(text, params):
+    """Serialize text and layout params to embed them into the page for renderers without browser"""
+    # Escape '</' so text can't close the script tag
+    return json.dumps({'text': text, **params}).replace('</', '<\\/')
+
+
+def get_page_params(page):
+    """Get text and layout params embedded into the page by HTMLCreator"""
+    match = PARAMS_PATTERN.search(page)
+    if match is None:
+        raise ValueError('Page has no embedded params, it should be created with HTMLCreator')
+    return json.loads(match.group(1))
+
+
+@lru_cache(maxsize=None)
+def get_relative_luminance(color):
+    """Relative luminance of CSS color as defined by WCAG"""
+    channels = np.array(ImageColor.getrgb(color)[:3]) / 255
+    linear = np.where(channels <= 0.03928, channels / 12.92, ((channels + 0.055) / 1.055) ** 2.4)
+    return float(linear @ [0.2126, 0.7152, 0.0722])
+
+
+def get_contrast_ratio(color1, color2):
+    """WCAG contrast ratio of two colors, from 1 to 21"""
+    luminances = sorted((get_relative_luminance(color1), get_relative_luminance(color2)))
+    return (luminances[1] + 0.05) / (luminances[0] + 0.05)
+
+
+@lru_cache(maxsize=None)
+def get_contrast_table(colors1, colors2):
+    """Contrast ratios of colors1 x colors2"""
+    luminances1 = np.array([get_relative_luminance(color) for color in colors1])[:, None]
+    luminances2 = np.array([get_relative_luminance(color) for color in colors2])[None, :]
+    return (np.maximum(luminances1, luminances2) + 0.05) / (np.minimum(luminances1, luminances2) + 0.05)
+
+
+@lru_cache(maxsize=None)
+def get_color_pairs(colors, min_contrast=None):
+    """Indices of (background, text) colors which differ and have contrast ratio of at least min_contrast"""
+    colors_array = np.array(colors)
+    valid = colors_array[:, None] != colors_array[None, :]
+    if min_contrast:
+        valid &= get_contrast_table(colors, colors) >= min_contrast
+    pairs = np.argwhere(valid)
+    if not len(pairs):
+        raise ValueError(f'There is no pair of different colors with contrast ratio of at least {min_contrast}')
+    return pairs
+
+
+def batch_to_params(batch):
+    """Turn structured array of HTMLProcessor.sample_batch into dicts like HTMLProcessor.__call__ returns"""
+    names = batch.dtype.names
+    params_list = []
+    for row in batch.tolist():
+        params = dict(zip(names, row))
+        if 'bg_image_id' in params and not params['bg_image_id']:
+            del params['bg_image_id'], params['bg_store']
+        if 'text_highlight_color' in params and not params['text_highlight_color']:
+            params.update(dict.fromkeys(HIGHLIGHT_SIZE_PARAMS, ''))
+        params_list.append(params)
+    return params_list
+
+
+@lru_cache(maxsize=None)
+def get_template(name='base.html'):
+    env = Environment(
+        loader=FileSystemLoader('src/layouts/templates')
+    )
+    return env.get_template(name)
+
+
+def render_page(params):
+    """Put text and layout params, like ones get_page_params returns, into html template"""
+    layout_params = {key: value for key, value in params.items() if key != 'text'}
+    return get_template().render(text=params['text'], params_json=dump_page_params(params['text'], layout_params), **layout_params)
+
+
+def get_layout_name(num, shard_name):
+    """File name passed to the next stage for the sample kept in layout table, it tells the shard of the sample"""
+    return f'layout_{num}.{shard_name}'
+
+
+def get_layout_shard(file_name):
+    """Shard of the sample named by get_layout_name, None for other names like layout_1.json or page_1.html"""
+    shard_name = file_name.partition('.')[2]
+    return shard_name if shard_name.endswith('.jsonl') else None
+
+
+class LayoutTable:
+    """Text and layout params of samples kept as rows in JSONL shards of storage subdir, instead of html pages.
+    Shard of the sample is read directly if it is known, otherwise shards are indexed by sample ids on a miss.
+    Recently read shards are kept in memory"""
+
+    def __init__(self, storage, subdir, cache_shards=4):
+        self.storage = storage
+        self.subdir = subdir
+        self.cache_shards = cache_shards
+        self.index = {}
+        self.indexed_shards = set()
+        self.shards = OrderedDict()
+
+
+    @staticmethod
+    def new_shard_name(first_id):
+        return f'layouts_{first_id}_{uuid.uuid4().hex[:8]}.jsonl'
+
+
+    def write(self, rows, shard_name=None):
+        """Save rows with 'id', 'text' and layout params as a new shard. Returns shard name"""
+        shard_name = shard_name or self.new_shard_name(rows[0]['id'])
+        self.storage.save_file(''.join(f'{json.dumps(row)}\n' for row in rows), shard_name, self.subdir)
+        return shard_name
+
+
+    def read_shard(self, shard_name):
+        rows = self.shards.get(shard_name)
+        if rows is None:
+            content = self.storage.read_file(shard_name, self.subdir, file_type='text')
+            rows = {row['id']: row for row in map(json.loads, content.splitlines()) if row}
+            self.shards[shard_name] = rows
+            if len(self.shards) > self.cache_shards:
+                self.shards.popitem(last=False)
+        else:
+            self.shards.move_to_end(shard_name)
+        return rows
+
+
+    def add_shard(self, shard_name):
+        if shard_name not in self.indexed_shards:
+            for num in self.read_shard(shard_name):
+                self.index[num] = shard_name
+            self.indexed_shards.add(shard_name)
+
+
+    def refresh(self):
+        """Index shards written since the last refresh. Storage subdir is listed, so it's done only for samples
+        which come without their shard, e.g. ones left by previous runs"""
+        for shard_name in sorted(self.storage.read_all(self.subdir)):
+            if shard_name.endswith('.jsonl'):
+                self.add_shard(shard_name)
+
+
+    def get(self, num, shard_name=None):
+        """Text and layout params of the sample, like get_page_params returns them"""
+        if num not in self.index:
+            if shard_name is not None:
+                self.add_shard(shard_name)
+            else:
+                self.refresh()
+        if num not in self.index:
+            raise KeyError(f'Sample {num} is not found in layout table {self.subdir}')
+        row = dict(self.read_shard(self.index[num])[num])
+        row.pop('id')
+        return row
+
+
+    def __iter__(self):
+        """Yield all rows, e.g. to look at the distribution of layout params"""
+        for shard_name in sorted(self.storage.read_all(self.subdir)):
+            if shard_name.endswith('.jsonl'):
+                content = self.storage.read_file(shard_name, self.subdir, file_type='text')
+                yield from (json.loads(line) for line in content.splitlines() if line)
+
+
 class HTMLProcessor(BaseProcessor):
 
     def __init__(self, config):
@@ -18,45 +193,75 @@ class HTMLProcessor(BaseProcessor):
             'get_text_position': self.get_text_position,
             'get_highlight_params': self.get_highlight_params,
         })
+        self.batch_methods = OrderedDict({
+            'get_bg_image': self.sample_bg_images,
+            'get_colors': self.sample_colors,
+            'get_font': self.sample_fonts,
+            'get_text_position': self.sample_text_positions,
+            'get_highlight_params': self.sample_highlight_params,
+        })
 
     
     def __call__(self, obj={}):
         return super().__call__(obj)
 
 
-    def get_bg_image(self, params, bg_images, proba=0.5):
-        """Set background image"""
+    def sample_batch(self, n, seed=None):
+        """Draw layout params of n pages at once with numpy generator (or seed of a new one), following the config.
+        Returns structured array with a field per param, batch_to_params turns it into dicts"""
+        rng = np.random.default_rng(seed)
+        columns = {}
+        for method_name, method in self.batch_methods.items():
+            if method_name in self.config:
+                method(columns, n, rng, **(self.config.get(method_name) or {}))
+
+        batch = np.empty(n, dtype=[(name, column.dtype) for name, column in columns.items()])
+        for name, column in columns.items():
+            batch[name] = column
+        return batch
+
+
+    def build_assets(self):
+        """Preprocess background images of the config once, before workers start"""
+        params = (self.config or {}).get('get_bg_image') or {}
+        if isinstance(params.get('bg_images'), str):
+            BackgroundStore(
+                params['bg_images'],
+                params.get('store_dir'),
+                params.get('sizes', DEFAULT_SIZES),
+                params.get('quality', 85),
+            ).build()
+
+
+    def get_bg_image(self, params, bg_images, proba=0.5, store_dir=None, sizes=DEFAULT_SIZES, quality=85):
+        """Set background image. Images of local folder are referenced by id in background store,
+        page gets the image when it is rendered"""
         is_bg_image = random.uniform(0, 1) < proba
+        bg_image_url = ""
         if is_bg_image and bg_images:
             if isinstance(bg_images, str):
                 # Treat bg_images like local path to bg images
-                bg_name = random.choice(os.listdir(bg_images))
-                bg_path = os.path.join(bg_images, bg_name)
-                with open(bg_path, "rb") as image_file:
-                    encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-                bg_image_url = f"data:image/jpeg;base64,{encoded_string}"
+                store = load_background_store(bg_images, store_dir, tuple(tuple(size) for size in sizes), quality)
+                if store.ids:
+                    params['bg_image_id'] = random.choice(store.ids)
+                    params['bg_store'] = store.store_dir
             elif isinstance(bg_images, list):
                 # If bg_images is a list of urls
                 bg_image_url = random.choice(bg_images)
             else:
                 raise TypeError('bg_images should be "None", "str" or "list"')
-        else:
-            bg_image_url = ""
 
         params['bg_image'] = bg_image_url
         return params
 
 
-    def get_colors(self, params, colors=COLORS):
-        """Set text and background colors"""
-        bg_color = random.choice(colors)
-
-        text_color = random.choice(colors)
-        while bg_color == text_color:
-            text_color = random.choice(colors)
+    def get_colors(self, params, colors=COLORS, min_contrast=None):
+        """Set text and background colors. They differ and have contrast ratio of at least min_contrast"""
+        pairs = get_color_pairs(tuple(colors), min_contrast)
+        bg_index, text_index = pairs[random.randrange(len(pairs))]
 
-        params['bg_color'] = bg_color
-        params['text_color'] = text_color
+        params['bg_color'] = colors[bg_index]
+        params['text_color'] = colors[text_index]
         return params
 
 
@@ -74,17 +279,20 @@ class HTMLProcessor(BaseProcessor):
         return params
 
 
-    def get_highlight_params(self, params, colors=COLORS, proba=0.5, highlight_padding_range=(1, 30), highlight_rounding_range=(1, 15)):
-        """Set highlight color, size and rounding"""
+    def get_highlight_params(self, params, colors=COLORS, proba=0.5, highlight_padding_range=(1, 30), highlight_rounding_range=(1, 15), min_contrast=None):
+        """Set highlight color, size and rounding. Highlight color differs from text and background colors
+        and has contrast ratio of at least min_contrast with text color"""
         is_text_highlighted = random.uniform(0, 1) < proba
-        if is_text_highlighted:
-            text_highlight_color = random.choice(colors)
-            while text_highlight_color == params['bg_color'] or text_highlight_color == params['text_color']:
-                text_highlight_color = random.choice(colors)
-
+        candidates = [
+            color for color in colors
+            if color not in (params['bg_color'], params['text_color'])
+            and (not min_contrast or get_contrast_ratio(color, params['text_color']) >= min_contrast)
+        ]
+        if is_text_highlighted and candidates:
+            text_highlight_color = random.choice(candidates)
             highlight_padding_height=random.randint(*highlight_padding_range)
             highlight_padding_width=random.randint(*highlight_padding_range)
-            highlight_rounding=random.randint(*highlight_rounding_range),
+            highlight_rounding=random.randint(*highlight_rounding_range)
         else:
             text_highlight_color = ""
             highlight_padding_height = ""
@@ -96,3 +304,66 @@ class HTMLProcessor(BaseProcessor):
         params['highlight_padding_width'] = highlight_padding_width
         params['highlight_rounding'] = highlight_rounding
         return params
+
+
+    def sample_bg_images(self, columns, n, rng, bg_images, proba=0.5, store_dir=None, sizes=DEFAULT_SIZES, quality=85):
+        """Batch version of get_bg_image"""
+        is_bg_image = rng.random(n) < proba
+        urls = np.full(n, '', dtype=object)
+        if is_bg_image.any() and bg_images:
+            if isinstance(bg_images, str):
+                store = load_background_store(bg_images, store_dir, tuple(tuple(size) for size in sizes), quality)
+                ids = np.full(n, '', dtype=object)
+                stores = np.full(n, '', dtype=object)
+                if store.ids:
+                    ids[is_bg_image] = np.array(store.ids, dtype=object)[rng.integers(len(store.ids), size=is_bg_image.sum())]
+                    stores[is_bg_image] = store.store_dir
+                columns['bg_image_id'] = ids
+                columns['bg_store'] = stores
+            elif isinstance(bg_images, list):
+                urls[is_bg_image] = np.array(bg_images, dtype=object)[rng.integers(len(bg_images), size=is_bg_image.sum())]
+            else:
+                raise TypeError('bg_images should be "None", "str" or "list"')
+        columns['bg_image'] = urls
+
+
+    def sample_colors(self, columns, n, rng, colors=COLORS, min_contrast=None):
+        """Batch version of get_colors, pairs are drawn from the table of valid ones"""
+        pairs = get_color_pairs(tuple(colors), min_contrast)
+        colors_array = np.array(colors, dtype=object)
+        bg_indices, text_indices = pairs[rng.integers(len(pairs), size=n)].T
+        columns['bg_color'] = colors_array[bg_indices]
+        columns['text_color'] = colors_array[text_indices]
+
+
+    def sample_fonts(self, columns, n, rng, font_size_range=(10, 50), fonts=FONTS):
+        """Batch version of get_font"""
+        columns['font'] = np.array(fonts, dtype=object)[rng.integers(len(fonts), size=n)]
+        columns['font_size'] = rng.integers(*font_size_range, size=n, endpoint=True)
+
+
+    def sample_text_positions(self, columns, n, rng, top_range=(5, 75), left_range=(5, 75)):
+        """Batch version of get_text_position"""
+        columns['top'] = rng.integers(*top_range, size=n, endpoint=True)
+        columns['left'] = rng.integers(*left_range, size=n, endpoint=True)
+
+
+    def sample_highlight_params(self, columns, n, rng, colors=COLORS, proba=0.5, highlight_padding_range=(1, 30), highlight_rounding_range=(1, 15), min_contrast=None):
+        """Batch version of get_highlight_params. Not highlighted pages get empty color and zero sizes"""
+        colors_array = np.array(colors, dtype=object)
+        valid = (colors_array != columns['bg_color'][:, None]) & (colors_array != columns['text_color'][:, None])
+        if min_contrast:
+            text_colors, text_indices = np.unique(columns['text_color'].astype(str), return_inverse=True)
+            valid &= get_contrast_table(tuple(text_colors), tuple(colors))[text_indices] >= min_contrast
+
+        # Every page takes k-th of its valid colors with k drawn uniformly
+        cumulative = valid.cumsum(axis=1)
+        counts = cumulative[:, -1]
+        k = (rng.random(n) * counts).astype(int)
+        choices = np.minimum((cumulative <= k[:, None]).sum(axis=1), len(colors) - 1)
+        is_text_highlighted = (rng.random(n) < proba) & (counts > 0)
+
+        columns['text_highlight_color'] = np.where(is_text_highlighted, colors_array[choices], '').astype(object)
+        columns['highlight_padding_height'] = rng.integers(*highlight_padding_range, size=n, endpoint=True) * is_text_highlighted
+        columns['highlight_padding_width'] = rng.integers(*highlight_padding_range, size=n, endpoint=True) * is_text_highlighted
+        columns['highlight_rounding'] = rng.integers(*highlight_rounding_range, size=n, endpoint=True) * is_text_highlighted
@@ -0,0 +1,139 @@
+from functools import lru_cache
+import math
+
+from src.layouts.fonts import load_font
+
+
+class GlyphMetrics:
+    """Advances of characters and line height of the font of given size in px, measured on first use and cached.
+    Fonts are hinted, so advances are measured for every size instead of scaling ones of a single size"""
+
+    def __init__(self, family, font_size, font_dirs=()):
+        self.font = load_font(family, font_size, font_dirs)
+        ascent, descent = self.font.getmetrics()
+        self.line_height = ascent + descent
+        self.advances = {}
+
+
+    def get_width(self, text):
+        """Width of one line of text in px"""
+        advances = self.advances
+        width = 0
+        for char in text:
+            advance = advances.get(char)
+            if advance is None:
+                advance = advances[char] = self.font.getlength(char)
+            width += advance
+        return width
+
+
+@lru_cache(maxsize=None)
+def get_glyph_metrics(family, font_size, font_dirs=()):
+    return GlyphMetrics(family, font_size, font_dirs)
+
+
+def count_lines(word_widths, space_width, max_width):
+    """Number of lines of greedy word wrapping, like wrap_words of PillowRenderer gives"""
+    lines = 0
+    line_width = None
+    for width in word_widths:
+        if line_width is not None and line_width + space_width + width <= max_width:
+            line_width += space_width + width
+        else:
+            lines += 1
+            line_width = width
+    return lines
+
+
+class TextFitter:
+    """Estimate text box of the page before it is rendered, following layout rules of base.html like PillowRenderer,
+    but with cached glyph metrics instead of drawing. Text which would go out of the canvas is moved inside it,
+    or made smaller if it doesn't fit at all. renders_saved counts samples that would have been clipped"""
+
+    def __init__(self, width=800, height=600, font_dirs=None, margin=2, min_font_size=8, max_iterations=10):
+        self.width = width
+        self.height = height
+        self.font_dirs = tuple(font_dirs or ())
+        self.margin = margin
+        self.min_font_size = min_font_size
+        self.max_iterations = max_iterations
+        self.renders_saved = 0
+        self.not_fitted = 0
+
+
+    def measure(self, params, text):
+        """Estimated text box coordinates in px, like PillowRenderer.layout returns them"""
+        metrics = get_glyph_metrics(params['font'], int(params['font_size']), self.font_dirs)
+        padding_height = int(params.get('highlight_padding_height') or 0)
+        padding_width = int(params.get('highlight_padding_width') or 0)
+
+        word_widths = [metrics.get_width(word) for word in text.split()]
+        space_width = metrics.get_width(' ')
+        center_x = params['left'] / 100 * self.width
+        center_y = params['top'] / 100 * self.height
+        available_width = max(0, self.width - center_x - 2 * padding_width)
+        max_content_width = sum(word_widths) + space_width * max(0, len(word_widths) - 1)
+        min_content_width = max(word_widths, default=0)
+        content_width = min(max(min_content_width, available_width), max_content_width)
+
+        box_width = content_width + 2 * padding_width
+        if content_width == max_content_width:
+            # Text narrower than available width takes one line, partial sums of word widths may differ in last digits
+            lines = 1 if word_widths else 0
+        else:
+            lines = count_lines(word_widths, space_width, content_width)
+        box_height = lines * metrics.line_height + 2 * padding_height
+        return {
+            'top': center_y - box_height / 2,
+            'left': center_x - box_width / 2,
+            'width': box_width,
+            'height': box_height,
+        }
+
+
+    def fits(self, coords):
+        return (
+            coords['left'] >= self.margin and coords['top'] >= self.margin
+            and coords['left'] + coords['width'] <= self.width - self.margin
+            and coords['top'] + coords['height'] <= self.height - self.margin
+        )
+
+
+    def get_center_range(self, box_size, canvas_size):
+        """Range of integer percents of box center which keep the box inside the canvas"""
+        half = box_size / 2 + self.margin
+        return math.ceil(100 * half / canvas_size), math.floor(100 * (canvas_size - half) / canvas_size)
+
+
+    def __call__(self, params, text):
+        """Get params with text inside the canvas. Params of text which fits already are returned as is"""
+        coords = self.measure(params, text)
+        if self.fits(coords):
+            return params
+
+        params = dict(params)
+        for _ in range(self.max_iterations):
+            min_left, max_left = self.get_center_range(coords['width'], self.width)
+            min_top, max_top = self.get_center_range(coords['height'], self.height)
+            if min_left <= max_left and min_top <= max_top:
+                # Box is small enough, move its center inside the canvas
+                params['left'] = min(max(params['left'], min_left), max_left)
+                params['top'] = min(max(params['top'], min_top), max_top)
+            elif params['font_size'] > self.min_font_size:
+                # Scale font down to the canvas, box size is roughly proportional to it
+                scale = min(
+                    (self.width - 2 * self.margin) / max(coords['width'], 1),
+                    (self.height - 2 * self.margin) / max(coords['height'], 1),
+                )
+                font_size = min(int(params['font_size'] * scale), int(params['font_size']) - 1)
+                params['font_size'] = max(self.min_font_size, font_size)
+            else:
+                break
+
+            coords = self.measure(params, text)
+            if self.fits(coords):
+                self.renders_saved += 1
+                return params
+
+        self.not_fitted += 1
+        return params
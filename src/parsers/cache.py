@@ -0,0 +1,96 @@
+import time
+import zlib
+
+from src.utils.sqlite_utils import ProcessConnection
+
+
+class ResponseCache:
+    """SQLite store of zlib-compressed page contents keyed by (title, revid).
+    Least recently used pages are evicted when compressed contents exceed max_size bytes.
+    kind tells how content should be read: 'html' from parse API or 'wikitext'"""
+
+    def __init__(self, path, max_size=1 << 30, evict_every=100, compress_level=6, timeout=60):
+        self.path = path
+        self.max_size = max_size
+        self.evict_every = evict_every
+        self.compress_level = compress_level
+        self.timeout = timeout
+        self.num_puts = 0
+        self.db = ProcessConnection(path, setup=self.create_tables, timeout=timeout)
+
+
+    @staticmethod
+    def create_tables(connection):
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'title TEXT NOT NULL, revid INTEGER NOT NULL, kind TEXT NOT NULL, content BLOB NOT NULL, '
+            'size INTEGER NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (title, revid))'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)')
+        connection.commit()
+
+
+    @property
+    def connection(self):
+        return self.db.get()
+
+
+    def put(self, title, revid, content, kind='html'):
+        blob = zlib.compress(content.encode('utf-8'), self.compress_level)
+        with self.connection as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                (title, revid, kind, blob, len(blob), time.time()),
+            )
+        self.num_puts += 1
+        if self.num_puts % self.evict_every == 0:
+            self.evict()
+
+
+    def get(self, title, revid=None):
+        """Get (content, kind) of the page, the latest cached revision if revid is None. None if page isn't cached"""
+        if revid is None:
+            query = 'SELECT revid, kind, content FROM pages WHERE title = ? ORDER BY revid DESC LIMIT 1'
+            row = self.connection.execute(query, (title,)).fetchone()
+        else:
+            query = 'SELECT revid, kind, content FROM pages WHERE title = ? AND revid = ?'
+            row = self.connection.execute(query, (title, revid)).fetchone()
+        if row is None:
+            return None
+        revid, kind, blob = row
+        with self.connection as connection:
+            connection.execute('UPDATE pages SET accessed = ? WHERE title = ? AND revid = ?', (time.time(), title, revid))
+        return zlib.decompress(blob).decode('utf-8'), kind
+
+
+    def keys(self):
+        """(title, revid) of all cached pages in insertion order"""
+        return self.connection.execute('SELECT title, revid FROM pages ORDER BY rowid').fetchall()
+
+
+    def size(self):
+        """Size of compressed contents in bytes"""
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+
+    def evict(self):
+        """Delete least recently used pages until the cache fits into max_size"""
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return
+        keys = []
+        for title, revid, size in self.connection.execute('SELECT title, revid, size FROM pages ORDER BY accessed'):
+            keys.append((title, revid))
+            excess -= size
+            if excess <= 0:
+                break
+        with self.connection as connection:
+            connection.executemany('DELETE FROM pages WHERE title = ? AND revid = ?', keys)
+
+
+    def close(self):
+        self.db.close()
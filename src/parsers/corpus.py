@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+NEWLINE = ord('\n')
+
+
+def build_offsets(path, chunk_size=1 << 26):
+    """Get (start, end) byte offsets of non-empty lines of the file, reading it chunk by chunk.
+    end points to the line break, so record is file[start:end]"""
+    starts = []
+    ends = []
+    with open(path, 'rb') as f:
+        position = 0
+        line_start = 0
+        while chunk := f.read(chunk_size):
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == NEWLINE) + position
+            if len(newlines):
+                starts.append(np.concatenate(([line_start], newlines[:-1] + 1)))
+                ends.append(newlines)
+                line_start = int(newlines[-1]) + 1
+            position += len(chunk)
+        if line_start < position:
+            # Last line without line break
+            starts.append([line_start])
+            ends.append([position])
+
+    if not starts:
+        return np.empty((0, 2), dtype=np.int64)
+    offsets = np.stack([np.concatenate(starts), np.concatenate(ends)], axis=1).astype(np.int64)
+    return offsets[offsets[:, 1] > offsets[:, 0]]
+
+
+def get_index_path(path, index_dir=None):
+    """Index is kept next to the corpus file, or in index_dir under the name unique for the file path"""
+    if index_dir is None:
+        return f'{path}.offsets.npy'
+    path_hash = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(index_dir, f'{os.path.basename(path)}-{path_hash}.offsets.npy')
+
+
+def load_offsets(path, index_dir=None):
+    """Load offsets index of the file memory-mapped, building it once. Index is rebuilt when the file changes"""
+    index_path = get_index_path(path, index_dir)
+    meta_path = f'{index_path[:-len(".npy")]}.json'
+    stat = os.stat(path)
+    meta = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    cached_meta = None
+    if os.path.exists(index_path) and os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            cached_meta = json.load(f)
+    if cached_meta != meta:
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        # Index is written under temporary name first, so readers never see a partial file
+        tmp_path = f'{index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, build_offsets(path))
+        os.replace(tmp_path, index_path)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+    return np.load(index_path, mmap_mode='r')
@@ -0,0 +1,126 @@
+import hashlib
+import re
+
+import numpy as np
+
+from src.utils.sqlite_utils import ProcessConnection
+
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+class MinHasher:
+    """MinHash signatures of texts over character n-grams of lowercased text with collapsed whitespace.
+    Hashers with the same num_perm and seed give comparable signatures in any process"""
+
+    def __init__(self, num_perm=64, ngram=5, seed=1):
+        self.num_perm = num_perm
+        self.ngram = ngram
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = generator.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+
+    def get_shingles(self, text):
+        text = WHITESPACE_PATTERN.sub(' ', text.lower()).strip()
+        if len(text) <= self.ngram:
+            return {text}
+        return {text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)}
+
+
+    def __call__(self, text):
+        """Get signature as array of num_perm uint32 values"""
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little') for shingle in self.get_shingles(text)),
+            dtype=np.uint64,
+        )
+        # Universal hashing (a * x + b) mod p, products wrap around like in datasketch
+        permuted = (hashes[:, None] * self.a + self.b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class DedupIndex:
+    """MinHash LSH index of emitted texts in SQLite, shared by all processes and kept alongside the dataset.
+    Signature is split into bands, texts sharing any band hash are candidates, and candidate is a duplicate
+    if estimated Jaccard similarity of character n-grams reaches threshold.
+    Lookup and insertion run in one write transaction, so two workers never emit the same text"""
+
+    def __init__(self, path, num_perm=64, bands=16, threshold=0.8, ngram=5, seed=1, timeout=60):
+        if num_perm % bands:
+            raise ValueError(f'num_perm should be divisible by bands, got {num_perm} and {bands}')
+        self.path = path
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.timeout = timeout
+        self.hasher = MinHasher(num_perm, ngram, seed)
+        self.db = ProcessConnection(path, setup=self.create_tables, timeout=timeout, isolation_level=None)
+
+
+    @staticmethod
+    def create_tables(connection):
+        connection.execute('CREATE TABLE IF NOT EXISTS signatures (key INTEGER PRIMARY KEY, signature BLOB NOT NULL)')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS bands (hash INTEGER NOT NULL, key INTEGER NOT NULL, PRIMARY KEY (hash, key)) WITHOUT ROWID'
+        )
+
+
+    @property
+    def connection(self):
+        return self.db.get()
+
+
+    def get_band_hashes(self, signature):
+        """64-bit hash of every band of signature. Band number is hashed too, so one index serves all bands"""
+        return [
+            int.from_bytes(hashlib.blake2b(signature[i:i + self.rows].tobytes(), digest_size=8, salt=i.to_bytes(16, 'little')).digest(), 'little', signed=True)
+            for i in range(0, len(signature), self.rows)
+        ]
+
+
+    def find_duplicate(self, signature, band_hashes):
+        """Key of the most similar indexed text if it is a near-duplicate of the signature, None otherwise"""
+        values = ', '.join('?' * len(band_hashes))
+        rows = self.connection.execute(
+            f'SELECT key, signature FROM signatures WHERE key IN (SELECT key FROM bands WHERE hash IN ({values}))',
+            band_hashes,
+        ).fetchall()
+        if not rows:
+            return None
+        signatures = np.frombuffer(b''.join(blob for _, blob in rows), dtype=np.uint32).reshape(len(rows), -1)
+        similarities = (signatures == signature).mean(axis=1)
+        best = int(similarities.argmax())
+        return rows[best][0] if similarities[best] >= self.threshold else None
+
+
+    def add(self, key, text):
+        """Index text under key unless it is a near-duplicate of indexed one. Returns True if text was added"""
+        signature = self.hasher(text)
+        band_hashes = self.get_band_hashes(signature)
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            duplicate = self.find_duplicate(signature, band_hashes)
+            if duplicate is None or duplicate == key:
+                connection.execute('INSERT OR REPLACE INTO signatures VALUES (?, ?)', (key, signature.tobytes()))
+                connection.executemany('INSERT OR IGNORE INTO bands VALUES (?, ?)', [(band_hash, key) for band_hash in band_hashes])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return duplicate is None or duplicate == key
+
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM signatures').fetchone()[0]
+
+
+    def checkpoint(self):
+        """Merge write-ahead log of the workers into the main file"""
+        self.db.checkpoint()
+
+
+    def close(self):
+        self.db.close()
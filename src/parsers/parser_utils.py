@@ -1,7 +1,10 @@
+from bs4 import BeautifulSoup
 from collections import OrderedDict
+from html.entities import html5
+from html.parser import HTMLParser
 import json
-import nltk
-from nltk import FreqDist, word_tokenize
+from nltk import FreqDist
+from itertools import chain
 import random
 import re
 import sys
@@ -10,16 +13,210 @@ from pathlib import Path
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
+from parsers.tokenizers import get_tokenizer
 from utils.utils import BaseProcessor
 
 
+HEADER_TAGS = ("h2", "h3", "h4", "h5", "h6")
+# Tag sets and entities BeautifulSoup html.parser builder uses, TextExtractor follows them
+PRESERVE_WHITESPACE_TAGS = frozenset(('pre', 'textarea'))
+STRING_CONTAINER_TAGS = frozenset(('rt', 'rp', 'style', 'script', 'template'))
+EMPTY_ELEMENT_TAGS = frozenset((
+    'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed', 'frame', 'hr', 'image', 'img',
+    'input', 'isindex', 'keygen', 'link', 'menuitem', 'meta', 'nextid', 'param', 'source', 'spacer', 'track', 'wbr',
+))
+HTML_ENTITIES = {name[:-1]: character for name, character in html5.items() if name.endswith(';')}
+DECIMAL_CHARREF_PATTERN = re.compile(r'^([0-9]+)(.*)')
+HEX_CHARREF_PATTERN = re.compile(r'^([0-9a-f]+)(.*)')
+NON_ASCII_PATTERN = re.compile(r'[^\x00-\x7F]+')
+REFERENCE_PATTERN = re.compile(r'\[\d+\]')
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=\.|\?)\s+(?!")|\n+|(?<=\.)"')
+
+
+def dereference_charref(name):
+    """Get character of numeric reference &#name; and data after the number if reference wasn't terminated.
+    Follows numeric character reference end state of the HTML spec: invalid code points become U+FFFD,
+    C1 controls are taken as Windows-1252 characters"""
+    base, pattern = 10, DECIMAL_CHARREF_PATTERN
+    if name[:1] in ('x', 'X'):
+        name, base, pattern = name[1:], 16, HEX_CHARREF_PATTERN
+    extra_data = ''
+    try:
+        numeric = int(name, base)
+    except ValueError:
+        match = pattern.search(name)
+        if match is None:
+            return '', name
+        numeric, extra_data = int(match.group(1), base), match.group(2)
+
+    if numeric == 0 or numeric > 0x10ffff or 0xd800 <= numeric <= 0xdfff:
+        return '\ufffd', extra_data
+    if 0x80 <= numeric <= 0x9f:
+        try:
+            return bytes((numeric,)).decode('cp1252'), extra_data
+        except UnicodeDecodeError:
+            pass
+    return chr(numeric), extra_data
+
+
+def iter_split(pattern, text):
+    """Lazy version of pattern.split(text) for patterns without groups and empty matches"""
+    position = 0
+    for match in pattern.finditer(text):
+        yield text[position:match.start()]
+        position = match.end()
+    yield text[position:]
+
+
+class TextExtractor(HTMLParser):
+    """Streaming html to text conversion without building a tree.
+    Gives the same text as BeautifulSoup(html, "html.parser").get_text() with skip_tags decomposed:
+    the same tokenizer, entity handling, implicit closing of tags and whitespace collapsing are used"""
+
+    ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+    def __init__(self, skip_tags=()):
+        super().__init__(convert_charrefs=False)
+        self.skip_tags = frozenset(skip_tags)
+
+
+    def extract(self, html):
+        self.reset()
+        self.stack = []
+        self.num_skipped = 0
+        self.num_preserved = 0
+        self.containers = []
+        self.closed_empty_elements = []
+        self.current = []
+        self.parts = []
+        self.feed(html)
+        self.close()
+        self.end_data()
+        return ''.join(self.parts)
+
+
+    def end_data(self, is_text=True):
+        """Finish string collected since the last markup. Only text outside of skipped tags,
+        style, script, template and ruby annotations is kept, like get_text() does"""
+        if not self.current:
+            return
+        data = ''.join(self.current)
+        self.current = []
+        if not self.num_preserved and not data.strip(self.ASCII_SPACES):
+            data = '\n' if '\n' in data else ' '
+        if is_text and not self.containers and not self.num_skipped:
+            self.parts.append(data)
+
+
+    def pop_to(self, tag):
+        """Close the most recent open tag with the name and all tags opened after it"""
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i] == tag:
+                break
+        else:
+            return
+        for name in reversed(self.stack[i:]):
+            if name in self.skip_tags:
+                self.num_skipped -= 1
+            if name in PRESERVE_WHITESPACE_TAGS:
+                self.num_preserved -= 1
+            if self.containers and self.containers[-1] == name:
+                self.containers.pop()
+        del self.stack[i:]
+
+
+    def handle_starttag(self, tag, attrs, handle_empty_element=True):
+        self.end_data()
+        self.stack.append(tag)
+        if tag in self.skip_tags:
+            self.num_skipped += 1
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self.num_preserved += 1
+        if tag in STRING_CONTAINER_TAGS:
+            self.containers.append(tag)
+        if tag in EMPTY_ELEMENT_TAGS and handle_empty_element:
+            self.handle_endtag(tag, check_already_closed=False)
+            self.closed_empty_elements.append(tag)
+
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, handle_empty_element=False)
+        self.handle_endtag(tag, check_already_closed=False)
+
+
+    def handle_endtag(self, tag, check_already_closed=True):
+        if check_already_closed and tag in self.closed_empty_elements:
+            self.closed_empty_elements.remove(tag)
+        else:
+            self.end_data()
+            self.pop_to(tag)
+
+
+    def handle_data(self, data):
+        self.current.append(data)
+
+
+    def handle_charref(self, name):
+        dereferenced, extra_data = dereference_charref(name)
+        self.current.append(dereferenced)
+        self.current.append(extra_data)
+
+
+    def handle_entityref(self, name):
+        character = HTML_ENTITIES.get(name)
+        self.current.append(character if character is not None else f'&{name}')
+
+
+    def handle_comment(self, data):
+        self.end_data()
+
+
+    def handle_decl(self, decl):
+        self.end_data()
+
+
+    def handle_pi(self, data):
+        self.end_data()
+
+
+    def unknown_decl(self, data):
+        self.end_data()
+        if data.upper().startswith('CDATA['):
+            # CDATA is text even inside of style or script, but not inside of skipped tags
+            self.current.append(data[len('CDATA['):])
+            containers, self.containers = self.containers, []
+            self.end_data()
+            self.containers = containers
+
+
 class TextProcessor(BaseProcessor):
+    """Turn page html into sentences. Methods are applied in the order of self.methods.
+    Fast engine handles html strings in one streaming pass: text is extracted without building a tree
+    and sentence filters are fused, the output is the same as the default engine gives.
+    tokenizer is used for token counting and removal, see tokenizers.get_tokenizer"""
 
-    def __init__(self, config):
+    HTML_METHODS = ('remove_section_headers', 'extract_text')
+    TOKENIZER_METHODS = ('update_token_counts', 'remove_frequent_tokens')
+
+    FAST_METHODS = (
+        'remove_section_headers',
+        'extract_text',
+        'remove_non_ascii_symbols',
+        'remove_references',
+        'split_into_sentences',
+        'remove_latex',
+        'strip_sentences',
+        'remove_short_sentences',
+    )
+
+    def __init__(self, config, engine='default', tokenizer='nltk'):
         super().__init__(config)
+        if engine not in ('default', 'fast'):
+            raise ValueError(f'engine should be "default" or "fast", got "{engine}"')
+        self.engine = engine
+        self.tokenizer = get_tokenizer(tokenizer)
         self.token_counts = FreqDist()
         self.proba_dct = {}
-        nltk.download('punkt_tab')
         self.methods = OrderedDict({
             'remove_section_headers': self.remove_section_headers,
             'extract_text': self.extract_text,
@@ -32,6 +229,76 @@ class TextProcessor(BaseProcessor):
             'update_token_counts': self.update_token_counts,
         })
         self.necessary_methods = ['extract_text', 'split_into_sentences']
+
+
+    def ensure_resources(self, nltk_data_dir=None, methods=None):
+        """Check nltk resources of the tokenizer if any of configured methods, or the given ones, needs tokenizer"""
+        if methods is None:
+            methods = self.config or {}
+        if any(method_name in methods for method_name in self.TOKENIZER_METHODS):
+            self.tokenizer.ensure_resources(nltk_data_dir)
+
+
+    def __call__(self, obj):
+        """Process page given as soup or html string"""
+        if isinstance(obj, str):
+            if self.engine == 'fast':
+                return self.process_fast(obj)
+            obj = BeautifulSoup(obj, "html.parser")
+        return super().__call__(obj)
+
+
+    def iter_sentences(self, html):
+        """Yield sentences of html page one by one, applying configured methods from FAST_METHODS in a single pass"""
+        skip_tags = HEADER_TAGS if 'remove_section_headers' in self.config else ()
+        yield from self.iter_text_sentences(TextExtractor(skip_tags).extract(html))
+
+
+    def iter_text_sentences(self, text):
+        """Yield sentences of plain text one by one, applying configured methods from FAST_METHODS"""
+        if 'remove_non_ascii_symbols' in self.config:
+            text = text.encode('ascii', 'ignore').decode('ascii')
+        if 'remove_references' in self.config:
+            text = REFERENCE_PATTERN.sub('', text)
+
+        remove_latex = 'remove_latex' in self.config
+        strip = 'strip_sentences' in self.config
+        min_len = None
+        if 'remove_short_sentences' in self.config:
+            min_len = (self.config['remove_short_sentences'] or {}).get('min_len', 2)
+
+        for sentence in iter_split(SENTENCE_SPLIT_PATTERN, text):
+            if not sentence or remove_latex and sentence.startswith('{\\'):
+                continue
+            if strip:
+                sentence = sentence.strip()
+            if min_len is not None and len(sentence) < min_len:
+                continue
+            yield sentence
+
+
+    def process_fast(self, html):
+        return self.process_sentences(list(self.iter_sentences(html)))
+
+
+    def process_sentences(self, sentences):
+        """Apply configured methods which are not in FAST_METHODS"""
+        for method_name, method in self.methods.items():
+            if method_name not in self.FAST_METHODS and method_name in self.config:
+                sentences = method(sentences, **(self.config.get(method_name) or {}))
+        return sentences
+
+
+    def process_text(self, text):
+        """Process plain text, skipping the steps which work with html"""
+        if self.engine == 'fast':
+            return self.process_sentences(list(self.iter_text_sentences(text)))
+        for method_name, method in self.methods.items():
+            if method_name in self.HTML_METHODS:
+                continue
+            if method_name in self.config or method_name in self.necessary_methods:
+                text = method(text, **(self.config.get(method_name) or {}))
+        return text
     
 
     def save_state(self, file_name):
@@ -58,29 +325,33 @@ class TextProcessor(BaseProcessor):
     
     def update_token_counts(self, sentences):
         """Accumulate token counts"""
-        for sentence in sentences:
-            tokens = word_tokenize(sentence)
-        self.token_counts.update(tokens)
+        self.token_counts.update(chain.from_iterable(self.tokenizer.tokenize_many(sentences)))
         return sentences
 
 
     def remove_frequent_tokens(self, sentence):
         """Remove tokens based on calculated probas"""
+        return self.remove_frequent_tokens_many([sentence])[0]
+
+
+    def remove_frequent_tokens_many(self, sentences):
+        """Remove tokens from batch of sentences tokenized with one call. Sentences left empty are kept as is"""
         if not len(self.token_counts):
             raise ValueError('You must calculate probas before token removal. Use "calc_probas" first')
-        
-        # Tokenize and remove frequent tokens
-        token_lst = word_tokenize(sentence)
-        token_lst_new = [token for token in token_lst if random.random() > self.proba_dct.get(token, 0)]
-        sentence_new = ' '.join(token_lst_new)
-        sentence_new = sentence_new.strip()
 
-        return sentence_new if sentence_new else sentence
+        probas = self.proba_dct
+        detokenize = self.tokenizer.detokenize
+        sentences_new = []
+        for sentence, token_lst in zip(sentences, self.tokenizer.tokenize_many(sentences)):
+            token_lst_new = [token for token in token_lst if random.random() > probas.get(token, 0)]
+            sentence_new = detokenize(token_lst_new).strip()
+            sentences_new.append(sentence_new if sentence_new else sentence)
+        return sentences_new
 
 
     def remove_section_headers(self, soup):
         """Remove section headers"""
-        for header in soup.find_all(["h2", "h3", "h4", "h5", "h6"]):
+        for header in soup.find_all(HEADER_TAGS):
             header.decompose()
         return soup
     
@@ -90,17 +361,17 @@ class TextProcessor(BaseProcessor):
 
 
     def remove_non_ascii_symbols(self, text):
-        return re.sub(r'[^\x00-\x7F]+', '', text)
+        return NON_ASCII_PATTERN.sub('', text)
 
 
     def remove_references(self, text):
         """Remove citations and references (e.g., [12])"""
-        return re.sub(r'\[\d+\]', '', text)
+        return REFERENCE_PATTERN.sub('', text)
 
 
     def split_into_sentences(self, text):
         """Split the text into sentences and remove empty strings"""
-        sentences = re.split(r'(?<=\.|\?)\s+(?!")|\n+|(?<=\.)"', text)
+        sentences = SENTENCE_SPLIT_PATTERN.split(text)
         return [i for i in sentences if i]
 
 
@@ -1,8 +1,16 @@
 from bs4 import BeautifulSoup
-import copy
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import mmap
+import shutil
 import sys
+import tempfile
+import zlib
 import requests
-from requests.exceptions import ReadTimeout
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ReadTimeout, RequestException
 from tqdm import tqdm
 from pathlib import Path
 
@@ -10,18 +18,194 @@ parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
 import os
+from multiprocessing import Value
+import numpy as np
+import random
+from parsers.cache import ResponseCache
+from parsers.corpus import load_offsets
+from parsers.dedup import DedupIndex
 from parsers.parser_utils import TextProcessor
+from parsers.tokenizers import get_tokenizer
+from parsers.wiki_dump import get_byte_ranges, get_stream_offsets, iter_articles, wikitext_to_html
 import time
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
-from utils.utils import DataCreator, DatasetFactory, set_driver
-
-
-class WikiParser(DataCreator):
-
-    def __init__(self, storage_type, storage_params, subdir='texts'):
+from utils.rate_limiter import RateLimiter
+from utils.utils import DataCreator, get_sample_id, set_driver
+
+
+class PageParser(DataCreator):
+    """Base of parsers cutting text samples out of pages. Subclasses yield page html from iter_pages.
+    Every page gives up to samples_per_page random sentences, each of them takes the next id from
+    the shared work queue, so ids stay unique across processes and parsing stops when ids run out.
+    Id is skipped if fetch_attempts pages in a row have no text left after processing,
+    ids left when iter_pages is over are reported as failed.
+    text_engine is passed to TextProcessor. nltk resources needed by processor config are checked
+    in nltk_data_dir once before workers start.
+    With dedup_path set, near-duplicates of texts emitted by any worker are dropped using MinHash LSH index
+    stored in SQLite file, dedup_params are passed to DedupIndex"""
+
+    def __init__(
+            self,
+            storage_type,
+            storage_params,
+            subdir='texts',
+            samples_per_page=1,
+            fetch_attempts=5,
+            text_engine='default',
+            nltk_data_dir=None,
+            dedup_path=None,
+            dedup_params=None,
+        ):
         super().__init__(storage_type, storage_params, subdir)
+        self.samples_per_page = samples_per_page
+        self.fetch_attempts = fetch_attempts
+        self.text_engine = text_engine
+        self.nltk_data_dir = nltk_data_dir
+        self.dedup_index = DedupIndex(dedup_path, **(dedup_params or {})) if dedup_path else None
+
+
+    def start(self, process_params, *args, **kwargs):
+        TextProcessor(process_params.get('processor_config'), engine=self.text_engine).ensure_resources(self.nltk_data_dir)
+        return super().start(process_params, *args, **kwargs)
+
+
+    def make_html(self, content, kind='html'):
+        """Get html of page content or of article wikitext"""
+        if kind == 'wikitext':
+            return wikitext_to_html(content)
+        return content
+
+
+    def iter_pages(self, **kwargs):
+        """Yield page html, or None for pages failed to fetch"""
+        raise NotImplementedError
+
+
+    def get_sentences(self, processor, page):
+        return processor(page)
+
+
+    def process(self, file_names, subdir, processor_config, storage_type, storage_params, chunk_num, input_queue=None, **kwargs):
+        storage = self.get_storage(storage_type, storage_params)
+        processor = TextProcessor(processor_config, engine=self.text_engine)
+        pages = self.iter_pages(**kwargs)
+        samples = []
+
+        for num in tqdm(self.iter_file_names(file_names, input_queue), position=chunk_num, desc=f'Process {chunk_num}'):
+
+            text = None
+            attempts = 0
+            while text is None:
+                # Take pages until one of them has text left after processing
+                if not samples:
+                    if attempts == self.fetch_attempts:
+                        break
+                    page = next(pages, StopIteration)
+                    if page is StopIteration:
+                        raise RuntimeError(f'Can not make sample {num}: corpus exhausted')
+                    attempts += 1
+                    if page:
+                        sentences = self.get_sentences(processor, page)
+                        samples = random.sample(sentences, min(self.samples_per_page, len(sentences)))
+                    continue
+
+                # Near-duplicates of already emitted texts never reach the next stages
+                sample = samples.pop()
+                if self.dedup_index is None or self.dedup_index.add(num, sample):
+                    text = sample
+            if text is None:
+                continue
+
+            file_name = f'title_{num}.txt'
+            storage.save_file(text, file_name, subdir)
+            self.emit(file_name)
+
+
+class WikiParser(PageParser):
+    """Parse random Wikipedia articles through the API.
+    By default every sample takes two requests: random title and its parsed page.
+    With pages_per_request set, one request returns that many random articles with their markup,
+    and up to max_requests requests are kept in flight by a thread pool.
+    Fetched pages are stored in cache if cache_path is given. In replay mode pages are taken
+    from the cache instead of network: workers take cached pages in turn, wrapping around.
+    With rate_limit set (requests per second), all workers draw requests from one shared token bucket
+    instead of sleeping delay after every page"""
+
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(
+            self,
+            storage_type,
+            storage_params,
+            subdir='texts',
+            pages_per_request=None,
+            max_requests=4,
+            cache_path=None,
+            cache_size=1 << 30,
+            replay=False,
+            rate_limit=None,
+            burst=1,
+            max_attempts=5,
+            samples_per_page=1,
+            text_engine='default',
+            nltk_data_dir=None,
+            dedup_path=None,
+            dedup_params=None,
+        ):
+        super().__init__(
+            storage_type,
+            storage_params,
+            subdir,
+            samples_per_page,
+            text_engine=text_engine,
+            nltk_data_dir=nltk_data_dir,
+            dedup_path=dedup_path,
+            dedup_params=dedup_params,
+        )
         self.WIKI_API_URL = "https://en.wikipedia.org/w/api.php"
+        self.pages_per_request = pages_per_request
+        self.max_requests = max_requests
+        self._session = None
+        self._session_pid = None
+        if replay and not cache_path:
+            raise ValueError('Replay mode needs cache_path')
+        self.cache = ResponseCache(cache_path, max_size=cache_size) if cache_path else None
+        self.replay = replay
+        # Created in the parent process, so that forked workers share it
+        self.rate_limiter = RateLimiter(rate_limit, burst) if rate_limit else None
+        self.max_attempts = max_attempts
+        # Index of the next cached page to replay, shared by all workers
+        self.next_cached = Value('i', 0)
+
+
+    @property
+    def session(self):
+        """HTTP session with connection pool, created on first use in every process"""
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_requests, max_retries=3)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+            self._session_pid = os.getpid()
+        return self._session
+
+
+    def api_get(self, params, timeout=None):
+        """Send request to the API. With rate limiter every request takes a token,
+        throttled requests slow all workers down and are retried"""
+        if self.rate_limiter is None:
+            return self.session.get(self.WIKI_API_URL, params=params, timeout=timeout)
+        for _ in range(self.max_attempts):
+            self.rate_limiter.acquire()
+            response = self.session.get(self.WIKI_API_URL, params=params, timeout=timeout)
+            throttled = response.status_code in self.THROTTLE_STATUSES
+            retry_after = response.headers.get('Retry-After')
+            self.rate_limiter.report(throttled, float(retry_after) if retry_after and retry_after.isdigit() else None)
+            if not throttled:
+                break
+        return response
 
 
     def get_random_wikipedia_title(self):
@@ -32,101 +216,508 @@ class WikiParser(DataCreator):
             "rnnamespace": 0, # Only main articles (not Talk, User, etc.)
             "format": "json"
         }
-        response = requests.get(self.WIKI_API_URL, params=params).json()
+        response = self.api_get(params).json()
         return response["query"]["random"][0]["title"]
 
 
     def get_soup(self, page_title, timeout=10):
         """Fetches section titles from a given Wikipedia page."""
+        html_content = self.get_page_html(page_title, timeout)
+        if html_content is None:
+            return None
+        soup = BeautifulSoup(html_content, "html.parser")
+        return soup
+
+
+    def get_page_html(self, page_title, timeout=10):
+        """Fetch html of the page, from cache if it is there. None if request failed"""
+        if self.cache is not None:
+            cached = self.cache.get(page_title)
+            if cached:
+                return self.make_html(*cached)
+
         params = {
             "action": "parse",
             "page": page_title,
             "format": "json",
-            "prop": "text"
+            "prop": "text|revid"
         }
         try:
-            response = requests.get(self.WIKI_API_URL, params=params, timeout=timeout).json()
+            response = self.api_get(params, timeout=timeout).json()
         except ReadTimeout:
             return None
         if "error" in response:
-            return [] # Skip pages with issues
+            return None # Skip pages with issues
         html_content = response.get("parse", {}).get("text", {}).get("*", "")
+        if self.cache is not None and html_content:
+            self.cache.put(page_title, response["parse"].get("revid", 0), html_content, kind='html')
+        return html_content
 
-        soup = BeautifulSoup(html_content, "html.parser")
-        return soup
-
-
-    def process(self, file_names, subdir, processor_config, storage_type, storage_params, chunk_num, delay=0.05, **kwargs):
-        """Collects Wikipedia section titles until reaching the target count."""
-        storage_cls = DatasetFactory.get_storage(storage_type)
-        storage_params_copy = copy.deepcopy(storage_params)
-        storage = storage_cls(**storage_params_copy)
-        processor = TextProcessor(processor_config)
-
-        for num in tqdm(file_names, position=chunk_num, desc=f'Process {chunk_num}'):
-
-            # Parse and process data
-            page_title = self.get_random_wikipedia_title()
-            soup = self.get_soup(page_title)
-            if not soup:
-                continue
-            sentences = processor(soup)
 
-            for text in sentences:
-
-                file_name = f'title_{num}.txt'
-                storage.save_file(text, file_name, subdir)
-            time.sleep(delay) # Avoid hitting API rate limits
-        
-        # # Postprocessing
-        # if 'update_token_counts' in processor_config and start_index < dataset_size:
-        #     processor.save_state('token_counts.json')
-        #     processor.calc_probas()
-        #     # Read every saved file, postprocess and rewrite it
-        #     for file_name in tqdm(storage.read_all(subdir)):
-        #         text = storage.read_file(file_name, subdir, file_type='text')
-        #         text = processor.remove_frequent_tokens(text)
-        #         storage.save_file(text, file_name, subdir)
-
-
-class YouTubeParser:
-
-    def __init__(self, driver_path, output_path):
-        self.output_path = output_path
+    def get_random_articles(self, num_pages, timeout=30):
+        """Fetch (title, wikitext) of num_pages random articles with one request. API returns 50 pages at most.
+        Failed requests raise, so the sample waiting for them is reported as failed"""
+        params = {
+            "action": "query",
+            "generator": "random",
+            "grnnamespace": 0,
+            "grnlimit": min(num_pages, 50),
+            "prop": "revisions",
+            "rvprop": "content|ids",
+            "rvslots": "main",
+            "format": "json",
+            "formatversion": 2,
+        }
+        response = self.api_get(params, timeout=timeout)
+        response.raise_for_status()
+        response = response.json()
+        if "error" in response:
+            raise RequestException(response["error"].get("info", "API error"))
+        articles = []
+        for page in response.get("query", {}).get("pages", []):
+            revisions = page.get("revisions")
+            if revisions:
+                wikitext = revisions[0]["slots"]["main"].get("content", "")
+                articles.append((page["title"], wikitext))
+                if self.cache is not None and wikitext:
+                    self.cache.put(page["title"], revisions[0].get("revid", 0), wikitext, kind='wikitext')
+        return articles
+
+
+    def iter_random_articles(self, delay=0.05):
+        """Yield random articles fetched in batches, keeping up to max_requests requests in flight"""
+        executor = ThreadPoolExecutor(max_workers=self.max_requests)
+        try:
+            futures = deque()
+            while True:
+                while len(futures) < self.max_requests:
+                    futures.append(executor.submit(self.get_random_articles, self.pages_per_request))
+                    if self.rate_limiter is None:
+                        time.sleep(delay) # Avoid hitting API rate limits
+                yield from futures.popleft().result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def start(self, *args, **kwargs):
+        with self.next_cached.get_lock():
+            self.next_cached.value = 0
+        return super().start(*args, **kwargs)
+
+
+    def iter_cached_pages(self):
+        """Yield html of cached pages taken in turn with other workers"""
+        cached_keys = self.cache.keys()
+        if not cached_keys:
+            raise ValueError(f'Cache {self.cache.path} is empty, nothing to replay')
+        while True:
+            with self.next_cached.get_lock():
+                page_num = self.next_cached.value
+                self.next_cached.value += 1
+            yield self.make_html(*self.cache.get(*cached_keys[page_num % len(cached_keys)]))
+
+
+    def iter_pages(self, delay=0.05, **kwargs):
+        """Yield html of random pages"""
+        if self.replay:
+            yield from self.iter_cached_pages()
+        elif self.pages_per_request:
+            for _, wikitext in self.iter_random_articles(delay):
+                yield self.make_html(wikitext, kind='wikitext')
+        else:
+            while True:
+                page_title = self.get_random_wikipedia_title()
+                yield self.get_page_html(page_title)
+                if self.rate_limiter is None:
+                    time.sleep(delay) # Avoid hitting API rate limits
+
+
+class WikiDumpParser(PageParser):
+    """Parse articles from local Wikipedia dump (pages-articles.xml.bz2) without network.
+    Multistream dumps are split into byte ranges of bz2 streams, which workers decompress in parallel.
+    Stream offsets come from the dump index file, or from scanning the dump if there is no index"""
+
+    def __init__(
+            self,
+            storage_type,
+            storage_params,
+            dump_path,
+            subdir='texts',
+            index_path=None,
+            range_size=1 << 26,
+            samples_per_page=1,
+            text_engine='default',
+            nltk_data_dir=None,
+            dedup_path=None,
+            dedup_params=None,
+        ):
+        super().__init__(
+            storage_type,
+            storage_params,
+            subdir,
+            samples_per_page,
+            text_engine=text_engine,
+            nltk_data_dir=nltk_data_dir,
+            dedup_path=dedup_path,
+            dedup_params=dedup_params,
+        )
+        self.dump_path = dump_path
+        self.index_path = index_path
+        self.range_size = range_size
+        self.ranges = None
+        self.articles = None
+        # Index of the next byte range to decompress, shared by all workers
+        self.next_range = Value('i', 0)
+
+
+    def get_ranges(self):
+        """Split dump into byte ranges once"""
+        if self.ranges is None:
+            offsets = get_stream_offsets(self.dump_path, self.index_path)
+            self.ranges = get_byte_ranges(offsets, os.path.getsize(self.dump_path), self.range_size)
+        return self.ranges
+
+
+    def start(self, *args, **kwargs):
+        self.get_ranges()
+        self.articles = None
+        with self.next_range.get_lock():
+            self.next_range.value = 0
+        return super().start(*args, **kwargs)
+
+
+    def iter_pages(self, **kwargs):
+        """Yield article html from byte ranges taken by this worker one by one, until all ranges are taken.
+        Worker keeps its position in the current range when processing is restarted after a failure"""
+        while True:
+            if self.articles is None:
+                with self.next_range.get_lock():
+                    range_num = self.next_range.value
+                    self.next_range.value += 1
+                if range_num >= len(self.ranges):
+                    return
+                self.articles = iter_articles(self.dump_path, *self.ranges[range_num])
+            for _, wikitext in self.articles:
+                yield self.make_html(wikitext, kind='wikitext')
+            self.articles = None
+
+
+class LocalCorpusParser(PageParser):
+    """Parse local corpora of plain text (one document per line) or JSONL files (document in text_field of every record).
+    Byte offsets of records are indexed once and cached next to the files or in index_dir, files are memory-mapped,
+    so documents are read one by one without reading whole files. Documents go through TextProcessor as plain text.
+    With order='random' every worker draws random documents, with order='sequential' workers take consecutive
+    blocks of documents in turn and ids left when the corpus is over fail. Block has block_size documents at most
+    and no more than ids of the worker's batch need, so documents claimed by one worker are not missing for others"""
+
+    def __init__(
+            self,
+            storage_type,
+            storage_params,
+            corpus_paths,
+            subdir='texts',
+            file_format=None,
+            text_field='text',
+            order='random',
+            block_size=64,
+            index_dir=None,
+            samples_per_page=1,
+            text_engine='default',
+            nltk_data_dir=None,
+            dedup_path=None,
+            dedup_params=None,
+        ):
+        super().__init__(
+            storage_type,
+            storage_params,
+            subdir,
+            samples_per_page,
+            text_engine=text_engine,
+            nltk_data_dir=nltk_data_dir,
+            dedup_path=dedup_path,
+            dedup_params=dedup_params,
+        )
+        if order not in ('random', 'sequential'):
+            raise ValueError(f'order should be "random" or "sequential", got "{order}"')
+        self.corpus_paths = [corpus_paths] if isinstance(corpus_paths, (str, Path)) else list(corpus_paths)
+        self.file_format = file_format
+        self.text_field = text_field
+        self.order = order
+        self.block_size = block_size
+        self.index_dir = index_dir
+        self.offsets = None
+        self.record_ends = None
+        self._files = None
+        self._files_pid = None
+        self.record_nums = None
+        # Number of the next record to read in sequential order, shared by all workers
+        self.next_record = Value('q', 0)
+
+
+    def load_index(self):
+        """Load offsets index of every corpus file once"""
+        if self.offsets is None:
+            self.offsets = [load_offsets(str(path), self.index_dir) for path in self.corpus_paths]
+            self.record_ends = np.cumsum([len(offsets) for offsets in self.offsets])
+        return self.offsets
+
+
+    def __len__(self):
+        self.load_index()
+        return int(self.record_ends[-1]) if len(self.record_ends) else 0
+
+
+    @property
+    def files(self):
+        """Memory-mapped corpus files, mapped on first use in every process"""
+        if self._files is None or self._files_pid != os.getpid():
+            files = []
+            for path in self.corpus_paths:
+                with open(path, 'rb') as f:
+                    files.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b'')
+            self._files = files
+            self._files_pid = os.getpid()
+        return self._files
+
+
+    def get_file_format(self, path):
+        if self.file_format is not None:
+            return self.file_format
+        return 'jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'text'
+
+
+    def read_record(self, record_num):
+        """Get document by its number across all corpus files"""
+        file_num = int(np.searchsorted(self.record_ends, record_num, side='right'))
+        first_record = int(self.record_ends[file_num - 1]) if file_num else 0
+        start, end = self.offsets[file_num][record_num - first_record]
+        data = self.files[file_num][start:end]
+        if self.get_file_format(self.corpus_paths[file_num]) == 'jsonl':
+            return json.loads(data).get(self.text_field) or ''
+        return data.decode('utf-8', errors='replace')
+
+
+    def start(self, *args, **kwargs):
+        self.load_index()
+        self.record_nums = None
+        with self.next_record.get_lock():
+            self.next_record.value = 0
+        return super().start(*args, **kwargs)
+
+
+    def iter_record_nums(self):
+        num_records = len(self)
+        if not num_records:
+            return
+        if self.order == 'random':
+            # Generator is seeded from OS entropy in every worker, so workers draw different documents
+            generator = np.random.default_rng()
+            while True:
+                yield from generator.integers(0, num_records, self.block_size).tolist()
+        else:
+            while True:
+                block_size = self.get_claim_size()
+                with self.next_record.get_lock():
+                    first_record = self.next_record.value
+                    self.next_record.value += block_size
+                if first_record >= num_records:
+                    return
+                yield from range(first_record, min(first_record + block_size, num_records))
+
+
+    def get_claim_size(self):
+        """Number of documents to claim for ids left in the current batch of the worker"""
+        if self.work_items is None or self.work_items.current is None:
+            return self.block_size
+        num_ids = len(self.work_items.batch) + 1
+        return max(1, min(self.block_size, math.ceil(num_ids / self.samples_per_page)))
+
+
+    def iter_pages(self, **kwargs):
+        """Yield documents of the corpus. Worker keeps its position when processing is restarted after a failure"""
+        if self.record_nums is None:
+            self.record_nums = self.iter_record_nums()
+        for record_num in self.record_nums:
+            yield self.read_record(record_num)
+
+
+    def get_sentences(self, processor, page):
+        return processor.process_text(page)
+
+
+class TokenDownsampler(DataCreator):
+    """Remove frequent tokens from stored texts in two passes over the storage.
+    In count pass every worker counts tokens of its texts and dumps them into counts_dir as zlib-compressed json,
+    then the parent merges these partial counters. In rewrite pass workers drop tokens with probabilities
+    calculated from merged counts and rewrite texts in place. Texts are read and saved read_batch_size at a time,
+    so no process holds more than a batch of texts. Rewritten samples are marked in manifest as stage.
+    tokenizer is passed to TextProcessor, its nltk resources are checked in nltk_data_dir once before workers start"""
+
+    def __init__(self, storage_type, storage_params, subdir='texts', stage='downsampled', read_batch_size=64, tokenizer='nltk', nltk_data_dir=None):
+        super().__init__(storage_type, storage_params, subdir)
+        self.stage = stage
+        self.read_batch_size = read_batch_size
+        self.tokenizer = tokenizer
+        self.nltk_data_dir = nltk_data_dir
+        self.processor = None
+
+
+    def start(self, *args, **kwargs):
+        get_tokenizer(self.tokenizer).ensure_resources(self.nltk_data_dir)
+        return super().start(*args, **kwargs)
+
+
+    def iter_chunks(self, file_names, input_queue=None):
+        """Group file names of the worker into chunks of read_batch_size"""
+        chunk = []
+        for file_name in self.iter_file_names(file_names, input_queue):
+            chunk.append(file_name)
+            if len(chunk) == self.read_batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+    def process(self, file_names, subdir, storage_type, storage_params, chunk_num, input_queue=None, counts_dir=None, token_counts=None, **kwargs):
+        storage = self.get_storage(storage_type, storage_params)
+        # Processor outlives restarts after failures, so counts of the worker are dumped once
+        if self.processor is None:
+            self.processor = TextProcessor({}, tokenizer=self.tokenizer)
+            if token_counts is not None:
+                self.processor.token_counts = Counter(token_counts)
+                self.processor.calc_probas()
+        processor = self.processor
+        storage.strategy = 'rewrite'
+
+        for chunk in tqdm(self.iter_chunks(file_names, input_queue), position=chunk_num, desc=f'Process {chunk_num}'):
+            texts = storage.read_many(chunk, subdir)
+            if token_counts is None:
+                processor.update_token_counts(texts)
+            else:
+                storage.save_many(list(zip(processor.remove_frequent_tokens_many(texts), chunk)), subdir)
+                if self.manifest is not None:
+                    self.manifest.add_many([get_sample_id(file_name) for file_name in chunk], self.stage)
+
+        if token_counts is None and processor.token_counts:
+            with open(os.path.join(counts_dir, f'token_counts_{os.getpid()}.json.z'), 'wb') as f:
+                f.write(zlib.compress(json.dumps(processor.token_counts).encode('utf-8')))
+
+
+    def count_tokens(self, file_names, num_processes=None, batch_size=64):
+        """Pass one. Return merged token counts of the texts and results of the workers"""
+        counts_dir = tempfile.mkdtemp(prefix='token_counts_')
+        try:
+            results = self(
+                process_params={'counts_dir': counts_dir},
+                input_data_subdir=self.subdir,
+                num_processes=num_processes,
+                batch_size=batch_size,
+                file_names=file_names,
+            )
+            token_counts = Counter()
+            for file_name in os.listdir(counts_dir):
+                with open(os.path.join(counts_dir, file_name), 'rb') as f:
+                    token_counts.update(json.loads(zlib.decompress(f.read())))
+        finally:
+            shutil.rmtree(counts_dir, ignore_errors=True)
+        return token_counts, results
+
+
+    def rewrite(self, file_names, token_counts, num_processes=None, batch_size=64):
+        """Pass two. Remove frequent tokens from the texts and save them in place"""
+        return self(
+            process_params={'token_counts': token_counts},
+            input_data_subdir=self.subdir,
+            num_processes=num_processes,
+            batch_size=batch_size,
+            file_names=file_names,
+        )
+
+
+    def downsample(self, file_names, rewrite_file_names=None, num_processes=None, batch_size=64):
+        """Count tokens of file_names and rewrite rewrite_file_names, all of file_names by default.
+        Returns results of both passes"""
+        token_counts, results = self.count_tokens(file_names, num_processes, batch_size)
+        if not token_counts:
+            return results
+        if rewrite_file_names is None:
+            rewrite_file_names = file_names
+        return results + self.rewrite(rewrite_file_names, token_counts, num_processes, batch_size)
+
+
+class YouTubeParser(DataCreator):
+    """Parse titles of YouTube search results for the list of queries.
+    Every worker keeps one Chrome session for all its queries. Results page is scrolled until max_titles titles
+    are loaded, no new titles appear or max_scrolls is reached. Title k of query number q gets id q * max_titles + k,
+    so ids are unique across queries and stay the same between runs"""
+
+    TITLES_SCRIPT = "return Array.from(document.querySelectorAll('h3 a#video-title'), a => a.textContent.trim())"
+    SCROLL_SCRIPT = 'window.scrollTo(0, document.documentElement.scrollHeight)'
+
+    def __init__(self, storage_type, storage_params, driver_path, queries=(), subdir='texts', max_titles=20, max_scrolls=10, scroll_pause=1):
+        super().__init__(storage_type, storage_params, subdir)
         self.driver_path = driver_path
-
-
-    def __call__(self, search_query, delay=0.05):
-
-        os.makedirs(self.output_path, exist_ok=True)
+        self.queries = list(queries)
+        self.max_titles = max_titles
+        self.max_scrolls = max_scrolls
+        self.scroll_pause = scroll_pause
+        # Titles of the last searched query of the worker
+        self.query_num = None
+        self.titles = []
+
+
+    def search(self, driver, search_query, delay=0.05):
+        """Get unique titles of search results, scrolling the page to load more of them"""
+        driver.get(f"https://www.youtube.com/results?search_query={search_query.replace(' ', '+')}")
+        time.sleep(delay)
+
+        titles = []
+        for _ in range(self.max_scrolls + 1):
+            loaded = list(dict.fromkeys(title for title in driver.execute_script(self.TITLES_SCRIPT) if title))
+            if len(loaded) == len(titles):
+                break
+            titles = loaded
+            if len(titles) >= self.max_titles:
+                break
+            driver.execute_script(self.SCROLL_SCRIPT)
+            time.sleep(self.scroll_pause)
+        return titles[:self.max_titles]
+
+
+    def process(self, file_names, subdir, storage_type, storage_params, chunk_num, input_queue=None, delay=0.05, **kwargs):
+        storage = self.get_storage(storage_type, storage_params)
         driver = set_driver(self.driver_path)
 
         try:
-            # Build the YouTube search URL
-            url = f"https://www.youtube.com/results?search_query={search_query.replace(' ', '+')}"
-
-            # Navigate to the page
-            driver.get(url)
-
-            # Allow some time for the page to load
-            time.sleep(delay)
-
-            # Extract video titles
-            video_titles = []
-            videos = driver.find_elements(By.CSS_SELECTOR, "h3 a#video-title")
-            for video in videos:
-                video_titles.append(video.text)
-
-            # Write titles as txt files
-            for num, title in enumerate(video_titles):
-                with open(os.path.join(self.output_path, f'title_{num}.txt'), 'w', encoding='utf-8') as f:
-                    f.write(title)
-
+            for num in tqdm(self.iter_file_names(file_names, input_queue), position=chunk_num, desc=f'Process {chunk_num}'):
+                query_num, title_num = divmod(num, self.max_titles)
+                if query_num >= len(self.queries):
+                    continue
+                if query_num != self.query_num:
+                    self.titles = self.search(driver, self.queries[query_num], delay)
+                    self.query_num = query_num
+                if title_num < len(self.titles):
+                    file_name = f'title_{num}.txt'
+                    storage.save_file(self.titles[title_num], file_name, subdir)
+                    self.emit(file_name)
         finally:
             # Close the browser
             driver.quit()
 
 
+    def collect(self, queries=None, num_processes=None, delay=0.05):
+        """Parse titles of all queries. Every batch holds ids of one query, so each query is searched once"""
+        if queries is not None:
+            self.queries = list(queries)
+        return self(
+            process_params={'delay': delay},
+            num_processes=num_processes,
+            batch_size=self.max_titles,
+            file_names=range(len(self.queries) * self.max_titles),
+        )
+
+
 class PowerPointTemplateParser:
 
     def __init__(self, output_path, driver_path):
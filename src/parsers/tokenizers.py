@@ -0,0 +1,120 @@
+from abc import ABC, abstractmethod
+import re
+
+import nltk
+from nltk import word_tokenize
+
+
+# Words with inner hyphens and apostrophes, numbers with decimal part, or single punctuation marks
+WORD_PATTERN = r"\w+(?:[-'.,]\w+)*|[^\w\s]"
+
+# Resources found or downloaded by this process. Workers forked afterwards inherit the set along with nltk.data.path
+_resolved_resources = set()
+
+
+def ensure_nltk_resources(resources, data_dir=None):
+    """Make sure nltk resources given as {package: resource path} are available, downloading missing ones into data_dir.
+    data_dir is put first into nltk search path. Each resource is checked once per process, so call it in the parent
+    before starting workers. Raises LookupError if resource is missing and can't be downloaded, e.g. offline"""
+    if data_dir and data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, data_dir)
+    for package, resource in resources.items():
+        if resource in _resolved_resources:
+            continue
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            try:
+                nltk.download(package, download_dir=data_dir, quiet=True, raise_on_error=True)
+                nltk.data.find(resource)
+            except (LookupError, ValueError, OSError) as e:
+                raise LookupError(
+                    f'nltk resource "{package}" is not found in {nltk.data.path} and can\'t be downloaded. '
+                    f'Download it with nltk.download("{package}", download_dir=...) and pass the directory as nltk_data_dir'
+                ) from e
+        _resolved_resources.add(resource)
+
+
+class Tokenizer(ABC):
+    """Split sentences into tokens. Subclasses tokenize whole batches, so per-sentence overhead is paid once per call.
+    nltk resources of the tokenizer are listed in resources as {package: resource path}"""
+
+    resources = {}
+
+    @abstractmethod
+    def tokenize_many(self, sentences):
+        """Get list of tokens of every sentence"""
+        pass
+
+
+    def ensure_resources(self, data_dir=None):
+        ensure_nltk_resources(self.resources, data_dir)
+
+
+    def tokenize(self, sentence):
+        return self.tokenize_many([sentence])[0]
+
+
+    def detokenize(self, tokens):
+        """Join tokens back into sentence"""
+        return ' '.join(tokens)
+
+
+class NLTKTokenizer(Tokenizer):
+    """nltk word_tokenize. punkt_tab resource is loaded by nltk on the first call"""
+
+    resources = {'punkt_tab': 'tokenizers/punkt_tab/english/'}
+
+    def tokenize_many(self, sentences):
+        return [word_tokenize(sentence) for sentence in sentences]
+
+
+class RegexTokenizer(Tokenizer):
+    """Unicode-aware regex tokenizer, several times faster than nltk and needs no resources"""
+
+    def __init__(self, pattern=WORD_PATTERN):
+        self.findall = re.compile(pattern).findall
+
+
+    def tokenize_many(self, sentences):
+        findall = self.findall
+        return [findall(sentence) for sentence in sentences]
+
+
+class HFTokenizer(Tokenizer):
+    """Subword tokenizer of HuggingFace tokenizers library loaded from local tokenizer.json.
+    Batches are encoded in Rust, tokens are joined back by the tokenizer decoder"""
+
+    def __init__(self, path):
+        try:
+            from tokenizers import Tokenizer as HFTokenizerModel
+        except ImportError as e:
+            raise ImportError('HFTokenizer needs "tokenizers" package, install it with "pip install tokenizers"') from e
+        self.tokenizer = HFTokenizerModel.from_file(path)
+
+
+    def tokenize_many(self, sentences):
+        return [encoding.tokens for encoding in self.tokenizer.encode_batch(sentences, add_special_tokens=False)]
+
+
+    def detokenize(self, tokens):
+        if self.tokenizer.decoder is None:
+            return super().detokenize(tokens)
+        return self.tokenizer.decoder.decode(tokens)
+
+
+TOKENIZERS = {
+    'nltk': NLTKTokenizer,
+    'regex': RegexTokenizer,
+}
+
+
+def get_tokenizer(tokenizer='nltk'):
+    """Get tokenizer by name, or by path to HuggingFace tokenizer.json. Tokenizer instances are returned as is"""
+    if not isinstance(tokenizer, str):
+        return tokenizer
+    if tokenizer in TOKENIZERS:
+        return TOKENIZERS[tokenizer]()
+    if tokenizer.endswith('.json'):
+        return HFTokenizer(tokenizer)
+    raise ValueError(f'tokenizer should be one of {list(TOKENIZERS)}, path to tokenizer.json or Tokenizer instance, got "{tokenizer}"')
@@ -0,0 +1,154 @@
+import bz2
+import re
+from xml.etree import ElementTree
+
+
+# Every bz2 stream starts with header 'BZh<level>' followed by magic of its first block
+STREAM_START_PATTERN = re.compile(rb'BZh[1-9]1AY&SY')
+PAGE_START = b'<page>'
+PAGE_END = b'</page>'
+
+COMMENT_PATTERN = re.compile(r'<!--.*?-->', re.DOTALL)
+REF_PATTERN = re.compile(r'<ref[^>/]*/>|<ref[^>]*>.*?</ref>', re.DOTALL | re.IGNORECASE)
+HIDDEN_LINK_PATTERN = re.compile(r'^(?:file|image|category|media):', re.IGNORECASE)
+LINK_PATTERN = re.compile(r'\[\[([^\[\]|]*)(?:\|([^\[\]]*))?\]\]')
+EXTERNAL_LINK_PATTERN = re.compile(r'\[(?:https?:)?//[^\s\]]+(?:\s([^\]]*))?\]')
+EMPHASIS_PATTERN = re.compile(r"'{2,}")
+HEADER_PATTERN = re.compile(r'^(={2,6})\s*(.+?)\s*\1\s*$')
+LIST_PATTERN = re.compile(r'^[*#:;]+\s*')
+
+
+def get_stream_offsets(dump_path, index_path=None, chunk_size=1 << 24):
+    """Get sorted byte offsets of bz2 streams in multistream dump.
+    Offsets are read from dump index file if it is given, otherwise the dump is scanned for stream headers.
+    Regular dumps are a single stream, so the only offset is 0"""
+    if index_path:
+        open_index = bz2.open if index_path.endswith('.bz2') else open
+        with open_index(index_path, 'rt', encoding='utf-8') as f:
+            offsets = {int(line.split(':', 1)[0]) for line in f if line.strip()}
+        return sorted(offsets)
+
+    offsets = []
+    overlap = 9  # Header split between chunks is found in the next one
+    with open(dump_path, 'rb') as f:
+        position = 0
+        tail = b''
+        while chunk := f.read(chunk_size):
+            data = tail + chunk
+            offsets.extend(position - len(tail) + match.start() for match in STREAM_START_PATTERN.finditer(data))
+            position += len(chunk)
+            tail = data[-overlap:]
+    return sorted(set(offsets)) or [0]
+
+
+def get_byte_ranges(offsets, file_size, range_size=1 << 26):
+    """Group consecutive streams into (start, end) byte ranges of at least range_size bytes"""
+    ranges = []
+    start = offsets[0]
+    for offset in offsets[1:]:
+        if offset - start >= range_size:
+            ranges.append((start, offset))
+            start = offset
+    ranges.append((start, file_size))
+    return ranges
+
+
+def iter_decompressed(dump_path, start, end, chunk_size=1 << 20):
+    """Decompress bz2 streams lying in byte range of the dump chunk by chunk"""
+    with open(dump_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        decompressor = bz2.BZ2Decompressor()
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            while chunk:
+                yield decompressor.decompress(chunk)
+                if decompressor.eof:
+                    # Next stream of multistream dump starts right after the current one
+                    chunk = decompressor.unused_data
+                    decompressor = bz2.BZ2Decompressor()
+                else:
+                    chunk = b''
+
+
+def iter_page_elements(chunks):
+    """Cut <page> elements out of decompressed xml chunks. Only one page is kept in memory"""
+    buffer = b''
+    for data in chunks:
+        buffer += data
+        position = 0
+        while True:
+            begin = buffer.find(PAGE_START, position)
+            if begin == -1:
+                break
+            end = buffer.find(PAGE_END, begin)
+            if end == -1:
+                break
+            position = end + len(PAGE_END)
+            yield buffer[begin:position]
+        begin = buffer.find(PAGE_START, position)
+        buffer = buffer[begin:] if begin != -1 else buffer[-len(PAGE_START):]
+
+
+def iter_articles(dump_path, start, end):
+    """Yield (title, wikitext) of articles in byte range of the dump, skipping redirects and non-article pages"""
+    for element in iter_page_elements(iter_decompressed(dump_path, start, end)):
+        page = ElementTree.fromstring(element)
+        if page.findtext('ns') != '0' or page.find('redirect') is not None:
+            continue
+        wikitext = page.findtext('revision/text')
+        if wikitext:
+            yield page.findtext('title'), wikitext
+
+
+def remove_nested(text, open_tag, close_tag, should_remove=None):
+    """Remove possibly nested blocks like {{template {{inner}}}}.
+    If should_remove is given, only blocks whose content passes it are removed"""
+    result = []
+    stack = []
+    position = 0
+    for match in re.finditer(f'{re.escape(open_tag)}|{re.escape(close_tag)}', text):
+        if match.group() == open_tag:
+            stack.append(match.start())
+        elif stack:
+            begin = stack.pop()
+            if not stack:
+                content = text[begin + len(open_tag):match.start()]
+                if should_remove is None or should_remove(content):
+                    result.append(text[position:begin])
+                    position = match.end()
+    result.append(text[position:])
+    return ''.join(result)
+
+
+def wikitext_to_html(wikitext):
+    """Convert article wikitext into simple html, like the one parse API returns:
+    templates, tables, references, files and categories are dropped, links are replaced with their labels,
+    section titles become h2-h6 headers and paragraphs become <p> elements"""
+    text = COMMENT_PATTERN.sub('', wikitext)
+    text = REF_PATTERN.sub('', text)
+    text = remove_nested(text, '{{', '}}')
+    text = remove_nested(text, '{|', '|}')
+    text = remove_nested(text, '[[', ']]', should_remove=HIDDEN_LINK_PATTERN.match)
+    text = LINK_PATTERN.sub(lambda match: match.group(2) or match.group(1), text)
+    text = EXTERNAL_LINK_PATTERN.sub(lambda match: match.group(1) or '', text)
+    text = EMPHASIS_PATTERN.sub('', text)
+
+    blocks = []
+    paragraph = []
+    for line in text.splitlines() + ['']:
+        line = line.strip()
+        header = HEADER_PATTERN.match(line)
+        if header or not line:
+            if paragraph:
+                blocks.append(f"<p>{' '.join(paragraph)}</p>")
+                paragraph = []
+            if header:
+                level = len(header.group(1))
+                blocks.append(f'<h{level}>{header.group(2)}</h{level}>')
+        else:
+            paragraph.append(LIST_PATTERN.sub('', line))
+    return '\n'.join(blocks)
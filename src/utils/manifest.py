@@ -0,0 +1,99 @@
+from src.utils.sqlite_utils import ProcessConnection
+
+
+class Manifest:
+    """Append-only SQLite index of finished sample stages, kept alongside the dataset.
+    Stages are named after dataset subdirs ('texts', 'pages', 'images', ...)"""
+
+    def __init__(self, path, flush_every=100, timeout=60):
+        self.path = path
+        self.flush_every = flush_every
+        self.timeout = timeout
+        self.pending = []
+        self.db = ProcessConnection(path, setup=self.create_tables, timeout=timeout)
+
+
+    @staticmethod
+    def create_tables(connection):
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS stages ('
+            'stage TEXT NOT NULL, sample_id INTEGER NOT NULL, PRIMARY KEY (stage, sample_id)) WITHOUT ROWID'
+        )
+        connection.execute('CREATE TABLE IF NOT EXISTS counts (stage TEXT PRIMARY KEY, count INTEGER NOT NULL)')
+        connection.commit()
+
+
+    @property
+    def connection(self):
+        return self.db.get()
+
+
+    def add(self, sample_id, stage):
+        """Mark stage of the sample as finished. Records are written in batches of flush_every"""
+        self.pending.append((stage, sample_id))
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+
+    def add_many(self, sample_ids, stage):
+        self.pending.extend((stage, sample_id) for sample_id in sample_ids)
+        self.flush()
+
+
+    def flush(self):
+        if not self.pending:
+            return
+        records_by_stage = {}
+        for stage, sample_id in self.pending:
+            records_by_stage.setdefault(stage, []).append((stage, sample_id))
+
+        with self.connection as connection:
+            for stage, records in records_by_stage.items():
+                cursor = connection.executemany('INSERT OR IGNORE INTO stages VALUES (?, ?)', records)
+                connection.execute(
+                    'INSERT INTO counts VALUES (?, ?) ON CONFLICT(stage) DO UPDATE SET count = count + excluded.count',
+                    (stage, cursor.rowcount),
+                )
+        self.pending = []
+
+
+    def add_count(self, name, value):
+        """Add value to counter kept along with stage counts, e.g. number of renders saved by text fitting"""
+        with self.connection as connection:
+            connection.execute(
+                'INSERT INTO counts VALUES (?, ?) ON CONFLICT(stage) DO UPDATE SET count = count + excluded.count',
+                (name, value),
+            )
+
+
+    def count(self, stage):
+        """Number of samples with finished stage, or value of counter"""
+        row = self.connection.execute('SELECT count FROM counts WHERE stage = ?', (stage,)).fetchone()
+        return row[0] if row else 0
+
+
+    def is_empty(self):
+        return self.connection.execute('SELECT 1 FROM stages LIMIT 1').fetchone() is None
+
+
+    def completed(self, stage):
+        """Set of sample ids with finished stage"""
+        rows = self.connection.execute('SELECT sample_id FROM stages WHERE stage = ?', (stage,))
+        return {row[0] for row in rows}
+
+
+    def orphans(self, stage, next_stage):
+        """Sorted ids of samples finished at stage but not at next_stage, e.g. pages with no image"""
+        rows = self.connection.execute(
+            'SELECT sample_id FROM stages WHERE stage = ? EXCEPT SELECT sample_id FROM stages WHERE stage = ? ORDER BY 1',
+            (stage, next_stage),
+        )
+        return [row[0] for row in rows]
+
+
+    def close(self):
+        """Flush pending records and merge write-ahead log into the main file"""
+        self.flush()
+        if self.db.is_open:
+            self.db.checkpoint()
+        self.db.close()
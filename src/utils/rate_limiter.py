@@ -0,0 +1,47 @@
+from multiprocessing import Lock, Value
+import time
+
+
+class RateLimiter:
+    """Token bucket in shared memory, so all processes forked after its creation share one request budget.
+    Rate is cut by backoff factor on throttled responses (HTTP 429/503) and grows back by
+    recovery part of max rate on successful ones, never going below min_rate"""
+
+    def __init__(self, rate, burst=1, min_rate=None, backoff=0.5, recovery=0.05):
+        self.max_rate = rate
+        self.burst = burst
+        self.min_rate = min_rate or rate / 100
+        self.backoff = backoff
+        self.recovery = recovery
+        self.lock = Lock()
+        self.rate = Value('d', rate, lock=False)
+        self.tokens = Value('d', burst, lock=False)
+        self.updated = Value('d', time.monotonic(), lock=False)
+
+
+    def _refill(self, now):
+        elapsed = now - self.updated.value
+        self.tokens.value = min(self.burst, self.tokens.value + elapsed * self.rate.value)
+        self.updated.value = now
+
+
+    def acquire(self):
+        """Take a token, waiting until it is available. Tokens are reserved in turn, so waiting processes never spin"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens.value -= 1
+            wait = -self.tokens.value / self.rate.value if self.tokens.value < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+    def report(self, throttled, retry_after=None):
+        """Adjust rate to server response. retry_after seconds pause every process"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if throttled:
+                self.rate.value = max(self.min_rate, self.rate.value * self.backoff)
+                pause = retry_after if retry_after is not None else 1 / self.rate.value
+                self.tokens.value = min(self.tokens.value, -pause * self.rate.value)
+            else:
+                self.rate.value = min(self.max_rate, self.rate.value + self.recovery * self.max_rate)
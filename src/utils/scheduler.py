@@ -0,0 +1,100 @@
+from threading import Thread
+import traceback
+
+
+def make_batches(file_names, batch_size):
+    """Split file names into lists of batch_size items"""
+    file_names = list(file_names)
+    return [file_names[i:i + batch_size] for i in range(0, len(file_names), batch_size)]
+
+
+class WorkItems:
+    """Iterate over file names taken in batches from shared task queue.
+    Every item is reported to result queue as finished when the next one is requested.
+    Batches end with None sentinel, one per worker"""
+
+    def __init__(self, task_queue, result_queue=None):
+        self.task_queue = task_queue
+        self.result_queue = result_queue
+        self.batch = []
+        self.current = None
+        self.outputs = []
+        self.exhausted = False
+
+
+    def __iter__(self):
+        while True:
+            self.done()
+            if not self.batch:
+                batch = self.task_queue.get()
+                if batch is None:
+                    self.exhausted = True
+                    return
+                self.batch = list(batch)
+            self.current = self.batch.pop(0)
+            yield self.current
+
+
+    def add_output(self, file_name):
+        self.outputs.append(file_name)
+
+
+    def _report(self, error=None):
+        if self.result_queue is not None:
+            self.result_queue.put((self.current, self.outputs, error))
+        self.current = None
+        self.outputs = []
+
+
+    def done(self):
+        """Report current item as processed"""
+        if self.current is not None:
+            self._report()
+
+
+    def fail(self, error):
+        """Report current item as failed. Items of the batch taken before the failure stay in the batch"""
+        self._report(''.join(traceback.format_exception(error)))
+
+
+    def fail_batch(self, error):
+        """Report every item of the current batch as failed, used when worker can't process anything"""
+        remaining = [self.current] if self.current is not None else []
+        remaining.extend(self.batch)
+        self.batch = []
+        for item in remaining:
+            self.current = item
+            self.fail(error)
+
+
+    def fail_remaining(self, error):
+        """Fail the current batch and every batch left in the task queue up to the sentinel.
+        Upstream stages keep putting batches into the queue, so worker which can't process anything still takes them"""
+        self.fail_batch(error)
+        while not self.exhausted:
+            batch = self.task_queue.get()
+            if batch is None:
+                self.exhausted = True
+            else:
+                self.batch = list(batch)
+                self.fail_batch(error)
+
+
+class ResultCollector(Thread):
+    """Drain result queue in the parent process while workers are running, so they never block on it"""
+
+    def __init__(self, result_queue):
+        super().__init__(daemon=True)
+        self.result_queue = result_queue
+        self.results = []
+
+
+    def run(self):
+        for result in iter(self.result_queue.get, None):
+            self.results.append(result)
+
+
+    def stop(self):
+        self.result_queue.put(None)
+        self.join()
+        return self.results
@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import weakref
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection which can be weakly referenced"""
+
+
+# Connections opened by this process
+_connections = weakref.WeakSet()
+# Connections inherited by forked process are kept alive and never closed in it: closing connection of the parent
+# releases its locks and may checkpoint write-ahead log of the database the parent and other processes still use
+_inherited_connections = []
+
+
+def _keep_inherited_connections():
+    _inherited_connections.extend(_connections)
+    _connections.clear()
+
+
+os.register_at_fork(after_in_child=_keep_inherited_connections)
+
+
+def connect(path, timeout=60, **kwargs):
+    """Open SQLite database in WAL mode, creating its directory. Every process should open its own connection"""
+    dir_name = os.path.dirname(path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=timeout, factory=Connection, **kwargs)
+    _connections.add(connection)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+class ProcessConnection:
+    """Connection to SQLite database opened on first use in every process, since connections can't be shared
+    with forked processes. setup is called with every new connection, e.g. to create tables"""
+
+    def __init__(self, path, setup=None, timeout=60, **kwargs):
+        self.path = path
+        self.setup = setup
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self._connection = None
+        self._pid = None
+
+
+    @property
+    def is_open(self):
+        """Whether this process has opened its connection"""
+        return self._connection is not None and self._pid == os.getpid()
+
+
+    def get(self):
+        if not self.is_open:
+            connection = connect(self.path, timeout=self.timeout, **self.kwargs)
+            if self.setup is not None:
+                self.setup(connection)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+
+    def checkpoint(self):
+        """Move write-ahead log into the database file and truncate it"""
+        self.get().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+    def close(self):
+        # Connection inherited from the parent is left to it
+        if self.is_open:
+            self._connection.close()
+        self._connection = None
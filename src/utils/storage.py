@@ -1,6 +1,10 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 import os
 from io import BytesIO
+import json
+import tarfile
+import uuid
 import boto3
 from botocore.config import Config
 from botocore.exceptions import ConnectionClosedError, ClientError
@@ -11,8 +15,10 @@ import time
 
 class Storage(ABC):
 
-    def __init__(self, file_exists_strategy='skip'):
+    def __init__(self, file_exists_strategy='skip', strict_exists_check=False):
         self.strategy = file_exists_strategy
+        self.strict_exists_check = strict_exists_check
+        self.existing_files = {}
 
 
     @abstractmethod
@@ -20,9 +26,37 @@ class Storage(ABC):
         pass
     
 
-    def _file_exists_handler(self, file_name, subdir):
+    def preload_existing(self, subdir, file_names=None):
+        """Load names of existing files in subdir with a single listing, or take them from e.g. dataset manifest"""
+        if file_names is None:
+            file_names = self.read_all(subdir)
+        self.existing_files[subdir] = set(file_names)
+
+
+    def _mark_existing(self, file_name, subdir, exists=True):
+        """Keep existence index up to date with files written or deleted by this instance"""
+        if subdir in self.existing_files:
+            if exists:
+                self.existing_files[subdir].add(file_name)
+            else:
+                self.existing_files[subdir].discard(file_name)
+
+
+    def _exists(self, file_names, subdir):
+        """Resolve existence of the files from the index, or ask storage for every file in strict mode"""
+        if self.strict_exists_check:
+            if len(file_names) == 1:
+                return [self.check_file_exists(file_names[0], subdir)]
+            return self.exists_many(file_names, subdir)
+        if subdir not in self.existing_files:
+            self.preload_existing(subdir)
+        return [file_name in self.existing_files[subdir] for file_name in file_names]
+
+
+    def _file_exists_handler(self, file_name, subdir, file_exists=None):
         """Returns True if save_file method in subclasses should be executed"""
-        file_exists = self.check_file_exists(file_name, subdir)
+        if file_exists is None:
+            file_exists = self._exists([file_name], subdir)[0]
         if file_exists:
             if self.strategy == 'skip':
                 return False 
@@ -35,10 +69,41 @@ class Storage(ABC):
         return True
 
 
+    def save_many(self, items, subdir=None):
+        """Save list of (content, file_name) pairs"""
+        for content, file_name in items:
+            self.save_file(content, file_name, subdir)
+
+
+    def read_many(self, file_names, subdir, file_type='text'):
+        """Read files in the given order"""
+        return [self.read_file(file_name, subdir, file_type) for file_name in file_names]
+
+
+    def exists_many(self, file_names, subdir):
+        """Check which of the files exist. Returns list of bools in the given order"""
+        return [self.check_file_exists(file_name, subdir) for file_name in file_names]
+
+
+    def close(self):
+        """Release resources and make everything written visible to other processes"""
+        pass
+
+
+    def _get_items_to_save(self, items, subdir):
+        """Filter (content, file_name) pairs according to file_exists_strategy checking existence of all files at once"""
+        items = list(items)
+        if not subdir:
+            return items
+        file_names = [file_name for _, file_name in items]
+        exists = self._exists(file_names, subdir)
+        return [item for item, file_exists in zip(items, exists) if self._file_exists_handler(item[1], subdir, file_exists)]
+
+
 class LocalStorage(Storage):
     
-    def __init__(self, dataset_name, file_exists_strategy='skip'):
-        super().__init__(file_exists_strategy=file_exists_strategy)
+    def __init__(self, dataset_name, file_exists_strategy='skip', strict_exists_check=False):
+        super().__init__(file_exists_strategy=file_exists_strategy, strict_exists_check=strict_exists_check)
         self.data_dir = dataset_name
 
 
@@ -51,16 +116,34 @@ class LocalStorage(Storage):
                 subdir_path = os.path.join(self.data_dir, subdir)
                 os.makedirs(subdir_path, exist_ok=True)
                 file_name = os.path.join(subdir_path, file_name)
+                self._write(content, file_name)
+                self._mark_existing(os.path.basename(file_name), subdir)
             else:
-                file_name = os.path.join(self.data_dir, file_name)
-
-            if isinstance(content, str):
-                with open(file_name, 'w', encoding='utf-8') as f:
-                    f.write(content)
-            elif isinstance(content, Image.Image):
-                content.save(file_name, format='PNG')
-            else:
-                raise TypeError('Content should be one of the types: str, ImageImage')
+                self._write(content, os.path.join(self.data_dir, file_name))
+
+
+    def save_many(self, items, subdir=None):
+        """Save list of (content, file_name) pairs creating subdir and checking existing files once"""
+        items = self._get_items_to_save(items, subdir)
+        subdir_path = os.path.join(self.data_dir, subdir) if subdir else self.data_dir
+        if items:
+            os.makedirs(subdir_path, exist_ok=True)
+        for content, file_name in items:
+            self._write(content, os.path.join(subdir_path, file_name))
+            self._mark_existing(file_name, subdir)
+
+
+    def _write(self, content, file_name):
+        if isinstance(content, str):
+            with open(file_name, 'w', encoding='utf-8') as f:
+                f.write(content)
+        elif isinstance(content, bytes):
+            with open(file_name, 'wb') as f:
+                f.write(content)
+        elif isinstance(content, Image.Image):
+            content.save(file_name, format='PNG')
+        else:
+            raise TypeError('Content should be one of the types: str, bytes, ImageImage')
 
 
     def read_file(self, file_name, subdir, file_type='text'):
@@ -71,10 +154,21 @@ class LocalStorage(Storage):
             return content
         elif file_type == 'image':
             return Image.open(file_name_full, mode='r')
+        elif file_type == 'bytes':
+            with open(file_name_full, 'rb') as f:
+                content = f.read()
+            return content
         else:
-            raise ValueError('Only "text" or "image" file type is supported')
+            raise ValueError('Only "text", "image" or "bytes" file type is supported')
         
 
+    def read_range(self, file_name, subdir, offset, size):
+        """Read size bytes of the file starting from offset"""
+        with open(os.path.join(self.data_dir, subdir, file_name), 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+
     def read_all(self, subdir, get_urls=False):
         """Get list of filenames in the specified path"""
         if not self.check_file_exists(file_name=None, subdir=subdir):
@@ -89,6 +183,13 @@ class LocalStorage(Storage):
         return file_names
     
 
+    def exists_many(self, file_names, subdir):
+        """Check which of the files exist with one directory listing"""
+        full_path = os.path.join(self.data_dir, subdir)
+        existing = set(os.listdir(full_path)) if os.path.isdir(full_path) else set()
+        return [file_name in existing for file_name in file_names]
+
+
     def check_file_exists(self, file_name=None, subdir=''):
         if file_name:
             file_name_full = os.path.join(self.data_dir, subdir, file_name)
@@ -101,22 +202,29 @@ class LocalStorage(Storage):
         if self.check_file_exists(file_name, subdir):
             file_name_full = os.path.join(self.data_dir, subdir, file_name)
             os.remove(file_name_full)
+        self._mark_existing(file_name, subdir, exists=False)
 
 
 class S3Storage(Storage):
     
-    def __init__(self, dataset_name, client_config, file_exists_strategy='skip'):
-        super().__init__(file_exists_strategy=file_exists_strategy)
+    def __init__(self, dataset_name, client_config, file_exists_strategy='skip', max_workers=16, strict_exists_check=False):
+        super().__init__(file_exists_strategy=file_exists_strategy, strict_exists_check=strict_exists_check)
         self.bucket_name = dataset_name
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
         self._get_s3_client(client_config)
 
 
     def _get_s3_client(self, client_config, retries=10, delay=1):
-        """Create s3 client"""
+        """Create s3 client. Its connection pool is shared by threads of bulk methods"""
         client_config.update(
             dict(
                 service_name='s3',
-                config=Config(retries={'max_attempts': retries, 'mode': 'standard'}),
+                config=Config(
+                    retries={'max_attempts': retries, 'mode': 'standard'},
+                    max_pool_connections=self.max_workers,
+                ),
             )
         )
         session = boto3.session.Session()
@@ -139,21 +247,43 @@ class S3Storage(Storage):
         self.s3 = s3
     
 
+    @property
+    def executor(self):
+        """Bounded thread pool for bulk methods, created on first use in every process"""
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._executor_pid = os.getpid()
+        return self._executor
+
+
     def save_file(self, content, file_name, subdir=None):
         # Decide whether file should be saved
         if not subdir or self._file_exists_handler(file_name, subdir):
-            if isinstance(content, str):
-                file_obj = BytesIO(content.encode("utf-8"))
-            elif isinstance(content, Image.Image):
-                file_obj = BytesIO()
-                content.save(file_obj, format='PNG')
-                file_obj.seek(0)
-            else:
-                raise TypeError('Content should be one of the types: str, ImageImage')
-            
-            if subdir:
-                file_name = f'{subdir}/{file_name}'
-            self.s3.upload_fileobj(file_obj, self.bucket_name, file_name)
+            self._upload(content, file_name, subdir)
+
+
+    def save_many(self, items, subdir=None):
+        """Save list of (content, file_name) pairs with concurrent requests"""
+        items = self._get_items_to_save(items, subdir)
+        list(self.executor.map(lambda item: self._upload(item[0], item[1], subdir), items))
+
+
+    def _upload(self, content, file_name, subdir=None):
+        if isinstance(content, str):
+            body = content.encode("utf-8")
+        elif isinstance(content, bytes):
+            body = content
+        elif isinstance(content, Image.Image):
+            file_obj = BytesIO()
+            content.save(file_obj, format='PNG')
+            body = file_obj.getvalue()
+        else:
+            raise TypeError('Content should be one of the types: str, bytes, ImageImage')
+        
+        # Dataset files are small, single request is cheaper than multipart transfer manager
+        key = f'{subdir}/{file_name}' if subdir else file_name
+        self.s3.put_object(Bucket=self.bucket_name, Key=key, Body=body)
+        self._mark_existing(file_name, subdir)
 
 
     def read_file(self, file_name, subdir, file_type='text'):
@@ -172,15 +302,35 @@ class S3Storage(Storage):
             # Open image using PIL
             file_data = BytesIO(file_data)
             return Image.open(file_data)
+        elif file_type == 'bytes':
+            return file_data
         else:
-            raise ValueError('Only "text" or "image" file type is supported')
+            raise ValueError('Only "text", "image" or "bytes" file type is supported')
         
 
+    def read_range(self, file_name, subdir, offset, size):
+        """Read size bytes of the object starting from offset with ranged request"""
+        file_name_full = f'{subdir}/{file_name}'
+        response = self.s3.get_object(Bucket=self.bucket_name, Key=file_name_full, Range=f'bytes={offset}-{offset + size - 1}')
+        return response['Body'].read()
+
+
+    def read_many(self, file_names, subdir, file_type='text'):
+        """Read files in the given order with concurrent requests"""
+        return list(self.executor.map(lambda file_name: self.read_file(file_name, subdir, file_type), file_names))
+
+
+    def exists_many(self, file_names, subdir):
+        """Check which of the files exist with concurrent requests"""
+        return list(self.executor.map(lambda file_name: self.check_file_exists(file_name, subdir), file_names))
+
+
     def read_all(self, subdir, page_size=1000, get_urls=False):    
         """Get list of object names with the specified prefix"""
         objects = []
+        prefix = f'{subdir.rstrip("/")}/' if subdir else ''
         paginator = self.s3.get_paginator("list_objects_v2")
-        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=subdir, PaginationConfig={'PageSize': page_size}):
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, PaginationConfig={'PageSize': page_size}):
             objects.extend(obj["Key"] for obj in page.get("Contents", []))
 
         if get_urls:
@@ -206,3 +356,202 @@ class S3Storage(Storage):
         if self.check_file_exists(file_name, subdir):
             file_name_full = f"{subdir}/{file_name}"
             self.s3.delete_object(Bucket=self.bucket_name, Key=file_name_full)
+        self._mark_existing(file_name, subdir, exists=False)
+
+
+class ShardStorage(Storage):
+    """Append files into rolling tar shards with sidecar index of byte offsets for random access.
+    Every instance writes its own shards, so processes never share an open shard.
+    Shards are put to destination storage ('local' or 'S3') once they reach shard_size or storage is closed.
+    Local shards are written in place, so other processes read files of open shards too"""
+
+    def __init__(
+            self,
+            dataset_name,
+            destination='local',
+            destination_params=None,
+            shard_size=256 * 2 ** 20,
+            shards_subdir='shards',
+            tmp_dir='tmp_shards',
+            file_exists_strategy='skip',
+            strict_exists_check=False,
+        ):
+        super().__init__(file_exists_strategy=file_exists_strategy, strict_exists_check=strict_exists_check)
+        destination_cls = {'local': LocalStorage, 'S3': S3Storage}[destination]
+        self.destination = destination_cls(dataset_name, **(destination_params or {}))
+        self.shard_size = shard_size
+        self.shards_subdir = shards_subdir
+
+        # Local shards are written in place, remote ones are uploaded when finished
+        if destination == 'local':
+            self.shards_dir = os.path.join(dataset_name, shards_subdir)
+        else:
+            self.shards_dir = tmp_dir
+        self.upload = destination != 'local'
+
+        self.prefix = f'shard-{uuid.uuid4().hex[:12]}'
+        self.shard_num = 0
+        self.shard_name = None
+        self._file = None
+        self._tar = None
+        self._index_file = None
+        self.index = {}
+
+
+    @property
+    def shares_open_shards(self):
+        """Whether other processes can read files before the shard is closed, like streaming stages do"""
+        return not self.upload
+
+
+    def _open_shard(self):
+        os.makedirs(self.shards_dir, exist_ok=True)
+        self.shard_name = f'{self.prefix}-{self.shard_num:05d}.tar'
+        self._file = open(os.path.join(self.shards_dir, self.shard_name), 'wb')
+        self._tar = tarfile.open(fileobj=self._file, mode='w')
+        self._index_file = open(os.path.join(self.shards_dir, f'{self.shard_name}.idx'), 'w', encoding='utf-8')
+
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        self._file.close()
+        self._index_file.close()
+        if self.upload:
+            for file_name in (self.shard_name, f'{self.shard_name}.idx'):
+                file_path = os.path.join(self.shards_dir, file_name)
+                with open(file_path, 'rb') as f:
+                    self.destination.save_file(f.read(), file_name, self.shards_subdir)
+                os.remove(file_path)
+            # Entries of uploaded shard are read from destination now
+            for entry in self.index.values():
+                entry['local'] = False
+        self._tar = None
+        self.shard_num += 1
+
+
+    def _append(self, key, data):
+        """Append member to current shard and its index"""
+        if self._tar is None:
+            self._open_shard()
+
+        if data is None:
+            # Deleted files are marked in the index only
+            entry = {'key': key, 'shard': self.shard_name, 'offset': 0, 'size': -1}
+        else:
+            info = tarfile.TarInfo(key)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, BytesIO(data))
+            self._file.flush()
+            data_offset = self._tar.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            entry = {'key': key, 'shard': self.shard_name, 'offset': data_offset, 'size': len(data)}
+        entry['time'] = time.time()
+
+        self._index_file.write(json.dumps(entry) + '\n')
+        self._index_file.flush()
+        entry['local'] = self.upload
+        self.index[key] = entry
+
+        if self._tar.offset >= self.shard_size:
+            self._close_shard()
+
+
+    def load_index(self):
+        """Merge sidecar indexes of all shards in destination. The latest entry of every key wins"""
+        index_names = [i for i in self.destination.read_all(self.shards_subdir) if i.endswith('.idx')]
+        index = {}
+        for content in self.destination.read_many(index_names, self.shards_subdir):
+            for line in content.splitlines():
+                if line:
+                    entry = json.loads(line)
+                    entry['local'] = False
+                    if entry['key'] not in index or index[entry['key']]['time'] <= entry['time']:
+                        index[entry['key']] = entry
+
+        # Not uploaded entries of this instance are newer than anything in destination
+        index.update({key: entry for key, entry in self.index.items() if entry['local'] or key not in index})
+        self.index = index
+        return index
+
+
+    def _get_entry(self, file_name, subdir):
+        key = f'{subdir}/{file_name}'
+        if key not in self.index:
+            self.load_index()
+        entry = self.index.get(key)
+        if entry is None or entry['size'] < 0:
+            raise FileNotFoundError(f'File "{file_name}" not found in subdir "{subdir}"')
+        return entry
+
+
+    def save_file(self, content, file_name, subdir=None):
+        if not subdir:
+            # Files out of dataset subdirs, like ui.py, are not sharded
+            self.destination.save_file(content, file_name)
+        elif self._file_exists_handler(file_name, subdir):
+            if isinstance(content, str):
+                data = content.encode('utf-8')
+            elif isinstance(content, bytes):
+                data = content
+            elif isinstance(content, Image.Image):
+                file_obj = BytesIO()
+                content.save(file_obj, format='PNG')
+                data = file_obj.getvalue()
+            else:
+                raise TypeError('Content should be one of the types: str, bytes, ImageImage')
+            self._append(f'{subdir}/{file_name}', data)
+            self._mark_existing(file_name, subdir)
+
+
+    def read_file(self, file_name, subdir, file_type='text'):
+        entry = self._get_entry(file_name, subdir)
+        if entry['local']:
+            with open(os.path.join(self.shards_dir, entry['shard']), 'rb') as f:
+                f.seek(entry['offset'])
+                file_data = f.read(entry['size'])
+        else:
+            file_data = self.destination.read_range(entry['shard'], self.shards_subdir, entry['offset'], entry['size'])
+
+        if file_type == 'text':
+            return file_data.decode('utf-8')
+        elif file_type == 'image':
+            return Image.open(BytesIO(file_data))
+        elif file_type == 'bytes':
+            return file_data
+        else:
+            raise ValueError('Only "text", "image" or "bytes" file type is supported')
+
+
+    def read_all(self, subdir, get_urls=False):
+        """Get list of file names in the subdir"""
+        if get_urls:
+            raise NotImplementedError('Files in shards have no urls')
+        prefix = f'{subdir.rstrip("/")}/'
+        return [key[len(prefix):] for key, entry in self.load_index().items() if key.startswith(prefix) and entry['size'] >= 0]
+
+
+    def check_file_exists(self, file_name=None, subdir=''):
+        if file_name:
+            key = f'{subdir}/{file_name}'
+            if key not in self.index:
+                self.load_index()
+            entry = self.index.get(key)
+            return entry is not None and entry['size'] >= 0
+        return bool(self.read_all(subdir))
+
+
+    def exists_many(self, file_names, subdir):
+        existing = set(self.read_all(subdir))
+        return [file_name in existing for file_name in file_names]
+
+
+    def delete_file(self, file_name, subdir):
+        if self.check_file_exists(file_name, subdir):
+            self._append(f'{subdir}/{file_name}', None)
+        self._mark_existing(file_name, subdir, exists=False)
+
+
+    def close(self):
+        self._close_shard()
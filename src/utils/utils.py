@@ -5,10 +5,16 @@ from string import Template
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-from math import ceil
-from multiprocessing import Process
+from multiprocessing import Process, Queue
 
-from src.utils.storage import LocalStorage, S3Storage
+from src.utils.manifest import Manifest
+from src.utils.scheduler import ResultCollector, WorkItems, make_batches
+from src.utils.storage import LocalStorage, S3Storage, ShardStorage
+
+
+def get_sample_id(file_name):
+    """Get sample number from file name like title_12.txt"""
+    return int(file_name.split('_')[1].split('.')[0])
 
 
 def generate_ui_script(images_path, boxes_path, texts_path):
@@ -39,27 +45,130 @@ class DataCreator(ABC):
         self.storage_type = storage_type
         self.storage_params = storage_params
         self.subdir = subdir
+        self.output_queue = None
+        self.work_items = None
+        self.manifest_path = None
+        self.manifest = None
+        self.storage = None
 
 
     @abstractmethod
     def process(self):
         pass
-        
-    
-    def __call__(self, process_params, input_data_subdir=None, dataset_size=None, start_index=0, num_processes=5):
 
+
+    def get_storage(self, storage_type, storage_params):
+        """Storage of the worker. It is created once and closed when the worker exits"""
+        if self.storage is None:
+            storage_cls = DatasetFactory.get_storage(storage_type)
+            storage_params_copy = copy.deepcopy(storage_params)
+            self.storage = storage_cls(**storage_params_copy)
+        return self.storage
+
+
+    def iter_file_names(self, file_names, input_queue=None):
+        """Yield file names of the static chunk or take them in batches from shared task queue until sentinel"""
+        if input_queue is None:
+            yield from file_names
+        else:
+            yield from self.work_items
+
+
+    def emit(self, file_name):
+        """Register produced file name and pass it to the next stage in streaming mode"""
+        if self.work_items is not None:
+            self.work_items.add_output(file_name)
+        if self.manifest is not None:
+            self.manifest.add(get_sample_id(file_name), self.subdir)
+        if self.output_queue is not None:
+            self.output_queue.put([file_name])
+
+
+    def pass_on(self, file_names):
+        """Register files saved together and pass them to the next stage as one batch.
+        Unlike emit, they are not added to outputs of the current item"""
+        if self.manifest is not None:
+            self.manifest.add_many([get_sample_id(file_name) for file_name in file_names], self.subdir)
+        if self.output_queue is not None:
+            self.output_queue.put(list(file_names))
+
+
+    def finish(self):
+        """Called once when the worker is done, e.g. to save outputs buffered across batches"""
+        pass
+
+
+    def _run_process(self, input_queue, result_queue=None, output_queue=None, **process_params):
+        """Persistent worker. Takes batches from the task queue until sentinel.
+        If an item fails, the error is reported and processing goes on with the next item"""
+        self.output_queue = output_queue
+        self.work_items = WorkItems(input_queue, result_queue)
+        if self.manifest_path:
+            self.manifest = Manifest(self.manifest_path)
+        try:
+            while not self.work_items.exhausted:
+                try:
+                    self.process(input_queue=input_queue, **process_params)
+                    self.work_items.done()
+                except Exception as e:
+                    if self.work_items.current is None:
+                        # Failed before any item was taken, e.g. storage or driver set up.
+                        # Batches are drained anyway, so that upstream stages never block on a full queue
+                        self.work_items.fail_remaining(e)
+                        raise
+                    self.work_items.fail(e)
+        finally:
+            try:
+                self.finish()
+            finally:
+                if self.storage is not None:
+                    self.storage.close()
+                if self.manifest is not None:
+                    self.manifest.close()
+
+
+    def get_file_names(self, input_data_subdir=None, dataset_size=None, start_index=0):
+        """List input files of the stage or sample numbers for the first stage"""
         storage_cls = DatasetFactory.get_storage(self.storage_type)
         storage_params_copy = copy.deepcopy(self.storage_params)
         storage = storage_cls(**storage_params_copy)
 
         if input_data_subdir and not dataset_size:
-            file_names = storage.read_all(input_data_subdir)[start_index:]
+            return storage.read_all(input_data_subdir)[start_index:]
         elif dataset_size and not input_data_subdir:
-            file_names = range(dataset_size)[start_index:]
+            return range(dataset_size)[start_index:]
         else:
             raise ValueError('One should provide either "input_data_subdir" or "dataset_size"')
-        
-        chunk_size = ceil(len(file_names) / num_processes)
+
+
+    def start(
+            self,
+            process_params,
+            input_data_subdir=None,
+            dataset_size=None,
+            start_index=0,
+            num_processes=None,
+            batch_size=8,
+            input_queue=None,
+            output_queue=None,
+            result_queue=None,
+            file_names=None,
+        ):
+        """Start persistent worker processes without waiting for them to finish.
+        Workers take batches of file names from shared queue, so idle ones pick up the work left by slow ones.
+        If input_queue is provided, batches come from upstream stage, otherwise they are put here.
+        Explicit file_names take precedence over listing input_data_subdir"""
+        num_processes = num_processes or os.cpu_count()
+
+        if input_queue is None:
+            if file_names is None:
+                file_names = self.get_file_names(input_data_subdir, dataset_size, start_index)
+            input_queue = Queue()
+            for batch in make_batches(file_names, batch_size):
+                input_queue.put(batch)
+            for _ in range(num_processes):
+                input_queue.put(None)
+
         processes = []
         process_params.update({
             'subdir': self.subdir,
@@ -67,21 +176,41 @@ class DataCreator(ABC):
             'dataset_size': dataset_size,
             'storage_type': self.storage_type,
             'storage_params': self.storage_params,
+            'input_queue': input_queue,
+            'output_queue': output_queue,
+            'result_queue': result_queue,
+            'file_names': [],
         })
 
         for chunk_num in range(num_processes):
-            chunk = file_names[chunk_num * chunk_size:(chunk_num + 1) * chunk_size]
-            process_params['file_names'] = chunk
             process_params['chunk_num'] = chunk_num
             pr = Process(
-                target=self.process,
+                target=self._run_process,
                 kwargs=process_params,
             )
             processes.append(pr)
             pr.start()
-
+        return processes
+        
+    
+    def __call__(self, process_params, input_data_subdir=None, dataset_size=None, start_index=0, num_processes=None, batch_size=8, file_names=None):
+        """Process all file names and return list of (file_name, produced_file_names, error) for every item"""
+        result_queue = Queue()
+        collector = ResultCollector(result_queue)
+        collector.start()
+        processes = self.start(
+            process_params,
+            input_data_subdir,
+            dataset_size,
+            start_index,
+            num_processes,
+            batch_size,
+            result_queue=result_queue,
+            file_names=file_names,
+        )
         for pr in processes:
             pr.join()
+        return collector.stop()
         
 
 class BaseProcessor:
@@ -107,7 +236,7 @@ class DatasetFactory:
 
     @classmethod
     def get_storage(self, storage_type='local'):
-        classes = {'local': LocalStorage, 'S3': S3Storage}
+        classes = {'local': LocalStorage, 'S3': S3Storage, 'shard': ShardStorage}
         return classes[storage_type]
 
 
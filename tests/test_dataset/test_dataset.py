@@ -0,0 +1,101 @@
+from moto import mock_aws
+import pytest
+
+from src.dataset.dataset import OCRDataset
+from src.images import images
+from src.images.images import ImageCreator
+from src.layouts.layouts import HTMLCreator
+from src.parsers.parsers import LocalCorpusParser
+from src.utils.storage import LocalStorage
+from src.utils.utils import get_sample_id
+
+
+TEXT_CONFIG = {'strip_sentences': {}}
+HTML_CONFIG = {'get_colors': {}, 'get_font': {'font_size_range': (10, 20)}, 'get_text_position': {}}
+
+
+def make_dataset(tmp_path, storage_type='local', storage_params=None, backend='pillow', **kwargs):
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    corpus_path = tmp_path / 'corpus.txt'
+    corpus_path.write_text('\n'.join(f'Document number {i} is here.' for i in range(100)), encoding='utf-8')
+    return OCRDataset(
+        driver_path=None,
+        parser=LocalCorpusParser,
+        html_creator=HTMLCreator,
+        image_creator=ImageCreator,
+        storage_type=storage_type,
+        storage_params=storage_params or {'dataset_name': str(tmp_path / 'dataset')},
+        manifest_path=str(tmp_path / 'manifest.sqlite'),
+        parser_params={'corpus_paths': str(corpus_path), 'order': 'sequential'},
+        image_creator_params={'backend': backend, 'renderer_params': {'width': 200, 'height': 100}},
+        **kwargs,
+    )
+
+
+def test_OCRDataset_streaming_rejects_remote_shards(tmp_path):
+    with mock_aws():
+        dataset = make_dataset(tmp_path, 'shard', {
+            'dataset_name': 'test-bucket',
+            'destination': 'S3',
+            'destination_params': {'client_config': {'region_name': 'us-east-1'}},
+            'tmp_dir': str(tmp_path / 'tmp_shards'),
+        })
+        with pytest.raises(ValueError, match='Shards of remote destination*'):
+            dataset({'strip_sentences': {}}, {}, {}, dataset_size=10, num_processes=1, streaming=True)
+
+
+def get_stage_ids(dataset):
+    storage = LocalStorage(dataset.dataset_name)
+    return {subdir: sorted(get_sample_id(name) for name in storage.read_all(subdir)) for subdir in ('texts', 'images')}
+
+
+def get_texts(dataset):
+    storage = LocalStorage(dataset.dataset_name)
+    return {get_sample_id(name): storage.read_file(name, 'texts') for name in storage.read_all('texts')}
+
+
+@pytest.mark.parametrize('layout_table', [False, True])
+def test_OCRDataset_streaming_matches_sequential(tmp_path, layout_table):
+    runs = {}
+    for streaming in (False, True):
+        dataset = make_dataset(tmp_path / f'streaming_{streaming}', layout_table=layout_table)
+        errors = dataset(TEXT_CONFIG, HTML_CONFIG, {}, dataset_size=12, num_processes=2, streaming=streaming, batch_size=4)
+        assert errors == []
+        assert dataset.get_size() == 12
+        runs[streaming] = (get_stage_ids(dataset), sorted(get_texts(dataset).values()))
+
+    assert runs[True] == runs[False]
+    assert runs[True][0] == {'texts': list(range(12)), 'images': list(range(12))}
+    assert runs[True][1] == sorted(f'Document number {i} is here.' for i in range(12))
+
+
+def fail_driver_setup(driver_path):
+    raise RuntimeError('Chrome is not available')
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_OCRDataset_resumes_partial_run(tmp_path, monkeypatch, streaming):
+    # Image stage fails in setup, so the first run leaves samples with texts and pages but no images
+    with monkeypatch.context() as m:
+        m.setattr(images, 'set_driver', fail_driver_setup)
+        dataset = make_dataset(tmp_path, backend='selenium')
+        errors = dataset(TEXT_CONFIG, HTML_CONFIG, {}, dataset_size=10, num_processes=2, streaming=streaming, batch_size=4)
+    assert len(errors) == 10
+    assert all('Chrome is not available' in error for _, error in errors)
+    assert dataset.get_size() == 0
+    texts = get_texts(dataset)
+    assert sorted(texts) == list(range(10))
+
+    dataset = make_dataset(tmp_path)
+    dataset.load_manifest()
+    pending_texts, pending_pages, pending_images = dataset.get_pending_file_names(12)
+    assert pending_texts == [10, 11]
+    assert pending_pages == []
+    assert len(pending_images) == 10
+
+    errors = dataset(TEXT_CONFIG, HTML_CONFIG, {}, dataset_size=12, num_processes=2, streaming=streaming, batch_size=4)
+    assert errors == []
+    assert dataset.get_size() == 12
+    assert get_stage_ids(dataset) == {'texts': list(range(12)), 'images': list(range(12))}
+    # Texts of the first run are not parsed again
+    assert {num: text for num, text in get_texts(dataset).items() if num < 10} == texts
@@ -0,0 +1,163 @@
+from io import BytesIO
+
+from PIL import Image
+import pytest
+
+from src.images import images
+from src.images.images import ImageCreator
+from src.layouts.assets import BackgroundStore
+from src.layouts.layouts_utils import LayoutTable, dump_page_params
+from src.utils.storage import LocalStorage
+
+
+class FakeDriver:
+    """Record browser calls made by ImageCreator"""
+
+    def __init__(self):
+        self.calls = []
+        self.params = []
+
+
+    def get(self, url):
+        self.calls.append('get')
+
+
+    def execute_script(self, script, *args):
+        self.calls.append('execute_script')
+        if 'innerWidth' in script:
+            return [800, 600]
+        if 'getBoundingClientRect' in script:
+            return {'top': 10, 'left': 10, 'width': 100, 'height': 20}
+        return 600
+
+
+    def execute_async_script(self, script, params):
+        self.calls.append('execute_async_script')
+        self.params.append(params)
+        return {'coords': {'top': 10, 'left': 10, 'width': 100, 'height': 20}, 'width': 800, 'height': 600}
+
+
+    def get_screenshot_as_png(self):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'white').save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+    def quit(self):
+        self.calls.append('quit')
+
+
+@pytest.mark.parametrize("embed_params,expected_gets", [
+    (True, 1),
+    (False, 3),
+])
+def test_ImageCreator_reuses_loaded_page(tmp_path, monkeypatch, embed_params, expected_gets):
+    driver = FakeDriver()
+    monkeypatch.setattr(images, 'set_driver', lambda driver_path: driver)
+    storage = LocalStorage(str(tmp_path))
+    for i in range(3):
+        params_json = dump_page_params(f'text {i}', {'font': 'Arial'}) if embed_params else ''
+        page = f"<div id='Text'>text {i}</div><script id='Params' type=\"application/json\">{params_json}</script>"
+        storage.save_file(page if embed_params else f"<div id='Text'>text {i}</div>", f'page_{i}.html', 'pages')
+
+    creator = ImageCreator('local', {'dataset_name': str(tmp_path)}, driver_path=None, bbox_subdir='labels')
+    creator.process(
+        file_names=[f'page_{i}.html' for i in range(3)],
+        subdir='images',
+        input_data_subdir='pages',
+        bbox_subdir='labels',
+        processor_config={},
+        storage_type='local',
+        storage_params={'dataset_name': str(tmp_path)},
+        chunk_num=0,
+    )
+
+    assert driver.calls.count('get') == expected_gets
+    assert driver.calls.count('execute_async_script') == (3 if embed_params else 0)
+    assert driver.calls[-1] == 'quit'
+    assert len(storage.read_all('labels')) == 3
+
+
+def test_ImageCreator_resolves_background_by_id(tmp_path):
+    bg_images = tmp_path / 'bg_images'
+    bg_images.mkdir()
+    Image.new('RGB', (100, 100), (255, 0, 0)).save(bg_images / 'red.png')
+    store = BackgroundStore(str(bg_images), sizes=[(200, 100)]).build()
+    params = {
+        'bg_image': '', 'bg_image_id': store.ids[0], 'bg_store': store.store_dir, 'bg_color': '#ffffff',
+        'font': 'Arial', 'font_size': 10, 'text_color': '#000000', 'top': 50, 'left': 50,
+    }
+    storage = LocalStorage(str(tmp_path))
+    storage.save_file(f"<script id='Params' type=\"application/json\">{dump_page_params('text', params)}</script>", 'page_0.html', 'pages')
+
+    creator = ImageCreator('local', {'dataset_name': str(tmp_path)}, driver_path=None, backend='pillow', renderer_params={'width': 200, 'height': 100})
+    creator.process(
+        file_names=['page_0.html'],
+        subdir='images',
+        input_data_subdir='pages',
+        bbox_subdir=None,
+        processor_config={},
+        storage_type='local',
+        storage_params={'dataset_name': str(tmp_path)},
+        chunk_num=0,
+    )
+
+    img = Image.open(BytesIO(storage.read_file('image_0.png', 'images', file_type='bytes')))
+    red, green, blue = img.convert('RGB').getpixel((5, 5))
+    assert red > 200 and green < 50 and blue < 50
+
+
+@pytest.mark.parametrize("reuse_page", [True, False])
+def test_ImageCreator_loads_assets_from_server(tmp_path, monkeypatch, reuse_page):
+    driver = FakeDriver()
+    monkeypatch.setattr(images, 'set_driver', lambda driver_path: driver)
+    bg_images = tmp_path / 'bg_images'
+    bg_images.mkdir()
+    Image.new('RGB', (100, 100), (255, 0, 0)).save(bg_images / 'red.png')
+    store = BackgroundStore(str(bg_images)).build()
+    storage = LocalStorage(str(tmp_path))
+    for i in range(2):
+        params_json = dump_page_params(f'text {i}', {'font': 'Arial', 'bg_image': '', 'bg_image_id': store.ids[0], 'bg_store': store.store_dir})
+        storage.save_file(f"<script id='Params' type=\"application/json\">{params_json}</script>", f'page_{i}.html', 'pages')
+
+    creator = ImageCreator('local', {'dataset_name': str(tmp_path)}, driver_path=None, reuse_page=reuse_page, asset_server=True)
+    creator.process(
+        file_names=['page_0.html', 'page_1.html'],
+        subdir='images',
+        input_data_subdir='pages',
+        bbox_subdir=None,
+        processor_config={},
+        storage_type='local',
+        storage_params={'dataset_name': str(tmp_path)},
+        chunk_num=0,
+    )
+
+    assert driver.calls.count('get') == (1 if reuse_page else 2)
+    assert [params['bg_image'].split('/')[-1] for params in driver.params] == [f'{store.ids[0]}_800x600.jpg'] * 2
+    assert all(params['bg_image'].startswith('http://127.0.0.1:') for params in driver.params)
+
+
+@pytest.mark.parametrize("backend,reuse_page", [('pillow', True), ('selenium', True), ('selenium', False)])
+def test_ImageCreator_renders_layout_table(tmp_path, monkeypatch, backend, reuse_page):
+    driver = FakeDriver()
+    monkeypatch.setattr(images, 'set_driver', lambda driver_path: driver)
+    storage = LocalStorage(str(tmp_path))
+    params = {'bg_image': '', 'bg_color': '#ffffff', 'font': 'Arial', 'font_size': 10, 'text_color': '#000000', 'top': 50, 'left': 50}
+    LayoutTable(storage, 'pages').write([{'id': i, 'text': f'text {i}', **params} for i in range(3)])
+
+    creator = ImageCreator('local', {'dataset_name': str(tmp_path)}, driver_path=None, backend=backend, reuse_page=reuse_page, layout_table=True)
+    creator.process(
+        file_names=[f'layout_{i}.json' for i in range(3)],
+        subdir='images',
+        input_data_subdir='pages',
+        bbox_subdir='labels',
+        processor_config={},
+        storage_type='local',
+        storage_params={'dataset_name': str(tmp_path)},
+        chunk_num=0,
+    )
+
+    assert sorted(storage.read_all('images')) == [f'image_{i}.png' for i in range(3)]
+    if backend == 'selenium':
+        assert driver.calls.count('get') == (1 if reuse_page else 3)
+        assert [params['text'] for params in driver.params] == ([f'text {i}' for i in range(3)] if reuse_page else [])
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from src.images.renderers import PillowRenderer, wrap_words
+from src.layouts.fonts import load_font
+
+
+@pytest.fixture
+def page_params():
+    params = {
+        'text': 'The quick brown fox jumps over the lazy dog',
+        'bg_image': '',
+        'bg_color': '#ffffff',
+        'text_color': '#000000',
+        'font': 'Arial',
+        'font_size': 30,
+        'top': 50,
+        'left': 50,
+        'text_highlight_color': '#ff0000',
+        'highlight_padding_height': 10,
+        'highlight_padding_width': 20,
+        'highlight_rounding': 5,
+    }
+    return params
+
+
+def test_wrap_words():
+    font = load_font('Arial', 20)
+    words = 'The quick brown fox jumps over the lazy dog'.split()
+    lines = wrap_words(words, font, font.getlength('The quick brown'))
+
+    assert ' '.join(lines) == ' '.join(words)
+    assert all(font.getlength(line) <= font.getlength('The quick brown') for line in lines)
+    assert wrap_words(['unbreakable'], font, 1) == ['unbreakable']
+
+
+@pytest.mark.parametrize("highlight_color", ['#ff0000', ''])
+def test_PillowRenderer_call(page_params, highlight_color):
+    page_params['text_highlight_color'] = highlight_color
+    renderer = PillowRenderer(width=800, height=600)
+    img, coords = renderer(page_params)
+    img = np.array(img)
+
+    assert img.shape == (600, 800, 3)
+    assert coords['left'] >= 0 and coords['left'] + coords['width'] <= 800
+    assert coords['top'] >= 0 and coords['top'] + coords['height'] <= 600
+
+    # Everything drawn lies inside the text box
+    drawn = np.argwhere((img != 255).any(axis=2))
+    assert drawn[:, 0].min() >= coords['top'] and drawn[:, 0].max() < coords['top'] + coords['height']
+    assert drawn[:, 1].min() >= coords['left'] and drawn[:, 1].max() < coords['left'] + coords['width']
+    assert (img == 0).all(axis=2).any()
+
+
+def test_PillowRenderer_wraps_text_near_right_edge(page_params):
+    renderer = PillowRenderer(width=800, height=600)
+    page_params['font_size'] = 20
+    page_params['left'] = 10
+    layout = renderer.layout(page_params)
+    page_params['left'] = 90
+    wrapped_layout = renderer.layout(page_params)
+
+    assert len(layout['lines']) == 1
+    assert len(wrapped_layout['lines']) > 1
+    assert wrapped_layout['coords']['height'] > layout['coords']['height']
@@ -0,0 +1,115 @@
+import os
+import urllib.error
+import urllib.request
+
+import matplotlib
+from PIL import Image
+import pytest
+
+from src.layouts.assets import AssetServer, BackgroundStore, LRUCache
+from src.layouts.fonts import get_font_face_css
+
+
+@pytest.fixture
+def bg_images(tmp_path):
+    path = tmp_path / 'bg_images'
+    path.mkdir()
+    Image.new('RGB', (200, 100), 'red').save(path / 'red.png')
+    Image.new('RGB', (100, 200), 'blue').save(path / 'blue.jpg')
+    (path / 'notes.txt').write_text('not an image')
+    return path
+
+
+def test_LRUCache():
+    cache = LRUCache(max_bytes=10)
+    cache.put('a', b'1234')
+    cache.put('b', b'1234')
+    cache.get('a')
+    cache.put('c', b'1234')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234'
+    assert cache.size == 8
+    cache.put('d', b'x' * 11)
+    assert cache.get('d') is None
+    assert len(cache) == 2
+
+
+def test_BackgroundStore(bg_images):
+    store = BackgroundStore(str(bg_images), sizes=[(40, 30), (80, 60)]).build()
+
+    assert len(store.ids) == 2
+    for image_id in store.ids:
+        for size in store.sizes:
+            with Image.open(store.get_variant_path(image_id, size)) as img:
+                assert img.size == size
+                assert img.format == 'JPEG'
+
+    # Smallest covering variant is taken, the largest one for bigger canvases
+    assert store.choose_size(40, 30) == (40, 30)
+    assert store.choose_size(50, 30) == (80, 60)
+    assert store.choose_size(800, 600) == (80, 60)
+    assert store.get_url(store.ids[0], 40, 30).startswith('data:image/jpeg;base64,')
+    assert len(store.cache) == 1
+
+    loaded = BackgroundStore(None, store.store_dir).load()
+    assert loaded.ids == store.ids
+    assert loaded.sizes == store.sizes
+
+
+def test_BackgroundStore_build_is_incremental(bg_images):
+    store = BackgroundStore(str(bg_images), sizes=[(40, 30)]).build()
+    mtimes = {image_id: os.stat(store.get_variant_path(image_id, (40, 30))).st_mtime_ns for image_id in store.ids}
+
+    os.remove(bg_images / 'blue.jpg')
+    store = BackgroundStore(str(bg_images), sizes=[(40, 30)]).build()
+
+    assert len(store.ids) == 1
+    assert len([name for name in os.listdir(store.store_dir) if name.endswith('.jpg')]) == 1
+    # Variants of unchanged images are not made again
+    assert os.stat(store.get_variant_path(store.ids[0], (40, 30))).st_mtime_ns == mtimes[store.ids[0]]
+
+
+def test_BackgroundStore_without_index(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        BackgroundStore(None, str(tmp_path)).load()
+
+
+def test_AssetServer(tmp_path):
+    (tmp_path / 'assets').mkdir()
+    (tmp_path / 'assets' / 'image one.jpg').write_bytes(b'content')
+    (tmp_path / 'secret.txt').write_text('secret')
+    server = AssetServer().start()
+    try:
+        url = server.get_url(str(tmp_path / 'assets' / 'image one.jpg'))
+        with urllib.request.urlopen(url, timeout=10) as response:
+            assert response.read() == b'content'
+            assert 'immutable' in response.headers['Cache-Control']
+            assert response.headers['Access-Control-Allow-Origin'] == '*'
+
+        # Only files of registered folders are served
+        for path in ('/../secret.txt', f'/{url.split("/")[3]}/../secret.txt', '/unknown/secret.txt'):
+            with pytest.raises(urllib.error.HTTPError, match='404'):
+                urllib.request.urlopen(f'http://{server.host}:{server.port}{path}', timeout=10)
+    finally:
+        server.stop()
+
+
+def test_BackgroundStore_get_url_from_server(bg_images):
+    store = BackgroundStore(str(bg_images), sizes=[(40, 30)]).build()
+    server = AssetServer().start()
+    try:
+        url = store.get_url(store.ids[0], 40, 30, server)
+        assert url.startswith(f'http://127.0.0.1:{server.port}/')
+        with urllib.request.urlopen(url, timeout=10) as response:
+            assert response.read() == store.read(store.ids[0], 40, 30)
+    finally:
+        server.stop()
+
+
+def test_get_font_face_css():
+    font_dir = os.path.join(os.path.dirname(matplotlib.__file__), 'mpl-data', 'fonts', 'ttf')
+    css = get_font_face_css([font_dir], lambda path: f'http://assets/{os.path.basename(path)}')
+
+    assert '@font-face { font-family: "DejaVu Sans"; src: url("http://assets/DejaVuSans.ttf"); }' in css
+    assert css.count('font-family: "DejaVu Sans";') == 1
@@ -1,6 +1,24 @@
+from PIL import Image
 import pytest
 
-from src.layouts.layouts_utils import HTMLProcessor
+from src.layouts.assets import BackgroundStore
+from src.layouts.layouts import HTMLCreator
+from src.layouts.layouts_utils import (
+    HTMLProcessor,
+    LayoutTable,
+    batch_to_params,
+    dump_page_params,
+    get_color_pairs,
+    get_contrast_ratio,
+    get_layout_name,
+    get_layout_shard,
+    get_page_params,
+    render_page,
+)
+from src.layouts.text_fit import TextFitter
+from src.utils.manifest import Manifest
+from src.utils.storage import LocalStorage
+from src.utils.utils import get_sample_id
 from src.layouts.config import BACKGROUND_IMAGES, COLORS, FONTS
 
 
@@ -28,7 +46,6 @@ def test_HTMLProcessor_call_with_params(html_processor_config_with_params):
 
 @pytest.mark.parametrize("bg_images,proba", [
     (BACKGROUND_IMAGES, 1),
-    ('bg_images', 1),
     (1, 1),
     (1, 0),
 ])
@@ -45,6 +62,19 @@ def test_get_bg_image(bg_images, proba):
         assert 'bg_image' in params
 
 
+def test_get_bg_image_from_store(tmp_path):
+    bg_images = tmp_path / 'bg_images'
+    bg_images.mkdir()
+    Image.new('RGB', (100, 50), 'red').save(bg_images / 'red.png')
+    processor = HTMLProcessor(config={'get_bg_image': {'bg_images': str(bg_images), 'sizes': [[40, 30]]}})
+    processor.build_assets()
+
+    params = processor.get_bg_image({}, str(bg_images), proba=1, sizes=[[40, 30]])
+
+    assert params['bg_image'] == ''
+    assert BackgroundStore(None, params['bg_store']).load().ids == [params['bg_image_id']]
+
+
 @pytest.mark.parametrize("colors", [COLORS, ['red', 'green', 'blue']])
 def test_get_colors(colors):
     processor = HTMLProcessor(config=None)
@@ -104,3 +134,177 @@ def test_get_highlight_params(colors, proba, highlight_padding_range, highlight_
     assert bool(params['highlight_rounding']) == bool(proba)
     if proba:
         assert params['bg_color'] != params['text_color'] != params['text_highlight_color']
+
+
+def test_page_params_round_trip():
+    params = {'font': 'Arial', 'font_size': 20, 'top': 10, 'left': 20}
+    text = 'Text with </script> inside'
+    page = f"<div id='Text'>{text}</div><script id='Params' type=\"application/json\">{dump_page_params(text, params)}</script>"
+
+    assert get_page_params(page) == {'text': text, **params}
+    with pytest.raises(ValueError):
+        get_page_params('<html></html>')
+
+
+def test_render_page():
+    params = {'text': 'Some <b>text</b>', 'font': 'Arial', 'font_size': 20, 'top': 10, 'left': 20, 'bg_image': ''}
+    page = render_page(params)
+
+    assert get_page_params(page) == params
+    assert 'font-size: 20px' in page
+
+
+def test_LayoutTable(tmp_path, monkeypatch):
+    storage = LocalStorage(str(tmp_path))
+    table = LayoutTable(storage, 'pages', cache_shards=1)
+    table.write([{'id': 0, 'text': 'a', 'font': 'Arial'}, {'id': 1, 'text': 'b', 'font': 'Verdana'}])
+
+    assert table.get(1) == {'text': 'b', 'font': 'Verdana'}
+    # Shards written later are found on a miss
+    table.write([{'id': 2, 'text': 'c', 'font': 'Arial'}])
+    assert table.get(2) == {'text': 'c', 'font': 'Arial'}
+    assert table.get(0) == {'text': 'a', 'font': 'Arial'}
+    assert len(table.shards) == 1
+
+    # Shard named along with the sample is read without listing the storage
+    shard_name = table.write([{'id': 3, 'text': 'd', 'font': 'Arial'}])
+    with monkeypatch.context() as m:
+        m.setattr(storage, 'read_all', lambda *args, **kwargs: pytest.fail('Storage is listed'))
+        assert table.get(3, shard_name) == {'text': 'd', 'font': 'Arial'}
+    assert get_layout_shard(get_layout_name(3, shard_name)) == shard_name
+    assert get_layout_shard('layout_3.json') is None
+
+    assert sorted(row['id'] for row in table) == [0, 1, 2, 3]
+    with pytest.raises(KeyError):
+        table.get(4)
+
+
+@pytest.mark.parametrize("layout_table", [True, False])
+def test_HTMLCreator_layout_table(tmp_path, layout_table):
+    storage_params = {'dataset_name': str(tmp_path)}
+    storage = LocalStorage(**storage_params)
+    storage.save_many([(f'text {i}', f'title_{i}.txt') for i in range(5)], 'texts')
+
+    creator = HTMLCreator('local', storage_params, layout_table=layout_table)
+    results = creator(
+        process_params={'processor_config': {'get_colors': {}, 'get_font': {}, 'get_text_position': {}}},
+        input_data_subdir='texts',
+        num_processes=2,
+        batch_size=2,
+    )
+
+    assert not [error for _, _, error in results if error]
+    outputs = sorted(name for _, outputs, _ in results for name in outputs)
+    if layout_table:
+        # Rows are buffered across batches, every worker saves one shard when it is done
+        shards = storage.read_all('pages')
+        assert 1 <= len(shards) <= 2
+        assert sorted(get_sample_id(name) for name in outputs) == list(range(5))
+        assert {get_layout_shard(name) for name in outputs} == set(shards)
+        table = LayoutTable(storage, 'pages')
+        assert [table.get(i)['text'] for i in range(5)] == [f'text {i}' for i in range(5)]
+        assert {'bg_color', 'font', 'top'} <= set(table.get(0))
+    else:
+        assert outputs == sorted(f'page_{i}.html' for i in range(5))
+
+
+def test_HTMLCreator_layout_table_shard_size(tmp_path):
+    storage_params = {'dataset_name': str(tmp_path)}
+    storage = LocalStorage(**storage_params)
+    storage.save_many([(f'text {i}', f'title_{i}.txt') for i in range(7)], 'texts')
+
+    creator = HTMLCreator('local', storage_params, layout_table=True, shard_size=3)
+    results = creator(
+        process_params={'processor_config': {'get_colors': {}, 'get_font': {}}},
+        input_data_subdir='texts',
+        num_processes=1,
+        batch_size=2,
+    )
+
+    assert not [error for _, _, error in results if error]
+    assert sorted(len(LayoutTable(storage, 'pages').read_shard(name)) for name in storage.read_all('pages')) == [1, 3, 3]
+
+
+def test_get_color_pairs():
+    colors = ('#000000', '#ffffff', '#777777', '#000000')
+
+    assert {tuple(pair) for pair in get_color_pairs(colors)} == {
+        (i, j) for i in range(4) for j in range(4) if colors[i] != colors[j]
+    }
+    assert all(get_contrast_ratio(colors[i], colors[j]) >= 4 for i, j in get_color_pairs(colors, min_contrast=4))
+    assert round(get_contrast_ratio('#000000', '#ffffff')) == 21
+    with pytest.raises(ValueError, match='There is no pair*'):
+        get_color_pairs(('#000000', '#010101'), min_contrast=4)
+
+
+def test_HTMLProcessor_sample_batch():
+    config = {
+        'get_bg_image': {'bg_images': BACKGROUND_IMAGES, 'proba': 0.5},
+        'get_colors': {'min_contrast': 4.5},
+        'get_font': {'font_size_range': (20, 40)},
+        'get_text_position': {},
+        'get_highlight_params': {'proba': 0.5, 'min_contrast': 3},
+    }
+    processor = HTMLProcessor(config=config)
+    batch = processor.sample_batch(500, seed=1)
+
+    assert len(batch) == 500
+    assert set(batch.dtype.names) == set(processor({}))
+    assert (batch['bg_color'] != batch['text_color']).all()
+    assert batch['font_size'].min() >= 20 and batch['font_size'].max() <= 40
+    assert set(batch['bg_image']) <= set(BACKGROUND_IMAGES) | {''}
+    highlighted = batch[batch['text_highlight_color'] != '']
+    assert 0 < len(highlighted) < 500
+    assert ((highlighted['text_highlight_color'] != highlighted['bg_color']) & (highlighted['text_highlight_color'] != highlighted['text_color'])).all()
+    for row in batch:
+        assert get_contrast_ratio(row['bg_color'], row['text_color']) >= 4.5
+        if row['text_highlight_color']:
+            assert get_contrast_ratio(row['text_highlight_color'], row['text_color']) >= 3
+            assert row['highlight_padding_height'] > 0
+    assert (processor.sample_batch(500, seed=1) == batch).all()
+
+    params_list = batch_to_params(batch)
+    assert [set(params) for params in params_list] == [set(processor({})) for _ in range(500)]
+    assert all(params['highlight_rounding'] == '' for params in params_list if not params['text_highlight_color'])
+
+
+def test_HTMLProcessor_sample_batch_from_store(tmp_path):
+    bg_images = tmp_path / 'bg_images'
+    bg_images.mkdir()
+    for color in ('red', 'blue'):
+        Image.new('RGB', (10, 10), color).save(bg_images / f'{color}.png')
+    processor = HTMLProcessor(config={'get_bg_image': {'bg_images': str(bg_images), 'proba': 0.5}})
+
+    params_list = batch_to_params(processor.sample_batch(100, seed=2))
+
+    store = BackgroundStore(None, str(bg_images / '.store')).load()
+    assert {params.get('bg_image_id') for params in params_list} == set(store.ids) | {None}
+    assert all(params['bg_store'] == store.store_dir for params in params_list if 'bg_image_id' in params)
+
+
+def test_HTMLCreator_fits_text(tmp_path):
+    storage_params = {'dataset_name': str(tmp_path)}
+    storage = LocalStorage(**storage_params)
+    storage.save_many([(f'Some text number {i} which is placed near the edge', f'title_{i}.txt') for i in range(10)], 'texts')
+
+    creator = HTMLCreator('local', storage_params, layout_table=True, seed=1)
+    creator.manifest_path = str(tmp_path / 'manifest.sqlite')
+    results = creator(
+        process_params={'processor_config': {
+            'get_colors': {},
+            'get_font': {'font_size_range': (30, 40)},
+            'get_text_position': {'top_range': (95, 100), 'left_range': (0, 5)},
+            'fit_text': {'width': 800, 'height': 600},
+        }},
+        input_data_subdir='texts',
+        num_processes=2,
+        batch_size=5,
+    )
+
+    assert not [error for _, _, error in results if error]
+    table = LayoutTable(storage, 'pages')
+    fitter = TextFitter()
+    for i in range(10):
+        params = table.get(i)
+        assert fitter.fits(fitter.measure(params, params['text']))
+    assert Manifest(creator.manifest_path).count('renders_saved') == 10
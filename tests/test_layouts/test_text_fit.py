@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from src.images.renderers import PillowRenderer
+from src.layouts.layouts_utils import HTMLProcessor
+from src.layouts.text_fit import TextFitter, count_lines
+
+
+TEXT = 'The quick brown fox jumps over the lazy dog and keeps running far away'
+
+
+def is_inside(coords, width=800, height=600):
+    return coords['left'] >= 0 and coords['top'] >= 0 and coords['left'] + coords['width'] <= width and coords['top'] + coords['height'] <= height
+
+
+def test_count_lines():
+    assert count_lines([10, 10, 10], 5, 39) == 2
+    assert count_lines([10, 10, 10], 5, 40) == 1
+    assert count_lines([10, 10, 10], 5, 9) == 3
+    assert count_lines([], 5, 100) == 0
+
+
+def test_TextFitter_measure_matches_renderer():
+    random.seed(0)
+    processor = HTMLProcessor({'get_colors': {}, 'get_font': {}, 'get_text_position': {}, 'get_highlight_params': {}})
+    fitter = TextFitter()
+    renderer = PillowRenderer()
+
+    mismatches = 0
+    for _ in range(50):
+        params = processor({})
+        estimated = fitter.measure(params, TEXT)
+        coords = renderer.layout({'text': TEXT, **params})['coords']
+        assert abs(estimated['width'] - coords['width']) <= 1
+        # Text as wide as available width may wrap differently, sum of glyph advances differs from its width by a bit
+        mismatches += any(abs(estimated[key] - coords[key]) > 1 for key in coords)
+    assert mismatches <= 2
+
+
+def test_TextFitter_call():
+    random.seed(1)
+    processor = HTMLProcessor({'get_colors': {}, 'get_font': {}, 'get_text_position': {'top_range': (0, 100), 'left_range': (0, 100)}})
+    fitter = TextFitter()
+    renderer = PillowRenderer()
+
+    clipped = 0
+    for _ in range(50):
+        params = processor({})
+        clipped += not is_inside(renderer.layout({'text': TEXT, **params})['coords'])
+        fitted = fitter(params, TEXT)
+        assert is_inside(renderer.layout({'text': TEXT, **fitted})['coords'])
+        assert fitted['font'] == params['font']
+
+    assert clipped > 0
+    assert fitter.renders_saved >= clipped
+    assert fitter.not_fitted == 0
+
+
+def test_TextFitter_keeps_fitting_params():
+    fitter = TextFitter()
+    params = {'font': 'Arial', 'font_size': 20, 'top': 50, 'left': 20}
+
+    assert fitter(params, 'Short text') is params
+    assert fitter.renders_saved == 0
+
+
+@pytest.mark.parametrize("text", [TEXT * 5, 'Unbreakablewordwhichisfartoolongtofitintothecanvasatthisfontsize'])
+def test_TextFitter_makes_text_smaller(text):
+    fitter = TextFitter()
+    params = {'font': 'Arial', 'font_size': 50, 'top': 50, 'left': 50}
+
+    fitted = fitter(params, text)
+
+    assert fitted['font_size'] < 50
+    assert fitter.fits(fitter.measure(fitted, text))
+    assert is_inside(PillowRenderer().layout({'text': text, **fitted})['coords'])
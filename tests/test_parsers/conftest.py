@@ -60,3 +60,13 @@ def text_processor_config_random(text_processor_config, r, num_choices):
     all_perms = list(permutations(config.items(), r))
     config_lst = [dict(random.choice(all_perms)) for _ in range(num_choices)]
     return config_lst
+
+
+@pytest.fixture
+def get_html():
+    return (
+        '<div class="mw-parser-output"><style>.hatnote{font-style:italic}</style>'
+        '<p>Zoë lives in <a href="/wiki/Paris">Paris</a>.<sup>[1]</sup> She said "Hi." Then  left?  Yes.</p>\n'
+        '<h2><span>History</span></h2>\n<p>{\\displaystyle x^2} is a formula &amp; a&nbsp;b.<br/>New line<br></br></p>'
+        '<h3>Unclosed header<p>Swallowed text.</p>\n<!-- comment --><pre>  </pre><p>A</p>   \n\n  '
+    )
@@ -0,0 +1,28 @@
+from src.parsers.cache import ResponseCache
+
+
+def test_put_and_get(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    cache.put('Page', 1, '<p>old</p>')
+    cache.put('Page', 2, '<p>new</p>')
+    cache.put('Other', 5, 'Some wikitext', kind='wikitext')
+
+    assert cache.get('Page') == ('<p>new</p>', 'html')
+    assert cache.get('Page', 1) == ('<p>old</p>', 'html')
+    assert cache.get('Other') == ('Some wikitext', 'wikitext')
+    assert cache.get('Missing') is None
+    assert cache.keys() == [('Page', 1), ('Page', 2), ('Other', 5)]
+    assert len(cache) == 3
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), evict_every=1000)
+    for i in range(10):
+        cache.put(f'Page {i}', 1, f'Content of page {i}')
+    cache.get('Page 0')
+
+    cache.max_size = cache.size() // 2
+    cache.evict()
+    assert cache.size() <= cache.max_size
+    assert cache.get('Page 0') is not None
+    assert cache.get('Page 1') is None
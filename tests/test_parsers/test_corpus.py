@@ -0,0 +1,114 @@
+import json
+import os
+
+import pytest
+
+from src.parsers.corpus import build_offsets, load_offsets
+from src.parsers.parser_utils import TextProcessor
+from src.parsers.parsers import LocalCorpusParser
+from src.utils.storage import LocalStorage
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    lines = [f'Document number {i} is here. It is document {i}.' for i in range(40)]
+    text_path = tmp_path / 'corpus.txt'
+    text_path.write_text('\n'.join(lines[:20]) + '\n\n', encoding='utf-8')
+    jsonl_path = tmp_path / 'corpus.jsonl'
+    jsonl_path.write_text('\n'.join(json.dumps({'id': i, 'text': line}) for i, line in enumerate(lines[20:])), encoding='utf-8')
+    return [str(text_path), str(jsonl_path)], lines
+
+
+def test_build_offsets(tmp_path):
+    path = tmp_path / 'lines.txt'
+    content = b'first\n\nsecond line\nthird'
+    path.write_bytes(content)
+
+    for chunk_size in (1, 4, 1 << 20):
+        offsets = build_offsets(str(path), chunk_size=chunk_size)
+        assert [content[start:end] for start, end in offsets] == [b'first', b'second line', b'third']
+
+
+def test_load_offsets_is_cached(tmp_path):
+    path = tmp_path / 'lines.txt'
+    path.write_bytes(b'a\nb\n')
+    index_dir = str(tmp_path / 'index')
+
+    assert len(load_offsets(str(path), index_dir)) == 2
+    index_files = os.listdir(index_dir)
+    assert len(index_files) == 2
+    assert len(load_offsets(str(path), index_dir)) == 2
+
+    path.write_bytes(b'a\nb\nc\n')
+    assert len(load_offsets(str(path), index_dir)) == 3
+    assert sorted(os.listdir(index_dir)) == sorted(index_files)
+
+
+def test_process_text():
+    config = {'remove_references': {}, 'split_into_sentences': {}, 'strip_sentences': {}, 'remove_short_sentences': {'min_len': 5}}
+    text = 'First sentence here [1]. Short. Second one?\nThird one'
+
+    assert TextProcessor(config).process_text(text) == ['First sentence here .', 'Short.', 'Second one?', 'Third one']
+    assert TextProcessor(config, engine='fast').process_text(text) == TextProcessor(config).process_text(text)
+
+
+@pytest.mark.parametrize('num_processes', [1, 2])
+def test_LocalCorpusParser_sequential(tmp_path, corpus, num_processes):
+    corpus_paths, lines = corpus
+    storage_params = {'dataset_name': str(tmp_path / 'dataset')}
+    parser = LocalCorpusParser('local', storage_params, corpus_paths, order='sequential', block_size=3, samples_per_page=2)
+
+    assert len(parser) == 40
+    assert parser.read_record(25) == lines[25]
+
+    results = parser(
+        process_params={'processor_config': {'strip_sentences': {}}, 'delay': 0},
+        dataset_size=90,
+        num_processes=num_processes,
+    )
+    storage = LocalStorage(**storage_params)
+    texts = storage.read_many(storage.read_all('texts'), 'texts')
+    expected = [sentence for i in range(40) for sentence in (f'Document number {i} is here.', f'It is document {i}.')]
+    # Every document is read once, ids left when the corpus is over are reported as failed
+    assert len(texts) == len(set(texts))
+    assert set(texts) <= set(expected)
+    errors = [error for _, _, error in results if error]
+    assert len(results) == 90
+    assert len(texts) + len(errors) == 90
+    assert all('corpus exhausted' in error for error in errors)
+    if num_processes == 1:
+        assert sorted(texts) == sorted(expected)
+
+
+def test_LocalCorpusParser_sequential_fills_every_id(tmp_path):
+    corpus_path = tmp_path / 'corpus.txt'
+    corpus_path.write_text('\n'.join(f'Document number {i}.' for i in range(60)), encoding='utf-8')
+    storage_params = {'dataset_name': str(tmp_path / 'dataset')}
+    parser = LocalCorpusParser('local', storage_params, str(corpus_path), order='sequential')
+
+    results = parser(
+        process_params={'processor_config': {'strip_sentences': {}}, 'delay': 0},
+        dataset_size=30,
+        num_processes=2,
+        file_names=list(range(30)),
+    )
+    storage = LocalStorage(**storage_params)
+    assert not [error for _, _, error in results if error]
+    assert len(storage.read_all('texts')) == 30
+
+
+def test_LocalCorpusParser_random(tmp_path, corpus):
+    corpus_paths, lines = corpus
+    storage_params = {'dataset_name': str(tmp_path / 'dataset')}
+    parser = LocalCorpusParser('local', storage_params, corpus_paths, index_dir=str(tmp_path / 'index'), samples_per_page=2)
+
+    results = parser(
+        process_params={'processor_config': {'strip_sentences': {}}, 'delay': 0},
+        dataset_size=30,
+        num_processes=2,
+    )
+    storage = LocalStorage(**storage_params)
+    assert not [error for _, _, error in results if error]
+    texts = storage.read_many(storage.read_all('texts'), 'texts')
+    assert len(texts) == 30
+    assert set(texts) <= {sentence for i in range(40) for sentence in (f'Document number {i} is here.', f'It is document {i}.')}
@@ -0,0 +1,58 @@
+from multiprocessing import Process, Queue
+import os
+
+import numpy as np
+import pytest
+
+from src.parsers.dedup import DedupIndex, MinHasher
+
+
+def test_MinHasher():
+    hasher = MinHasher(num_perm=128)
+    signature = hasher('The quick brown fox jumps over the lazy dog.')
+
+    assert signature.shape == (128,)
+    assert np.array_equal(signature, MinHasher(num_perm=128)('the quick  brown fox jumps over the lazy dog.'))
+    assert np.mean(signature == hasher('The quick brown fox jumps over the lazy dog!')) > 0.8
+    assert np.mean(signature == hasher('Completely different sentence about something else.')) < 0.2
+
+
+def test_DedupIndex(tmp_path):
+    path = str(tmp_path / 'dedup.sqlite')
+    index = DedupIndex(path)
+
+    assert index.add(0, 'The quick brown fox jumps over the lazy dog.')
+    assert not index.add(1, 'The quick brown fox jumps over the lazy dog!')
+    assert index.add(2, 'Completely different sentence about something else.')
+    # Text may be added again under its own key, e.g. when failed sample is parsed again
+    assert index.add(0, 'The quick brown fox jumps over the lazy dog.')
+    index.close()
+
+    index = DedupIndex(path)
+    assert len(index) == 2
+    assert not index.add(3, 'the quick brown fox jumps over the lazy dog.')
+    index.checkpoint()
+    assert os.path.getsize(f'{path}-wal') == 0
+    index.close()
+
+    with pytest.raises(ValueError, match='num_perm should be divisible by bands*'):
+        DedupIndex(path, num_perm=64, bands=10)
+
+
+def add_texts(index, texts, first_key, result_queue):
+    result_queue.put([text for key, text in enumerate(texts, first_key) if index.add(key, text)])
+
+
+def test_DedupIndex_is_shared_by_processes(tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.sqlite'))
+    texts = [f'Sentence {i} about the topic number {i}' for i in range(20)]
+    result_queue = Queue()
+    processes = [Process(target=add_texts, args=(index, texts, num * 100, result_queue)) for num in range(3)]
+    for pr in processes:
+        pr.start()
+    added = [text for _ in processes for text in result_queue.get()]
+    for pr in processes:
+        pr.join()
+
+    assert sorted(added) == sorted(set(added))
+    assert len(index) == len(added)
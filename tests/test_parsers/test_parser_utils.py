@@ -1,7 +1,7 @@
 from bs4 import BeautifulSoup
 import pytest
 
-from src.parsers.parser_utils import TextProcessor
+from src.parsers.parser_utils import TextExtractor, TextProcessor
 
 
 def test_fully_configured_TextProcessor_call(get_soup, text_processor_config):
@@ -120,3 +120,23 @@ def test_calc_probas():
 
     with pytest.raises(ValueError, match="You must calculate token counts before calculating probas*"):
         processor.calc_probas()
+
+
+@pytest.mark.parametrize("html", [
+    '<p>Caf&eacute; &amp; bar&nbsp;&copy &unknown; &#233; &#x263a; &#X263A; &#150; &#129; &#0; &#xd800; &#1114112; &#12ab &#x1fq</p>',
+    '<div>line<br>break<img src="a.png"/>after</div><pre>  kept\n  spaces </pre><textarea> a  b </textarea>',
+    '<p>text<script>var a = 1;</script><style>p {}</style><template>t</template>ruby<rt>annotation</rt><rp>(</rp></p>',
+    '<p>one<p>two</div>three<![CDATA[cdata]]><!-- comment --></p>',
+])
+def test_TextExtractor_matches_BeautifulSoup(html):
+    # Tag sets and reference rules follow BeautifulSoup html.parser builder, so any change in it shows up here
+    assert TextExtractor().extract(html) == BeautifulSoup(html, "html.parser").get_text()
+
+
+def test_fast_engine_matches_default(get_html, text_processor_config, text_processor_config_single_and_zero):
+    for config in [{}, text_processor_config] + text_processor_config_single_and_zero:
+        default_processor = TextProcessor(config=config)
+        fast_processor = TextProcessor(config=config, engine='fast')
+
+        assert fast_processor(get_html) == default_processor(get_html)
+        assert fast_processor(get_html) == default_processor(BeautifulSoup(get_html, "html.parser"))
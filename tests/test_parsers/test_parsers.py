@@ -1,7 +1,8 @@
 import pytest
 from bs4 import BeautifulSoup
 from src.utils.storage import LocalStorage
-from src.parsers.parsers import WikiParser
+from src.parsers import parsers
+from src.parsers.parsers import TokenDownsampler, WikiParser, YouTubeParser
 
 
 def test_get_random_wikipedia_title_and_get_sentences():
@@ -14,3 +15,183 @@ def test_get_random_wikipedia_title_and_get_sentences():
     soup = parser.get_soup(title)
     assert isinstance(title, str)
     assert isinstance(soup, BeautifulSoup)
+
+
+class FakeResponse:
+
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = {}
+
+
+    def raise_for_status(self):
+        pass
+
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """Answer generator=random queries with numbered articles"""
+
+    def __init__(self, throttle_every=None):
+        self.num_requests = 0
+        self.throttle_every = throttle_every
+
+
+    def get(self, url, params=None, timeout=None):
+        if self.throttle_every and self.num_requests % self.throttle_every == 0:
+            self.num_requests += 1
+            return FakeResponse({}, status_code=429)
+        pages = [
+            {'title': f'Article {self.num_requests}-{i}', 'revisions': [{'slots': {'main': {'content': f'Article {i} text.'}}}]}
+            for i in range(params['grnlimit'])
+        ]
+        self.num_requests += 1
+        return FakeResponse({'query': {'pages': pages}})
+
+
+def test_WikiParser_batched_fetching(tmp_path, monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(WikiParser, 'session', property(lambda self: session))
+    storage_params = {'dataset_name': str(tmp_path)}
+    parser = WikiParser('local', storage_params, pages_per_request=5, max_requests=2)
+
+    articles = parser.get_random_articles(100)
+    assert len(articles) == 50
+    assert articles[0] == ('Article 0-0', 'Article 0 text.')
+
+    results = parser(
+        process_params={'processor_config': {'strip_sentences': {}}, 'delay': 0},
+        dataset_size=12,
+        num_processes=1,
+    )
+    storage = LocalStorage(**storage_params)
+    assert not [error for _, _, error in results if error]
+    assert sorted(storage.read_all('texts')) == sorted(f'title_{i}.txt' for i in range(12))
+
+
+def test_WikiParser_replay(tmp_path, monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(WikiParser, 'session', property(lambda self: session))
+    cache_path = str(tmp_path / 'cache.sqlite')
+    WikiParser('local', {'dataset_name': str(tmp_path)}, pages_per_request=3, cache_path=cache_path).get_random_articles(3)
+
+    monkeypatch.setattr(WikiParser, 'session', property(lambda self: None))
+    storage_params = {'dataset_name': str(tmp_path / 'replay')}
+    parser = WikiParser('local', storage_params, cache_path=cache_path, replay=True)
+    results = parser(
+        process_params={'processor_config': {'strip_sentences': {}}, 'delay': 0},
+        dataset_size=6,
+        num_processes=2,
+    )
+    storage = LocalStorage(**storage_params)
+    assert not [error for _, _, error in results if error]
+    texts = [storage.read_file(f'title_{i}.txt', 'texts', file_type='text') for i in range(6)]
+    assert sorted(texts) == sorted([f'Article {i} text.' for i in range(3)] * 2)
+
+
+def test_WikiParser_retries_throttled_requests(tmp_path, monkeypatch):
+    session = FakeSession(throttle_every=2)
+    monkeypatch.setattr(WikiParser, 'session', property(lambda self: session))
+    parser = WikiParser('local', {'dataset_name': str(tmp_path)}, pages_per_request=2, rate_limit=1000, burst=10)
+
+    for _ in range(3):
+        assert len(parser.get_random_articles(2)) == 2
+    assert session.num_requests == 6
+    assert parser.rate_limiter.rate.value < 1000
+
+
+def test_TokenDownsampler(tmp_path):
+    storage_params = {'dataset_name': str(tmp_path)}
+    storage = LocalStorage(**storage_params)
+    file_names = [f'title_{i}.txt' for i in range(30)]
+    storage.save_many([(f'the the the word{i}', file_name) for i, file_name in enumerate(file_names)], 'texts')
+
+    downsampler = TokenDownsampler('local', storage_params, read_batch_size=4, tokenizer='regex')
+    token_counts, results = downsampler.count_tokens(file_names, num_processes=3)
+    assert not [error for _, _, error in results if error]
+    assert token_counts['the'] == 90
+    assert token_counts['word7'] == 1
+
+    results = downsampler.rewrite(file_names, token_counts, num_processes=3)
+    assert not [error for _, _, error in results if error]
+    texts = storage.read_many(file_names, 'texts')
+    # Rare tokens are never removed, the most frequent one is removed with probability > 0.95
+    assert all(text.split()[-1] == f'word{i}' for i, text in enumerate(texts))
+    assert sum(text.split().count('the') for text in texts) < 45
+
+
+def test_WikiParser_drops_duplicates(tmp_path, monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(WikiParser, 'session', property(lambda self: session))
+    cache_path = str(tmp_path / 'cache.sqlite')
+    WikiParser('local', {'dataset_name': str(tmp_path)}, pages_per_request=3, cache_path=cache_path).get_random_articles(3)
+
+    storage_params = {'dataset_name': str(tmp_path / 'replay')}
+    parser = WikiParser('local', storage_params, cache_path=cache_path, replay=True, dedup_path=str(tmp_path / 'dedup.sqlite'))
+    results = parser(
+        process_params={'processor_config': {'strip_sentences': {}}, 'delay': 0},
+        dataset_size=6,
+        num_processes=2,
+    )
+    storage = LocalStorage(**storage_params)
+    assert not [error for _, _, error in results if error]
+    texts = storage.read_many(storage.read_all('texts'), 'texts')
+    assert sorted(texts) == [f'Article {i} text.' for i in range(3)]
+
+
+class FakeYouTubeDriver:
+    """Search results page loading 4 more titles on every scroll, up to 10"""
+
+    def __init__(self):
+        self.urls = []
+        self.loaded = 0
+        self.quit_calls = 0
+
+
+    def get(self, url):
+        self.urls.append(url)
+        self.loaded = 4
+
+
+    def execute_script(self, script):
+        if script == YouTubeParser.SCROLL_SCRIPT:
+            self.loaded = min(self.loaded + 4, 10)
+            return None
+        query = self.urls[-1].split('=')[-1]
+        return [f'{query} video {i}' for i in range(self.loaded)] + ['']
+
+
+    def quit(self):
+        self.quit_calls += 1
+
+
+def test_YouTubeParser_reuses_driver(tmp_path, monkeypatch):
+    driver = FakeYouTubeDriver()
+    monkeypatch.setattr(parsers, 'set_driver', lambda driver_path: driver)
+    storage_params = {'dataset_name': str(tmp_path)}
+    parser = YouTubeParser('local', storage_params, driver_path=None, queries=['cats', 'dogs and birds'], max_titles=8, scroll_pause=0)
+
+    parser.process(file_names=range(20), subdir='texts', storage_type='local', storage_params=storage_params, chunk_num=0, delay=0)
+    parser.storage.close()
+
+    storage = LocalStorage(**storage_params)
+    assert len(driver.urls) == 2
+    assert driver.quit_calls == 1
+    assert sorted(storage.read_all('texts')) == sorted(f'title_{i}.txt' for i in range(16))
+    assert storage.read_file('title_9.txt', 'texts', file_type='text') == 'dogs+and+birds video 1'
+
+
+def test_YouTubeParser_collect(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsers, 'set_driver', lambda driver_path: FakeYouTubeDriver())
+    storage_params = {'dataset_name': str(tmp_path)}
+    parser = YouTubeParser('local', storage_params, driver_path=None, max_titles=12, scroll_pause=0)
+
+    results = parser.collect(['cats', 'dogs', 'birds'], num_processes=2, delay=0)
+    storage = LocalStorage(**storage_params)
+    assert not [error for _, _, error in results if error]
+    # Page stops loading new titles at 10
+    assert sorted(storage.read_all('texts')) == sorted(f'title_{q * 12 + i}.txt' for q in range(3) for i in range(10))
@@ -0,0 +1,106 @@
+import sys
+import types
+
+import nltk
+import pytest
+
+from src.parsers import tokenizers
+from src.parsers.parser_utils import TextProcessor
+from src.parsers.tokenizers import HFTokenizer, RegexTokenizer, ensure_nltk_resources, get_tokenizer
+
+
+def test_RegexTokenizer():
+    tokenizer = RegexTokenizer()
+
+    assert tokenizer.tokenize_many(["Don't stop, it's 3.5 km!", 'Ünïcode wörds']) == [
+        ["Don't", 'stop', ',', "it's", '3.5', 'km', '!'],
+        ['Ünïcode', 'wörds'],
+    ]
+    assert tokenizer.tokenize('') == []
+
+
+def test_get_tokenizer():
+    tokenizer = RegexTokenizer()
+
+    assert get_tokenizer(tokenizer) is tokenizer
+    assert isinstance(get_tokenizer('regex'), RegexTokenizer)
+    with pytest.raises(ValueError, match='tokenizer should be one of*'):
+        get_tokenizer('unknown')
+
+
+class FakeEncoding:
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+
+class FakeDecoder:
+
+    def decode(self, tokens):
+        return ''.join(tokens).replace('##', '')
+
+
+class FakeHFModel:
+    decoder = FakeDecoder()
+
+    @classmethod
+    def from_file(cls, path):
+        return cls()
+
+
+    def encode_batch(self, sentences, add_special_tokens=True):
+        return [FakeEncoding([f'##{i}' if i != 0 else word for i, word in enumerate(sentence.split())]) for sentence in sentences]
+
+
+def test_HFTokenizer(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'tokenizers', types.SimpleNamespace(Tokenizer=FakeHFModel))
+    tokenizer = get_tokenizer('tokenizer.json')
+
+    assert isinstance(tokenizer, HFTokenizer)
+    assert tokenizer.tokenize_many(['a b', 'c']) == [['a', '##1'], ['c']]
+    assert tokenizer.detokenize(['a', '##1']) == 'a1'
+
+
+def test_batch_token_counts_and_removal():
+    processor = TextProcessor(config=None, tokenizer='regex')
+    sentences = [f'the the the word{i}' for i in range(10)]
+
+    processor.update_token_counts(sentences)
+    processor.calc_probas()
+    sentences_new = processor.remove_frequent_tokens_many(sentences)
+
+    assert processor.token_counts['the'] == 30
+    assert processor.token_counts['word3'] == 1
+    assert all(sentence.split()[-1] == f'word{i}' for i, sentence in enumerate(sentences_new))
+    assert processor.remove_frequent_tokens('') == ''
+
+
+def fail_download(*args, **kwargs):
+    raise ValueError('No network')
+
+
+def test_ensure_nltk_resources(tmp_path, monkeypatch):
+    monkeypatch.setattr(nltk.data, 'path', list(nltk.data.path))
+    monkeypatch.setattr(nltk, 'download', fail_download)
+    monkeypatch.setattr(tokenizers, '_resolved_resources', set())
+    (tmp_path / 'tokenizers' / 'punkt_tab' / 'english').mkdir(parents=True)
+
+    ensure_nltk_resources({'punkt_tab': 'tokenizers/punkt_tab/english/'}, str(tmp_path))
+    assert nltk.data.path[0] == str(tmp_path)
+    assert 'tokenizers/punkt_tab/english/' in tokenizers._resolved_resources
+
+    with pytest.raises(LookupError, match='nltk resource "missing" is not found*'):
+        ensure_nltk_resources({'missing': 'corpora/missing'}, str(tmp_path))
+
+
+class MissingResourceTokenizer(RegexTokenizer):
+    resources = {'missing': 'corpora/missing'}
+
+
+def test_TextProcessor_checks_resources_of_enabled_methods(monkeypatch):
+    monkeypatch.setattr(nltk, 'download', fail_download)
+    tokenizer = MissingResourceTokenizer()
+
+    TextProcessor(config={'strip_sentences': {}}, tokenizer=tokenizer).ensure_resources()
+    with pytest.raises(LookupError):
+        TextProcessor(config={'update_token_counts': {}}, tokenizer=tokenizer).ensure_resources()
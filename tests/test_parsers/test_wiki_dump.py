@@ -0,0 +1,90 @@
+import bz2
+import pytest
+
+from src.utils.storage import LocalStorage
+
+from src.parsers.parsers import WikiDumpParser
+from src.parsers.wiki_dump import get_byte_ranges, get_stream_offsets, iter_articles, wikitext_to_html
+
+
+def make_page(num, ns=0, redirect=False):
+    redirect_tag = '<redirect title="Other" />' if redirect else ''
+    return (
+        f'<page><title>Article {num}</title><ns>{ns}</ns><id>{num}</id>{redirect_tag}'
+        f'<revision><text xml:space="preserve">{{{{Infobox}}}}Article number {num} is about [[Topic|things]].\n'
+        f'== Section ==\nSecond paragraph of article {num}.</text></revision></page>\n'
+    )
+
+
+@pytest.fixture
+def multistream_dump(tmp_path):
+    """Dump of 3 streams with 3 articles each, a talk page and a redirect, and its index file"""
+    streams = [bz2.compress(b'<mediawiki><siteinfo><sitename>Wikipedia</sitename></siteinfo>\n')]
+    for stream_num in range(3):
+        pages = ''.join(make_page(stream_num * 3 + i) for i in range(3))
+        if stream_num == 1:
+            pages += make_page(100, ns=1) + make_page(101, redirect=True)
+        streams.append(bz2.compress(pages.encode('utf-8')))
+    streams.append(bz2.compress(b'</mediawiki>'))
+
+    dump_path = tmp_path / 'pages-articles-multistream.xml.bz2'
+    index_path = tmp_path / 'pages-articles-multistream-index.txt'
+    offsets = []
+    with open(dump_path, 'wb') as dump, open(index_path, 'w') as index:
+        for stream in streams:
+            offsets.append(dump.tell())
+            index.write(f'{dump.tell()}:1:Title\n')
+            dump.write(stream)
+    return str(dump_path), str(index_path), offsets
+
+
+def test_get_stream_offsets(multistream_dump):
+    dump_path, index_path, offsets = multistream_dump
+    assert get_stream_offsets(dump_path) == offsets
+    assert get_stream_offsets(dump_path, index_path) == offsets
+    assert get_stream_offsets(dump_path, chunk_size=7) == offsets
+
+
+@pytest.mark.parametrize("range_size", [1, 10 ** 6])
+def test_iter_articles(multistream_dump, range_size):
+    dump_path, _, offsets = multistream_dump
+    ranges = get_byte_ranges(offsets, offsets[-1] + 100, range_size)
+    titles = [title for start, end in ranges for title, _ in iter_articles(dump_path, start, end)]
+
+    assert len(ranges) == (len(offsets) if range_size == 1 else 1)
+    assert titles == [f'Article {i}' for i in range(9)]
+
+
+def test_wikitext_to_html():
+    html = wikitext_to_html("{{Infobox|a={{b}}}}Text with [[Link|label]], [[Plain]] and [http://x.org site].<ref>cite</ref>\n"
+                            "[[File:a.png|thumb|caption with [[link]]]]\n== History ==\n'''Bold''' text")
+
+    assert html == '<p>Text with label, Plain and site.</p>\n<h2>History</h2>\n<p>Bold text</p>'
+
+
+@pytest.mark.parametrize("num_processes,samples_per_page", [(1, 1), (2, 1), (1, 2), (2, 2)])
+def test_WikiDumpParser_call(multistream_dump, tmp_path, num_processes, samples_per_page):
+    dump_path, index_path, _ = multistream_dump
+    storage_params = {'dataset_name': str(tmp_path / 'dataset')}
+    parser = WikiDumpParser('local', storage_params, dump_path=dump_path, index_path=index_path, range_size=1, samples_per_page=samples_per_page)
+    results = parser(
+        process_params={'processor_config': {'remove_section_headers': {}, 'strip_sentences': {}}},
+        dataset_size=20,
+        num_processes=num_processes,
+        batch_size=2,
+    )
+
+    saved = [file_name for _, outputs, _ in results for file_name in outputs]
+    storage = LocalStorage(**storage_params)
+    texts = [storage.read_file(file_name, 'texts', file_type='text') for file_name in saved]
+    # Ids left when the dump is over are reported as failed
+    errors = [error for _, _, error in results if error]
+    assert len(texts) + len(errors) == 20
+    assert all('corpus exhausted' in error for error in errors)
+    sentences = {f'Article number {i} is about things.' for i in range(9)} | {f'Second paragraph of article {i}.' for i in range(9)}
+
+    # Every sentence is used once. Worker running out of ids drops the rest of its byte range
+    assert len(set(texts)) == len(texts)
+    assert set(texts) <= sentences
+    if num_processes == 1:
+        assert len(texts) == 9 * samples_per_page
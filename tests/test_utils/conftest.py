@@ -3,7 +3,7 @@ from moto import mock_aws
 from contextlib import contextmanager
 import pytest
 from dotenv import load_dotenv
-from src.utils.storage import S3Storage
+from src.utils.storage import S3Storage, ShardStorage
 load_dotenv()
 
 
@@ -33,8 +33,14 @@ def s3_storage(strategy):
     ("s3", "skip", False),
     ("s3", "raise", True),
     ("s3", "invalid", False),
+    ("shard", "rewrite", False),
+    ("shard", "skip", False),
+    ("shard", "raise", False),
+    ("shard", "invalid", False),
+    ("shard_s3", "rewrite", False),
+    ("shard_s3", "skip", False),
 ])
-def temp_storage(request, local_storage):
+def temp_storage(request, local_storage, tmp_path):
     backend, strategy, get_urls = request.param
     if backend == "local":
         storage_cls, storage_params = local_storage
@@ -46,3 +52,19 @@ def temp_storage(request, local_storage):
             storage_cls, storage_params = storage_tpl
             storage = storage_cls(**storage_params)
             yield storage, get_urls
+    elif backend == "shard":
+        storage_cls, storage_params = local_storage
+        storage = ShardStorage(storage_params['dataset_name'], shard_size=1024, file_exists_strategy=strategy)
+        yield storage, get_urls
+    elif backend == "shard_s3":
+        with s3_storage(strategy) as storage_tpl:
+            _, storage_params = storage_tpl
+            storage = ShardStorage(
+                storage_params['dataset_name'],
+                destination='S3',
+                destination_params={'client_config': storage_params['client_config']},
+                shard_size=1024,
+                tmp_dir=str(tmp_path),
+                file_exists_strategy=strategy,
+            )
+            yield storage, get_urls
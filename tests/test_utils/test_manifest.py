@@ -0,0 +1,54 @@
+import os
+from multiprocessing import Process
+import pytest
+from src.utils.manifest import Manifest
+
+
+def add_samples(path, sample_ids, stage):
+    manifest = Manifest(path, flush_every=3)
+    for sample_id in sample_ids:
+        manifest.add(sample_id, stage)
+    manifest.close()
+
+
+def test_manifest_add_and_count(tmp_path):
+    manifest = Manifest(os.path.join(tmp_path, 'manifest.sqlite'), flush_every=2)
+    assert manifest.is_empty()
+
+    for sample_id in (0, 1, 2, 2):
+        manifest.add(sample_id, 'texts')
+    manifest.add_many([0, 2], 'pages')
+
+    assert manifest.completed('texts') == {0, 1, 2}
+    assert manifest.count('texts') == 3
+    assert manifest.count('pages') == 2
+    assert manifest.count('images') == 0
+    assert manifest.orphans('texts', 'pages') == [1]
+
+    manifest.add_count('renders_saved', 2)
+    manifest.add_count('renders_saved', 3)
+    assert manifest.count('renders_saved') == 5
+
+
+def test_manifest_is_shared_by_processes(tmp_path):
+    path = os.path.join(tmp_path, 'manifest.sqlite')
+    manifest = Manifest(path)
+    manifest.add_many([100], 'texts')
+
+    processes = [Process(target=add_samples, args=(path, range(i, 40, 4), 'texts')) for i in range(4)]
+    for pr in processes:
+        pr.start()
+    for pr in processes:
+        pr.join()
+
+    assert manifest.count('texts') == 41
+    assert manifest.completed('texts') == set(range(40)) | {100}
+
+
+@pytest.mark.parametrize("sample_ids,expected", [([], []), ([5, 3], [3, 5])])
+def test_manifest_orphans(tmp_path, sample_ids, expected):
+    manifest = Manifest(os.path.join(tmp_path, 'manifest.sqlite'))
+    manifest.add_many(sample_ids + [1], 'pages')
+    manifest.add_many([1, 2], 'images')
+
+    assert manifest.orphans('pages', 'images') == expected
@@ -0,0 +1,37 @@
+from multiprocessing import Process
+import time
+
+from src.utils.rate_limiter import RateLimiter
+
+
+def take_tokens(rate_limiter, num_tokens):
+    for _ in range(num_tokens):
+        rate_limiter.acquire()
+
+
+def test_rate_is_shared_by_processes():
+    rate_limiter = RateLimiter(rate=100, burst=1)
+    start = time.monotonic()
+    processes = [Process(target=take_tokens, args=(rate_limiter, 10)) for _ in range(3)]
+    for pr in processes:
+        pr.start()
+    for pr in processes:
+        pr.join()
+
+    # 30 requests at 100 per second with burst of 1 take about 0.29 s however many processes there are
+    assert 0.25 < time.monotonic() - start < 1.5
+
+
+def test_report_adjusts_rate():
+    rate_limiter = RateLimiter(rate=100, burst=5, min_rate=10)
+    rate_limiter.report(throttled=True)
+    assert rate_limiter.rate.value == 50
+    assert rate_limiter.tokens.value < 0
+
+    for _ in range(5):
+        rate_limiter.report(throttled=True)
+    assert rate_limiter.rate.value == 10
+
+    for _ in range(100):
+        rate_limiter.report(throttled=False)
+    assert rate_limiter.rate.value == 100
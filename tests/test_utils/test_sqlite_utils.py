@@ -0,0 +1,51 @@
+from multiprocessing import Process, Queue
+
+from src.utils import sqlite_utils
+from src.utils.sqlite_utils import ProcessConnection, connect
+
+
+def report_inherited(connection, result_queue):
+    result_queue.put(any(inherited is connection for inherited in sqlite_utils._inherited_connections))
+
+
+def test_forked_process_keeps_inherited_connections(tmp_path):
+    connection = connect(str(tmp_path / 'db' / 'test.sqlite'))
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    result_queue = Queue()
+    pr = Process(target=report_inherited, args=(connection, result_queue))
+    pr.start()
+    assert result_queue.get(timeout=10)
+    pr.join()
+
+
+def count_rows(db, result_queue):
+    inherited = db._connection
+    connection = db.get()
+    result_queue.put((connection is not inherited, connection.execute('SELECT COUNT(*) FROM items').fetchone()[0]))
+    db.close()
+
+
+def test_process_connection_opens_own_connection_in_forked_process(tmp_path):
+    def create_tables(connection):
+        connection.execute('CREATE TABLE IF NOT EXISTS items (key INTEGER PRIMARY KEY)')
+        connection.commit()
+
+    db = ProcessConnection(str(tmp_path / 'test.sqlite'), setup=create_tables)
+    assert not db.is_open
+    with db.get() as connection:
+        connection.execute('INSERT INTO items VALUES (1)')
+    assert db.is_open and db.get() is connection
+
+    result_queue = Queue()
+    pr = Process(target=count_rows, args=(db, result_queue))
+    pr.start()
+    assert result_queue.get(timeout=10) == (True, 1)
+    pr.join()
+
+    # Closing in the child leaves connection of the parent working
+    assert db.is_open
+    assert connection.execute('SELECT COUNT(*) FROM items').fetchone()[0] == 1
+    db.checkpoint()
+    db.close()
+    assert not db.is_open
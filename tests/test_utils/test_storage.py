@@ -1,7 +1,8 @@
 from PIL import Image
 from io import BytesIO
+from multiprocessing import Process
 import pytest
-from src.utils.storage import Storage
+from src.utils.storage import ShardStorage, Storage
 
 
 def test_storage_init():
@@ -140,3 +141,120 @@ def test_read_all_and_delete(temp_storage):
 
     files_empty = storage.read_all(subdir)
     assert not files_empty
+
+
+@pytest.mark.parametrize("temp_storage", [
+    ("local", "rewrite", False),
+    ("local", "skip", False),
+    ("s3", "rewrite", False),
+    ("s3", "skip", False),
+], indirect=True)
+def test_save_many_and_read_many(temp_storage):
+    storage, _ = temp_storage
+    subdir = 'texts_many'
+
+    storage.save_file('Initial content', 'test_0.txt', subdir)
+    items = [(f'text {i}', f'test_{i}.txt') for i in range(5)]
+    storage.save_many(items, subdir)
+
+    file_names = [file_name for _, file_name in items]
+    texts = storage.read_many(file_names, subdir)
+    assert texts[1:] == [text for text, _ in items[1:]]
+    if storage.strategy == 'rewrite':
+        assert texts[0] == 'text 0'
+    else:
+        assert texts[0] == 'Initial content'
+
+    exists = storage.exists_many(file_names + ['missing.txt'], subdir)
+    assert exists == [True] * 5 + [False]
+
+
+@pytest.mark.parametrize("temp_storage", [("local", "raise", False), ("s3", "raise", False)], indirect=True)
+def test_save_many_raise(temp_storage):
+    storage, _ = temp_storage
+
+    storage.save_file('Initial content', 'test_1.txt', 'texts_many')
+    with pytest.raises(FileExistsError, match='File "test_1.txt" already exists*'):
+        storage.save_many([('a', 'test_0.txt'), ('b', 'test_1.txt')], 'texts_many')
+
+
+@pytest.mark.parametrize("strict_exists_check", [True, False])
+def test_existence_index(local_storage, strict_exists_check, monkeypatch):
+    storage_cls, storage_params = local_storage
+    storage = storage_cls(**storage_params, strict_exists_check=strict_exists_check)
+    storage.strategy = 'skip'
+    storage.save_file('Initial content', 'test_0.txt', 'texts')
+
+    checks = []
+    check_file_exists = storage.check_file_exists
+    monkeypatch.setattr(storage, 'check_file_exists', lambda *args: checks.append(args) or check_file_exists(*args))
+
+    for i in range(3):
+        storage.save_file(f'text {i}', f'test_{i}.txt', 'texts')
+    storage.delete_file('test_1.txt', 'texts')
+    storage.save_file('New content', 'test_1.txt', 'texts')
+
+    assert storage.read_many(['test_0.txt', 'test_1.txt', 'test_2.txt'], 'texts') == ['Initial content', 'New content', 'text 2']
+    if strict_exists_check:
+        assert len(checks) == 5
+    else:
+        # Only delete_file asks storage, saves are resolved from the index
+        assert checks == [('test_1.txt', 'texts')]
+
+
+@pytest.mark.parametrize("temp_storage", [("shard", "rewrite", False), ("shard_s3", "rewrite", False)], indirect=True)
+def test_shard_storage_is_shared_after_close(temp_storage):
+    """Files written by one instance are readable by another one from the destination"""
+    storage, _ = temp_storage
+
+    for i in range(20):
+        storage.save_file(f'text {i}' * 20, f'title_{i}.txt', 'texts')
+        storage.save_file(Image.new(mode='RGB', size=(10, 10), color='red'), f'image_{i}.png', 'images')
+    storage.save_file('Rewritten', 'title_3.txt', 'texts')
+    storage.delete_file('title_4.txt', 'texts')
+    storage.close()
+
+    # New instance sees only what was put to the destination
+    reader = ShardStorage(storage.shards_dir)
+    reader.destination = storage.destination
+
+    assert len(reader.read_all('texts')) == 19
+    assert reader.read_file('title_3.txt', 'texts') == 'Rewritten'
+    assert reader.read_file('title_7.txt', 'texts') == 'text 7' * 20
+    assert reader.read_file('image_5.png', 'images', file_type='image').size == (10, 10)
+    assert not reader.check_file_exists('title_4.txt', 'texts')
+
+
+def write_shard_files(dataset_name):
+    # Storage is left open, like storages of running streaming workers
+    storage = ShardStorage(dataset_name, shard_size=1 << 20)
+    for i in range(3):
+        storage.save_file(f'text {i}', f'title_{i}.txt', 'texts')
+
+
+def test_shard_storage_is_shared_before_close(tmp_path):
+    """Files of open local shards are readable by other processes, so streaming stages can use shard storage"""
+    dataset_name = str(tmp_path / 'dataset')
+    pr = Process(target=write_shard_files, args=(dataset_name,))
+    pr.start()
+    pr.join()
+
+    reader = ShardStorage(dataset_name)
+    assert reader.shares_open_shards
+    assert reader.check_file_exists('title_1.txt', 'texts')
+    assert reader.read_file('title_2.txt', 'texts') == 'text 2'
+    assert sorted(reader.read_all('texts')) == ['title_0.txt', 'title_1.txt', 'title_2.txt']
+
+
+@pytest.mark.parametrize("temp_storage", [("shard_s3", "rewrite", False)], indirect=True)
+def test_remote_shard_storage_is_not_shared_before_close(temp_storage):
+    storage, _ = temp_storage
+    storage.shard_size = 1 << 20
+    storage.save_file('text', 'title_0.txt', 'texts')
+
+    reader = ShardStorage(storage.shards_dir)
+    reader.destination = storage.destination
+    assert not storage.shares_open_shards
+    assert not reader.check_file_exists('title_0.txt', 'texts')
+    storage.close()
+    assert reader.check_file_exists('title_0.txt', 'texts')
@@ -1,5 +1,25 @@
+from multiprocessing import Queue
 import pytest
-from src.utils.utils import generate_ui_script
+from src.utils.scheduler import ResultCollector
+from src.utils.utils import DataCreator, DatasetFactory, generate_ui_script
+
+
+class UpperCaseCreator(DataCreator):
+
+    def process(self, file_names, subdir, input_data_subdir, storage_type, storage_params, input_queue=None, **kwargs):
+        storage = DatasetFactory.get_storage(storage_type)(**storage_params)
+        for file_name in self.iter_file_names(file_names, input_queue):
+            text = storage.read_file(file_name, input_data_subdir)
+            if text == 'broken':
+                raise ValueError(f'Can not process {file_name}')
+            storage.save_file(text.upper(), file_name, subdir)
+            self.emit(file_name)
+
+
+class BrokenSetupCreator(DataCreator):
+
+    def process(self, input_queue=None, **kwargs):
+        raise RuntimeError('Driver is not available')
 
 
 @pytest.mark.parametrize("images_path,boxes_path,texts_path", [
@@ -10,3 +30,73 @@ def test_generate_ui_script(images_path, boxes_path, texts_path):
 
     script = generate_ui_script(images_path, boxes_path, texts_path)
     assert 'placeholder' not in script
+
+
+def test_DataCreator_streaming(local_storage):
+    storage_cls, storage_params = local_storage
+    storage = storage_cls(**storage_params)
+    for i in range(10):
+        storage.save_file(f'text {i}', f'title_{i}.txt', 'texts')
+
+    queue = Queue(maxsize=2)
+    first_stage = UpperCaseCreator('local', storage_params, subdir='upper')
+    second_stage = UpperCaseCreator('local', storage_params, subdir='final')
+
+    consumers = second_stage.start({}, input_data_subdir='upper', num_processes=2, input_queue=queue)
+    producers = first_stage.start({}, input_data_subdir='texts', num_processes=3, output_queue=queue)
+    for pr in producers:
+        pr.join()
+    for _ in consumers:
+        queue.put(None)
+    for pr in consumers:
+        pr.join()
+
+    assert sorted(storage.read_all('final')) == sorted(storage.read_all('texts'))
+    assert storage.read_file('title_3.txt', 'final') == 'TEXT 3'
+
+
+def test_DataCreator_streaming_into_stage_failing_setup(local_storage):
+    storage_cls, storage_params = local_storage
+    storage = storage_cls(**storage_params)
+    for i in range(20):
+        storage.save_file(f'text {i}', f'title_{i}.txt', 'texts')
+
+    queue = Queue(maxsize=2)
+    result_queue = Queue()
+    collector = ResultCollector(result_queue)
+    collector.start()
+    first_stage = UpperCaseCreator('local', storage_params, subdir='upper')
+    second_stage = BrokenSetupCreator('local', storage_params, subdir='final')
+
+    consumers = second_stage.start({}, num_processes=2, input_queue=queue, result_queue=result_queue)
+    producers = first_stage.start({}, input_data_subdir='texts', num_processes=2, batch_size=1, output_queue=queue)
+    for pr in producers:
+        pr.join(timeout=30)
+        assert not pr.is_alive()
+    for _ in consumers:
+        queue.put(None)
+    for pr in consumers:
+        pr.join(timeout=30)
+        assert not pr.is_alive()
+
+    results = collector.stop()
+    assert sorted(file_name for file_name, _, _ in results) == sorted(storage.read_all('texts'))
+    assert all('Driver is not available' in error for _, _, error in results)
+
+
+@pytest.mark.parametrize("num_processes,batch_size", [(1, 1), (3, 2), (4, 100)])
+def test_DataCreator_call_reports_results(local_storage, num_processes, batch_size):
+    storage_cls, storage_params = local_storage
+    storage = storage_cls(**storage_params)
+    for i in range(10):
+        text = 'broken' if i in (2, 7) else f'text {i}'
+        storage.save_file(text, f'title_{i}.txt', 'texts')
+
+    creator = UpperCaseCreator('local', storage_params, subdir='upper')
+    results = creator({}, input_data_subdir='texts', num_processes=num_processes, batch_size=batch_size)
+
+    assert len(results) == 10
+    failed = sorted(file_name for file_name, _, error in results if error)
+    assert failed == ['title_2.txt', 'title_7.txt']
+    assert all(outputs == [file_name] for file_name, outputs, error in results if not error)
+    assert len(storage.read_all('upper')) == 8